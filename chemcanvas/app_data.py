@@ -57,6 +57,8 @@ class Settings:
     page_grid_major_every = 5
     autosave = True
     autosave_interval = 60 # seconds
+    # zoom (%) below which molecules are drawn in less detail, see Canvas.set_zoom()
+    lod_zoom_thresholds = (50, 30)
 
 # initialize Settings with Default values. (subclassing 'Default' class does not work properly)
 for key,val in dict(vars(Default)).items():
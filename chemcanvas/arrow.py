@@ -400,7 +400,7 @@ class Arrow(DrawableObject):
             self.canvas.removeItem(self._selection_item)
             self._selection_item = None
 
-    def bounding_box(self):
+    def calc_bounding_box(self):
         bboxes = []
         for item in self._main_items:
             bboxes.append(self.canvas.itemBoundingBox(item))
@@ -410,15 +410,19 @@ class Arrow(DrawableObject):
 
     def move_by(self, dx, dy):
         self.points = [(pt[0]+dx,pt[1]+dy) for pt in self.points]
+        self.invalidate_bounding_box()
 
     def scale(self, scale):
         self.scale_val *= scale
+        self.invalidate_bounding_box()
 
     def transform(self, tr):
         self.points = tr.transform_points(self.points)
+        self.invalidate_bounding_box()
 
     def transform_3D(self, tr):
         self.points = [tr.transform(*pt,0)[:2] for pt in self.points]
+        self.invalidate_bounding_box()
 
 
 
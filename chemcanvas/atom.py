@@ -8,14 +8,18 @@ import operator
 import re
 
 from app_data import App, Settings, periodic_table, auto_hydrogen_elements
-from drawing_parents import DrawableObject, Color, Font, Align
+from drawing_parents import (DrawableObject, Color, Font, Align,
+                            shared_style, style_property, style_class)
 from graph import Vertex
-from common import find_matching_parentheses, list_difference
+from common import find_matching_parentheses, list_difference, lru_cached
 import geometry as geo
+from tool_helpers import get_crowding_angles
 
 global atom_id_no
 atom_id_no = 1
 
+AtomStyle = style_class("AtomStyle", ("font_name", "font_size", "radical_size", "color"))
+
 
 class Atom(Vertex, DrawableObject):
     focus_priority = 5
@@ -28,8 +32,23 @@ class Atom(Vertex, DrawableObject):
             "_text", "text_layout", "_alignment", "show_symbol", "visible", "color")
     meta__undo_copy = ("_neighbors",)
     meta__scalables = ("x", "y", "z")
+    # slots keep memory usage low in large documents
+    __slots__ = ("canvas", "x", "y", "z", "molecule", "symbol", "is_group", "isotope",
+            "oxidation_num", "charge", "lonepairs", "lonepair_type", "radical",
+            "valency", "occupied_valency", "hydrogens", "auto_hydrogens",
+            "show_symbol", "visible", "_hydrogens_text", "hydrogen_pos", "marks_pos",
+            "_text", "text_layout", "_alignment", "id", "_style", "circle_charge", "_bbox",
+            "_main_items", "_mark_items", "_focusable_item", "_focus_item", "_selection_item")
+
+    # drawing style shared among atoms (see AtomStyle)
+    font_name = style_property("font_name")
+    font_size = style_property("font_size")
+    radical_size = style_property("radical_size")
+    color = style_property("color")
 
     def __init__(self, symbol='C'):
+        self._style = shared_style(AtomStyle(Settings.atom_font_name,
+                    Settings.atom_font_size, Settings.electron_dot_size, (0,0,0)))
         DrawableObject.__init__(self)
         Vertex.__init__(self)
         self.x, self.y = None, None
@@ -67,9 +86,6 @@ class Atom(Vertex, DrawableObject):
         self.id = 'a' + str(atom_id_no)
         atom_id_no += 1
         # drawing related
-        self.font_name = Settings.atom_font_name
-        self.font_size = Settings.atom_font_size
-        self.radical_size = Settings.electron_dot_size
         self.circle_charge = False
         self._main_items = [] # symbol + hydrogen + isotope
         self._mark_items = []
@@ -105,6 +121,21 @@ class Atom(Vertex, DrawableObject):
 
     def set_pos(self, x, y):
         self.x, self.y = x, y
+        self.on_geometry_change()
+
+    def on_geometry_change(self):
+        """ must be called when atom coordinates are changed """
+        self.invalidate_bounding_box()
+        if self.molecule:
+            self.molecule.geometry_version += 1
+            self.molecule.on_atoms_moved((self,))
+
+    def on_chemistry_change(self):
+        """ must be called when symbol, charge, isotope or hydrogens are changed """
+        self.invalidate_bounding_box()
+        if self.molecule:
+            self.molecule.topology_version += 1
+            self.molecule.on_atoms_changed((self,))
 
     def set_symbol(self, symbol):
         """ Atom type is changed. Text and valency need to be updated """
@@ -118,6 +149,7 @@ class Atom(Vertex, DrawableObject):
         self.auto_hydrogens = True
         self.hydrogens = 0
         self._update_valency()# also updates hydrogen count
+        self.on_chemistry_change()
 
 
     def set_hydrogens(self, count):
@@ -131,12 +163,14 @@ class Atom(Vertex, DrawableObject):
                 self.hydrogen_pos = None
         self.update_occupied_valency()
         self._update_hydrogens()
+        self.on_chemistry_change()
 
     def set_oxidation_num(self, num):
         self.oxidation_num = num
 
     def set_charge(self, val):
         self.charge = val
+        self.on_chemistry_change()
 
     def set_lonepairs(self, count):
         self.lonepairs = count
@@ -222,6 +256,9 @@ class Atom(Vertex, DrawableObject):
 
     def _draw_visible_atom(self):
         font = Font(self.font_name, self.font_size*self.molecule.scale_val)
+        if self.canvas.detail_level>=2:
+            self._draw_label_box(self.symbol, Align.HCenter, 0, font)
+            return
         # draw symbol
         symbol_item = self.canvas.addChemicalFormula(html_formula(self.symbol),
             (self.x, self.y), Align.HCenter, 0, font, color=self.color)
@@ -255,14 +292,33 @@ class Atom(Vertex, DrawableObject):
         if self._text == None:
             self._update_text()
         offset = self.canvas.getCharWidth(self.symbol[0], font)/2
+        if self.canvas.detail_level>=2:
+            self._draw_label_box(self._text, self._alignment, offset, font)
+            return
         self._main_items = [self.canvas.addChemicalFormula(html_formula(self._text),
             (self.x, self.y), self._alignment, offset, font, color=self.color)]
         rect = self.canvas.itemBoundingBox(self._main_items[0])
         self._focusable_item = self.canvas.addRect(rect, color=Color.transparent)
 
 
+    def _draw_label_box(self, text, align, offset, font):
+        """ draws a box in place of text, used when zoomed out """
+        w, h = self.canvas.getTextWidth(text, font), 0.8*font.size
+        if align == Align.HCenter:
+            x = self.x - w/2
+        elif align == Align.Left:
+            x = self.x - offset
+        else:
+            x = self.x - w + offset
+        rect = x, self.y-h/2, x+w, self.y+h/2
+        self._main_items = [self.canvas.addRect(rect, color=self.color, fill=self.color)]
+        self._focusable_item = self.canvas.addRect(rect, color=Color.transparent)
+
+
     def _draw_marks(self):
         self._decide_marks_pos()
+        if self.canvas.detail_level>=1:
+            return
         ax, ay, scale = self.x, self.y, self.molecule.scale_val
         abs_pos = [(ax+dx*scale, ay+dy*scale) for dx,dy in self.marks_pos]
         pos_i = 0
@@ -334,7 +390,7 @@ class Atom(Vertex, DrawableObject):
         return self.marks_pos[-count:]
 
 
-    def bounding_box(self):
+    def calc_bounding_box(self):
         """returns the bounding box of the object as a list of [x1,y1,x2,y2]"""
         if self._main_items:
             return self.canvas.itemBoundingBox(self._main_items[0])
@@ -368,11 +424,14 @@ class Atom(Vertex, DrawableObject):
 
     def move_by(self, dx, dy):
         self.x, self.y = self.x+dx, self.y+dy
+        self.on_geometry_change()
 
 
     def update_occupied_valency(self):
         """ occupied_valency is updated when new bond is added or removed,
         bond order is changed or explicit hydrogen count is changed """
+        if self.molecule and self.molecule.queue_atom_update(self):
+            return
         occupied_valency = 0 if self.auto_hydrogens else self.hydrogens
         for bond in self.bonds:
             occupied_valency += bond.order
@@ -452,6 +511,8 @@ class Atom(Vertex, DrawableObject):
 
 
     def on_bond_count_change(self):
+        if self.molecule and self.molecule.queue_atom_update(self, bonds_changed=True):
+            return
         self.on_bonds_reposition()
         self.update_occupied_valency()
         self.visible = None
@@ -467,9 +528,9 @@ class Atom(Vertex, DrawableObject):
 
     @property
     def occupied_angles(self):
-        """ return list of angles at which neighbor atoms and marks are located """
-        coords = [(a.x,a.y) for a in self.neighbors]
-        angles = [geo.line_get_angle_from_east([self.x,self.y, x,y]) for x,y in coords]
+        """ return list of angles at which neighbor atoms, nearby non-bonded atoms
+        and marks are located """
+        angles = get_crowding_angles(self, Settings.bond_length*self.molecule.scale_val)
         if self.isotope:
             angles.append(PI*5/4)# topleft
         if self.hydrogen_pos!=None:
@@ -591,9 +652,11 @@ class Atom(Vertex, DrawableObject):
 
     def transform(self, tr):
         self.x, self.y = tr.transform(self.x, self.y)
+        self.on_geometry_change()
 
     def transform_3D(self, tr):
         self.x, self.y, self.z = tr.transform(self.x, self.y, self.z)
+        self.on_geometry_change()
 
     def scale(self, scale):
         self.z *= scale
@@ -642,6 +705,7 @@ class Atom(Vertex, DrawableObject):
     def set_property(self, key, val):
         if key=="Isotope Number":
             self.isotope = val!="Auto" and int(val) or None
+            self.on_chemistry_change()
 
         elif key=="Hydrogens":
             self.set_hydrogens(val=="Auto" and -1 or int(val))
@@ -668,6 +732,7 @@ def format_num(match):
     return "<sub>" + sub + "</sub>"
 
 # converts ^H2O to H<sub>2</sub>O
+@lru_cached()
 def html_formula(formula):
     return re.sub(formula_num_re, format_num, formula)
 
@@ -676,6 +741,7 @@ def html_formula(formula):
 atom_re = "[A-Z][a-z]?\d*"
 
 # effectively reverses formulae like CO(NH2)2 to (NH2)2OC
+@lru_cached()
 def get_reverse_formula(formula):
     size = len(formula)
     parts = []
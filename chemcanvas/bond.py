@@ -7,7 +7,8 @@ from functools import reduce
 
 from app_data import App, Settings
 from graph import Edge
-from drawing_parents import DrawableObject, Color, PenStyle, LineCap, Font, Align
+from drawing_parents import (DrawableObject, Color, PenStyle, LineCap, Font, Align,
+                            shared_style, style_property, style_class)
 from arrow import arrow_head
 import geometry as geo
 import common
@@ -16,6 +17,12 @@ import common
 global bond_id_no
 bond_id_no = 1
 
+# bond types drawn in simpler way at detail level 1 (see Canvas.detail_level)
+lod_bond_types = {"hashed_wedge": "wedge", "hashed": "bold", "wavy": "single"}
+
+BondStyle = style_class("BondStyle", ("line_width", "line_spacing", "coord_head_dimensions",
+                    "double_length_ratio", "color"))
+
 
 
 class Bond(Edge, DrawableObject):
@@ -26,16 +33,29 @@ class Bond(Edge, DrawableObject):
                 "second_line_side", "auto_second_line_side", "show_delocalization")
     meta__undo_copy = ("atoms",)
     meta__same_objects = {"vertices":"atoms"}
+    # slots keep memory usage low in large documents
+    __slots__ = ("canvas", "molecule", "type", "id", "_style", "_main_items", "_bbox",
+            "_focus_item", "_selection_item", "show_delocalization", "second_line_side",
+            "auto_second_line_side", "_midline", "_line_width")
+
+    # drawing style shared among bonds (see BondStyle)
+    line_width = style_property("line_width")
+    line_spacing = style_property("line_spacing")
+    coord_head_dimensions = style_property("coord_head_dimensions")
+    double_length_ratio = style_property("double_length_ratio")
+    color = style_property("color")
 
     types = ("single", "double", "triple", "delocalized", "partial", "hbond", "coordinate",
             "E_or_Z", "wavy", "wedge", "hashed_wedge", "bold", "hashed", "bold2",
             "1_or_2", "1_or_a", "2_or_a", "any")
 
     def __init__(self):
+        self._style = shared_style(BondStyle(Settings.bond_width, Settings.bond_spacing,
+                    tuple(x*Settings.bond_width for x in Settings.coord_head_dimensions),
+                    0.75, (0,0,0)))
         DrawableObject.__init__(self)
         Edge.__init__(self)
         # Properties
-        self.atoms = self.vertices
         self.molecule = None
         self.type = "single"
         # unique id
@@ -52,14 +72,19 @@ class Bond(Edge, DrawableObject):
         # double bond's second line placement and gap related
         self.second_line_side = None # None=Unknown, 0=Middle, -1=Right, +1=Left side
         self.auto_second_line_side = True
-        self.line_width = Settings.bond_width
-        self.line_spacing = Settings.bond_spacing
-        self.coord_head_dimensions = tuple(x*self.line_width for x in Settings.coord_head_dimensions)
-        self.double_length_ratio = 0.75
 
     def __str__(self):
         return "%s : %s-%s" % (self.id, self.atoms[0], self.atoms[1])
 
+    @property
+    def atoms(self):
+        """ same list object as self.vertices """
+        return self.vertices
+
+    @atoms.setter
+    def atoms(self, atoms):
+        self.vertices = atoms
+
     @property
     def atom1(self):
         return self.atoms[0]
@@ -91,6 +116,9 @@ class Bond(Edge, DrawableObject):
                 if deloc.contains_bond(self):
                     self.molecule.destroy_delocalization(deloc)
         self.type = bond_type
+        if self.molecule:
+            self.molecule.topology_version += 1
+            self.molecule.on_atoms_changed(self.atoms)
 
         # if bond order is changed atoms occupied valency will also be changed
         [atom.update_occupied_valency() for atom in self.atoms]
@@ -105,13 +133,21 @@ class Bond(Edge, DrawableObject):
         # we can not use self.atoms = [atom1, atom2] here
         self.atoms.clear()
         self.atoms += [atom1, atom2]
+        # connectivity changed, so cached graph data (eg. adjacency) is invalid
+        if self.molecule:
+            self.molecule.clear_cache()
+            self.molecule.on_edge_connected(self)
 
     def disconnect_atoms(self):
+        if self.molecule:
+            self.molecule.on_edge_disconnected(self)
         self.atoms[0].remove_neighbor(self.atoms[1])
         self.atoms[0].on_bond_count_change()
         self.atoms[1].remove_neighbor(self.atoms[0])
         self.atoms[1].on_bond_count_change()
         self.atoms.clear()
+        if self.molecule:
+            self.molecule.clear_cache()
 
     def atom_connected_to(self, atom):
         """ used in Molecule.handle_overlap() """
@@ -195,7 +231,12 @@ class Bond(Edge, DrawableObject):
         self.canvas = self.molecule.canvas
         # draw
         self._line_width = max(self.line_width*self.molecule.scale_val, 1)
-        method = "_draw_%s" % self.type
+        if self.canvas.detail_level>=2:
+            method = "_draw_single"
+        elif self.canvas.detail_level==1:
+            method = "_draw_%s" % lod_bond_types.get(self.type, self.type)
+        else:
+            method = "_draw_%s" % self.type
         getattr(self, method)()
         [self.canvas.toBondLayer(item) for item in self._main_items]
         # add all main items as focusable
@@ -482,9 +523,8 @@ class Bond(Edge, DrawableObject):
         coords = [(a.x,a.y) for a in atms]
         # searching for circles
         circles = 0 # sum of side value of all ring atoms
-        # find all rings in the molecule and choose the rings which contain this bond.
-        for ring in self.molecule.get_smallest_independent_cycles_dangerous_and_cached():
-          if self.atoms[0] in ring and self.atoms[1] in ring:
+        # rings which contain this bond
+        for ring in self.molecule.get_rings_of_edge(self):
             on_which_side = lambda xy: geo.line_get_side_of_point( line, xy)
             circles += reduce( operator.add, map( on_which_side, [a.pos for a in ring if a not in self.atoms]), 0)
         if circles: # left or right side has greater number of ring atoms
@@ -532,6 +572,7 @@ class Bond(Edge, DrawableObject):
         return new_bond
 
     def bounding_box(self):
+        # not cached, as it changes whenever an atom moves
         return geo.rect_normalize(self.atom1.pos + self.atom2.pos)
 
     def scale(self, scale):
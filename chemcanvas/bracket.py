@@ -110,18 +110,22 @@ class Bracket(DrawableObject):
             self.canvas.removeItem(self._selection_item)
             self._selection_item = None
 
-    def bounding_box(self):
+    def calc_bounding_box(self):
         return list(self.points[0] + self.points[1])
 
     def move_by(self, dx, dy):
         self.points = [(pt[0]+dx,pt[1]+dy) for pt in self.points]
+        self.invalidate_bounding_box()
 
     def scale(self, scale):
         self.scale_val *= scale
+        self.invalidate_bounding_box()
 
     def transform(self, tr):
         self.points = tr.transform_points(self.points)
+        self.invalidate_bounding_box()
 
     def transform_3D(self, tr):
         self.points = [tr.transform(*pt) for pt in self.points]
+        self.invalidate_bounding_box()
 
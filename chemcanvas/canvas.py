@@ -1,16 +1,22 @@
 # -*- coding: utf-8 -*-
 # This file is a part of ChemCanvas Program which is GNU GPLv3 licensed
 # Copyright (C) 2022-2026 Arindam Chaudhuri <arindamsoft94@gmail.com>
+from bisect import bisect_left
+from contextlib import contextmanager
+
 from app_data import App, Settings
 from undo_manager import UndoManager
 from drawing_parents import Color, Font, Align, PenStyle, LineCap, hex_color, Layer
 import geometry as geo
-from common import float_to_str, bbox_of_bboxes
-from tool_helpers import get_objs_with_all_children, draw_objs_recursively, move_objs
+from common import float_to_str, bbox_of_bboxes, lru_cached, cache_stats
+from tool_helpers import (get_objs_with_all_children, get_objs_with_dependents,
+        draw_objs_recursively, move_objs)
 from document import Document
 
-from PyQt5.QtWidgets import QGraphicsScene, QGraphicsItem, QGraphicsTextItem, QMenu
-from PyQt5.QtCore import QRectF, QPointF, Qt, pyqtSignal
+from PyQt5.QtWidgets import (QGraphicsScene, QGraphicsItem, QGraphicsTextItem, QMenu,
+        QGraphicsLineItem, QGraphicsRectItem, QGraphicsPolygonItem,
+        QGraphicsEllipseItem, QGraphicsPathItem)
+from PyQt5.QtCore import QRectF, QPointF, Qt, pyqtSignal, QTimer
 from PyQt5.QtGui import (QColor, QPen, QBrush, QPolygonF, QPainterPath,
         QFontMetricsF, QFont, QImage, QPainter, QTransform)
 
@@ -31,6 +37,8 @@ class Canvas(QGraphicsScene):
             view.verticalScrollBar().valueChanged.connect(self.onPageScroll)
         # top level objects
         self.objects = []
+        # bounding box and page of top level objects
+        self.page_index = PageIndex(self)
         # pages
         self.pages_count = 1
         self.curr_page_no = 0 # page index (starts from 0)
@@ -45,8 +53,31 @@ class Canvas(QGraphicsScene):
         self.page_grid_spacing = 20
         self.page_grid_major_every = 5
         self.page_grid_items = []
-
-        self.dirty_objects = set() # redraw_needed
+        # level of detail. 0 = full detail, 1 = no atom marks and hashed bonds,
+        # 2 = atom labels as boxes and single line bonds
+        self.detail_level = 0
+
+        # objects waiting to be redrawn, they are drawn once when control
+        # returns to event loop. see mark_dirty()
+        self.dirty_objects = set()
+        self._redraw_timer = QTimer(self)
+        self._redraw_timer.setSingleShot(True)
+        self._redraw_timer.setInterval(0)
+        self._redraw_timer.timeout.connect(self.redraw_dirty_objects)
+        # no. of redraws requested and actually done, since last undo state saved
+        self.redraw_stats = {"requested": 0, "drawn": 0, "flushes": 0}
+        self.last_action_redraw_stats = dict(self.redraw_stats)
+        self.total_redraw_stats = dict(self.redraw_stats)
+
+        # removed graphics items are hidden and kept here for reuse, as adding
+        # and removing items from scene is costly. see removeItem()
+        self._item_pool = {QGraphicsLineItem: [], QGraphicsRectItem: [],
+                QGraphicsPolygonItem: [], QGraphicsEllipseItem: [],
+                QGraphicsPathItem: [], QGraphicsTextItem: []}
+        self._pooled_items = set()
+        # [hits, misses] of text items reused without doing layout again
+        self.text_layout_stats = cache_stats.setdefault("Canvas.text_layout", [0, 0])
+        self.item_pool_size = 1000 # max no. of items of each type
 
         # event handling
         self.mouse_pressed = False
@@ -189,16 +220,15 @@ class Canvas(QGraphicsScene):
 
 
     def getDocument(self):
+        # pages of objects are decided by their drawn bounding boxes
+        self.redraw_dirty_objects()
         doc = Document()
         doc.set_pages_count(self.pages_count)
         for page_no, page in enumerate(doc.pages):
             page.pos = self.get_page_pos(page_no)
         doc.page_size = self.page_size
-        ext_page_h = self.page_size[1] + self.page_spacing # extended height including spacing
         for o in self.objects:
-            cx,cy = geo.rect_get_center( o.bounding_box())
-            page_no = int(cy/ext_page_h)
-            doc.pages[page_no].objects.append(o)
+            doc.pages[self.page_index.page_of(o)].objects.append(o)
         return doc
 
     def setDocument(self, doc):
@@ -260,6 +290,7 @@ class Canvas(QGraphicsScene):
         margin = 1/2.54*Settings.render_dpi # 1 cm
         spacing = 0.75/2.54*Settings.render_dpi # 0.75 cm
         page_w, page_h = self.page_size
+        self.redraw_dirty_objects()
         page_x, page_y = self.get_page_pos(self.curr_page_no)
         min_x, min_y = page_x + margin, page_y + margin
         max_x, max_y = page_x + page_w - margin, page_y + page_h - margin
@@ -270,14 +301,16 @@ class Canvas(QGraphicsScene):
             x = min(min_x, page_x+(page_w-w)/2)
             y = min(min_y, page_y+(page_h-h)/2)
             return (x,y)
-        rects = [o.bounding_box() for o in objects]
+        rects = sorted(list(self.page_index.bbox_of(o)) for o in objects)
+        lefts = [r[0] for r in rects]
         lowest_rect = max(rects, key=lambda r : r[3])
         baseline = (lowest_rect[3]+lowest_rect[1])/2
         prev_rect = lowest_rect
         while 1:
             # try to place beside previous rect
             x1, x2 = prev_rect[2]+spacing, prev_rect[2]+spacing+w
-            rects_above = list(filter(lambda r : x1<r[2] and r[0]<x2, rects))
+            # rects are sorted by left edge, so only those starting before x2 are checked
+            rects_above = [r for r in rects[:bisect_left(lefts, x2)] if x1<r[2]]
             if not rects_above:# found place or reached end
                 break
             above_rect = max(rects_above, key=lambda r : r[3])
@@ -301,12 +334,10 @@ class Canvas(QGraphicsScene):
         # get objects in each page
         page_w, page_h = self.page_size
         extended_page_h = page_h + self.page_spacing
+        self.redraw_dirty_objects()
         for o in self.objects:
-            bbox = o.bounding_box()
-            cx,cy = geo.rect_get_center(bbox)
-            page_no = int(cy/extended_page_h)
-            if page_no>self.pages_count-1:
-                page_no = self.pages_count-1
+            bbox = self.page_index.bbox_of(o)
+            page_no = self.page_index.page_of(o)
             left, top = 0, page_no*extended_page_h
             right, bottom = page_w, top + page_h
             move_x, move_y = 0, 0
@@ -328,18 +359,15 @@ class Canvas(QGraphicsScene):
     def addObject(self, obj):
         self.objects.append(obj)
         obj.canvas = self
+        self.page_index.object_added(obj)
 
     def removeObject(self, obj):
         obj.canvas = None
         self.objects.remove(obj)
+        self.page_index.object_removed(obj)
 
     def objects_in_page(self, page_no):
-        objs = []
-        for o in self.objects:
-            cx,cy = geo.rect_get_center( o.bounding_box())
-            if int(cy/self.page_size[1]) == page_no:
-                objs.append(o)
-        return objs
+        return self.page_index.objects_in_page(page_no)
 
     def objectsInRect(self, rect):
         """ get objects intersected by region rectangle. """
@@ -352,15 +380,51 @@ class Canvas(QGraphicsScene):
         gfx_items = set(self.items(QPolygonF([QPointF(*pt) for pt in polygon])))
         return [itm.object for itm in gfx_items & self.focusable_items]
 
+    def mark_dirty(self, objs):
+        """ schedule redraw of objs, their children and objects depending on them.
+        All are drawn only once, when control returns to event loop, or when
+        redraw_dirty_objects() is called """
+        objs = get_objs_with_dependents(objs)
+        self.redraw_stats["requested"] += len(objs)
+        self.dirty_objects.update(objs)
+        if not self._redraw_timer.isActive():
+            self._redraw_timer.start()
+
     def redraw_dirty_objects(self):
-        draw_objs_recursively(self.dirty_objects)
-        self.dirty_objects.clear()
+        """ draw the objects scheduled for redraw """
+        self._redraw_timer.stop()
+        if not self.dirty_objects:
+            return
+        dirty = self.dirty_objects
+        self.dirty_objects = set()
+        # arrows anchored to the redrawn objects
+        dirty.update(o for o in self.objects if o.class_name=="Arrow" and
+                            (o.e_src in dirty or o.e_dst in dirty))
+        for obj in sorted(dirty, key=lambda x : x.redraw_priority):
+            obj.draw()
+        self.redraw_stats["drawn"] += len(dirty)
+        self.redraw_stats["flushes"] += 1
+
+    def redraw_stats_text(self):
+        """ returns no. of draws avoided by redrawing dirty objects once, for debugging """
+        lines = []
+        for name, stats in (("last action", self.last_action_redraw_stats),
+                            ("total", self.total_redraw_stats)):
+            lines.append("Redraws (%s) : %i requested, %i drawn, %i avoided, in %i flushes" % (
+                    name, stats["requested"], stats["drawn"],
+                    max(stats["requested"]-stats["drawn"], 0), stats["flushes"]))
+        return "\n".join(lines)
 
     # -------------------- DRAWING COMMANDS -------------------------
 
     def addLine(self, line, width=1, color=Color.black, style=PenStyle.solid, cap=LineCap.square):
         pen = QPen(QColor(*color), width, style, cap)
-        return QGraphicsScene.addLine(self, *line, pen)
+        item = self._reuse_item(QGraphicsLineItem)
+        if not item:
+            return QGraphicsScene.addLine(self, *line, pen)
+        item.setLine(*line)
+        item.setPen(pen)
+        return item
 
     # A stroked rectangle has a size of (rectangle size + pen width)
     def addRect(self, rect, width=1, color=Color.black, style=PenStyle.solid, fill=None):
@@ -369,7 +433,13 @@ class Canvas(QGraphicsScene):
         if isinstance(fill, tuple):# a color
             fill = QColor(*fill)
         brush = QBrush(fill) if fill else QBrush()
-        return QGraphicsScene.addRect(self, x1,y1, x2-x1, y2-y1, pen, brush)
+        item = self._reuse_item(QGraphicsRectItem)
+        if not item:
+            return QGraphicsScene.addRect(self, x1,y1, x2-x1, y2-y1, pen, brush)
+        item.setRect(x1,y1, x2-x1, y2-y1)
+        item.setPen(pen)
+        item.setBrush(brush)
+        return item
 
     def addPolygon(self, points, width=1, color=Color.black, style=PenStyle.solid, fill=None):
         polygon = QPolygonF([QPointF(*p) for p in points])
@@ -377,13 +447,19 @@ class Canvas(QGraphicsScene):
         if isinstance(fill, tuple):# a color
             fill = QColor(*fill)
         brush = QBrush(fill) if fill else QBrush()
-        return QGraphicsScene.addPolygon(self, polygon, pen, brush)
+        item = self._reuse_item(QGraphicsPolygonItem)
+        if not item:
+            return QGraphicsScene.addPolygon(self, polygon, pen, brush)
+        item.setPolygon(polygon)
+        item.setPen(pen)
+        item.setBrush(brush)
+        return item
 
     def addPolyline(self, points, width=1, color=Color.black, style=PenStyle.solid):
         shape = QPainterPath(QPointF(*points[0]))
         [shape.lineTo(QPointF(*pt)) for pt in points[1:]]
         pen = QPen(QColor(*color), width, style)
-        return QGraphicsScene.addPath(self, shape, pen)
+        return self._addPathItem(shape, pen)
 
     def addEllipse(self, rect, width=1, color=Color.black, fill=None):
         x1,y1, x2,y2 = rect
@@ -391,7 +467,13 @@ class Canvas(QGraphicsScene):
         if isinstance(fill, tuple):# a color
             fill = QColor(*fill)
         brush = QBrush(fill) if fill else QBrush()
-        return QGraphicsScene.addEllipse(self, x1,y1, x2-x1, y2-y1, pen, brush)
+        item = self._reuse_item(QGraphicsEllipseItem)
+        if not item:
+            return QGraphicsScene.addEllipse(self, x1,y1, x2-x1, y2-y1, pen, brush)
+        item.setRect(x1,y1, x2-x1, y2-y1)
+        item.setPen(pen)
+        item.setBrush(brush)
+        return item
 
     def addCubicBezier(self, points, width=1, color=Color.black, style=PenStyle.solid, fill=None):
         """ draw single bezier or multiple connected bezier curves.
@@ -404,7 +486,7 @@ class Canvas(QGraphicsScene):
         if isinstance(fill, tuple):# a color
             fill = QColor(*fill)
         brush = QBrush(fill) if fill else QBrush()
-        return QGraphicsScene.addPath(self, shape, pen, brush)
+        return self._addPathItem(shape, pen, brush)
 
     def addArc(self, rect, start_ang, span_ang, width=1, color=Color.black):
         """ draw arc """
@@ -413,7 +495,7 @@ class Canvas(QGraphicsScene):
         path.arcMoveTo(x1,y1,x2-x1,y2-y1, start_ang)
         path.arcTo(x1,y1,x2-x1,y2-y1, start_ang, span_ang)
         pen = QPen(QColor(*color), width)
-        return QGraphicsScene.addPath(self, path, pen)
+        return self._addPathItem(path, pen)
 
     def addPath(self, path, width=1, color=Color.black, style=PenStyle.solid, fill=None):
         """ draw path from QPainterPath """
@@ -421,24 +503,59 @@ class Canvas(QGraphicsScene):
         if isinstance(fill, tuple):# a color
             fill = QColor(*fill)
         brush = QBrush(fill) if fill else QBrush()
-        return QGraphicsScene.addPath(self, path, pen, brush)
+        return self._addPathItem(path, pen, brush)
 
+    def _addPathItem(self, path, pen, brush=QBrush()):
+        item = self._reuse_item(QGraphicsPathItem)
+        if not item:
+            return QGraphicsScene.addPath(self, path, pen, brush)
+        item.setPath(path)
+        item.setPen(pen)
+        item.setBrush(brush)
+        return item
+
+    def _addTextItem(self, text, font, color):
+        """ returns a text item with html text set. a removed item is reused
+        if available, and text layout is done again only if text or font differs """
+        # prefer an item recently removed, which has the same text
+        pool = self._item_pool[QGraphicsTextItem]
+        for i in range(len(pool)-1, max(len(pool)-5, -1), -1):
+            if getattr(pool[i], "text", None) == text:
+                pool[i], pool[-1] = pool[-1], pool[i]
+                break
+        item = self._reuse_item(QGraphicsTextItem)
+        if not item:
+            self.text_layout_stats[1] += 1
+            item = QGraphicsTextItem()
+            item.setDefaultTextColor(QColor(*color))
+            if font:
+                item.setFont(font)
+            item.setHtml(text)
+            item.text = text # from this we can get the original text we have set
+            self.addItem(item)
+            return item
+        color, font = QColor(*color), font or QFont()
+        if item.defaultTextColor() != color:
+            item.setDefaultTextColor(color)
+        if getattr(item, "text", None) != text or item.font() != font:
+            item.document().setTextWidth(-1)
+            item.setFont(font)
+            item.setHtml(text)
+            item.text = text
+            self.text_layout_stats[1] += 1
+        else:
+            self.text_layout_stats[0] += 1
+        return item
 
     def addHtmlText(self, text, pos, font=None, align=Align.Left|Align.Baseline, color=(0,0,0)):
         """ Draw Html Text """
-        item = QGraphicsTextItem()
-        item.setDefaultTextColor(QColor(*color))
         if font:
-            _font = QFont(font.name)
-            _font.setPixelSize(int(round(font.size)))
-            _font.setBold(font.bold)
-            _font.setItalic(font.italic)
-            item.setFont(_font)
-        item.setHtml(text)
-        item.text = text # from this we can get the original text we have set
-        self.addItem(item)
-
-        font_metrics = QFontMetricsF(item.font())
+            font_key = (font.name, int(round(font.size)), font.bold, font.italic)
+            item = self._addTextItem(text, get_qfont(*font_key), color)
+            font_metrics = get_font_metrics(*font_key)
+        else:
+            item = self._addTextItem(text, None, color)
+            font_metrics = QFontMetricsF(item.font())
         item_w = item.boundingRect().width()
         x, y = pos[0]-self.textitem_margin, pos[1]-self.textitem_margin
         w, h = item_w-2*self.textitem_margin, font_metrics.height()
@@ -463,15 +580,8 @@ class Canvas(QGraphicsScene):
 
     def addChemicalFormula(self, text, pos, align, offset, font, color=(0,0,0)):
         """ draw chemical formula """
-        item = QGraphicsTextItem()
-        item.setDefaultTextColor(QColor(*color))
-        if font:
-            _font = QFont(font.name)
-            _font.setPixelSize(int(round(font.size)))
-            item.setFont(_font)
-        item.setHtml(text)
-        item.text = text # from this we can get the original text we have set
-        self.addItem(item)
+        _font = font and get_qfont(font.name, int(round(font.size)))
+        item = self._addTextItem(text, _font, color)
         w, h = item.boundingRect().getRect()[2:]
         x, y, w = pos[0]-self.textitem_margin, pos[1]-h/2, w-2*self.textitem_margin
 
@@ -486,6 +596,33 @@ class Canvas(QGraphicsScene):
 
     # ----------------- GRAPHICS ITEMS MANAGEMENT --------------------
 
+    def removeItem(self, item):
+        """ hides the item and keeps it for reuse by drawing commands,
+        instead of removing from scene """
+        pool = self._item_pool.get(type(item))
+        # items inside a group (see MoveTool) are not reused
+        if (pool is None or len(pool)>=self.item_pool_size or item.scene() is not self
+                or item.parentItem()):
+            return QGraphicsScene.removeItem(self, item)
+        if item in self._pooled_items:
+            return
+        item.setVisible(False)
+        pool.append(item)
+        self._pooled_items.add(item)
+
+    def _reuse_item(self, item_type):
+        """ returns a removed item of item_type in default state, or None """
+        pool = self._item_pool[item_type]
+        if not pool:
+            return None
+        item = pool.pop()
+        self._pooled_items.remove(item)
+        item.setPos(0,0)
+        item.setZValue(0)
+        item.setRotation(0)
+        item.setVisible(True)
+        return item
+
     def get_items_of_objects(self, objects):
         objs = get_objs_with_all_children(objects)
         objs = sorted(objs, key=lambda x : x.redraw_priority)
@@ -534,7 +671,7 @@ class Canvas(QGraphicsScene):
 
     def set_nonprinting_items_visible(self, visible):
         """ use this to prevent printing unwanted items while generating image or pdf """
-        all_items = set(self.items())
+        all_items = set(self.items()) - self._pooled_items
         objs = get_objs_with_all_children(self.objects)
         printables = [obj.chemistry_items for obj in objs]
         printables = set([x for items in printables for x in items])
@@ -558,14 +695,15 @@ class Canvas(QGraphicsScene):
         [item.moveBy(dx, dy) for item in items]
 
     def getCharWidth(self, char, font):
-        qfont = QFont(font.name)
-        qfont.setPixelSize(int(round(font.size)))
-        return QFontMetricsF(qfont).widthChar(char)
+        widths = get_char_widths(font.name, int(round(font.size)))
+        try:
+            return widths[char]
+        except KeyError:
+            width = widths[char] = get_font_metrics(font.name, int(round(font.size))).widthChar(char)
+            return width
 
     def getTextWidth(self, text, font):
-        qfont = QFont(font.name)
-        qfont.setPixelSize(int(round(font.size)))
-        return QFontMetricsF(qfont).width(text)
+        return get_text_width(font.name, int(round(font.size)), text)
 
     # --------------------- INTERACTIVE-NESS -----------------------
 
@@ -573,11 +711,16 @@ class Canvas(QGraphicsScene):
         """ Add drawable objects, e.g bond, atom, arrow etc """
         graphics_item.object = obj
         self.focusable_items.add(graphics_item)
+        # object is redrawn, so its bounding box may be changed
+        obj.invalidate_bounding_box()
+        self.page_index.object_changed(obj)
 
     def removeFocusable(self, graphics_item):
         """ Remove drawable objects, e.g bond, atom, arrow etc """
         if graphics_item in self.focusable_items:
             self.focusable_items.remove(graphics_item)
+            graphics_item.object.invalidate_bounding_box()
+            self.page_index.object_changed(graphics_item.object)
             graphics_item.object = None
 
     def changeFocusTo(self, focused_obj):
@@ -632,6 +775,7 @@ class Canvas(QGraphicsScene):
         self.dragging = False
         x, y = ev.scenePos().x(), ev.scenePos().y()
         self._mouse_press_pos = (x, y)
+        self.redraw_dirty_objects()
         App.tool.on_mouse_press(x, y)
         QGraphicsScene.mousePressEvent(self, ev)
 
@@ -665,6 +809,7 @@ class Canvas(QGraphicsScene):
         if self.mouse_pressed:
             self.mouse_pressed = False
             pos = ev.scenePos()
+            self.redraw_dirty_objects()
             App.tool.on_mouse_release(pos.x(), pos.y())
             self.dragging = False
         QGraphicsScene.mouseReleaseEvent(self, ev)
@@ -673,6 +818,7 @@ class Canvas(QGraphicsScene):
     def mouseDoubleClickEvent(self, ev):
         if ev.button() == Qt.LeftButton:
             pos = ev.scenePos()
+            self.redraw_dirty_objects()
             App.tool.on_mouse_double_click(pos.x(), pos.y())
         QGraphicsScene.mouseDoubleClickEvent(self, ev)
 
@@ -699,6 +845,7 @@ class Canvas(QGraphicsScene):
         else:
             return
 
+        self.redraw_dirty_objects()
         App.tool.on_key_press(key, text)
 
 
@@ -728,46 +875,80 @@ class Canvas(QGraphicsScene):
         return not self.undo_manager.has_unsaved_changes()
 
     def save_state_to_undo_stack(self, name=''):
+        # drawing may change some attributes, so finish pending redraws first
+        self.redraw_dirty_objects()
+        self.last_action_redraw_stats = self.redraw_stats
+        for key, val in self.redraw_stats.items():
+            self.total_redraw_stats[key] += val
+        self.redraw_stats = {"requested": 0, "drawn": 0, "flushes": 0}
         self.undo_manager.save_current_state(name)
         App.window.setDocumentSaved(False)
 
     def undo(self):
         App.tool.clear()
+        self.redraw_dirty_objects()
         self.undo_manager.undo()
         App.window.setDocumentSaved(self.is_saved)
 
     def redo(self):
         App.tool.clear()
+        self.redraw_dirty_objects()
         self.undo_manager.redo()
         App.window.setDocumentSaved(self.is_saved)
 
 
     # ------------------------ OTHERS --------------------------
 
+    def set_zoom(self, zoom):
+        """ sets level of detail according to zoom (%) of view """
+        self.set_detail_level(len([z for z in Settings.lod_zoom_thresholds if zoom<z]))
+
+    def set_detail_level(self, level):
+        if level==self.detail_level:
+            return
+        self.detail_level = level
+        draw_objs_recursively(self.objects)
+
+    @contextmanager
+    def full_detail(self):
+        """ temporarily draws everything in full detail, e.g while exporting """
+        self.redraw_dirty_objects()
+        level = self.detail_level
+        self.set_detail_level(0)
+        try:
+            yield
+        finally:
+            self.set_detail_level(level)
+
     def getImage(self, dpi=-1, margin=0):
-        # source area
-        x1, y1, x2, y2 = map(int, self.curr_page_objects_bbox())
-        src_rect = QRectF(x1,y1, x2-x1+1, y2-y1+1)
-        # dest area
-        scale = dpi/Settings.render_dpi if dpi>0 else 1.0
-        w, h = int(round((x2-x1+1)*scale)), int(round((y2-y1+1)*scale))
-        dst_rect = QRectF(margin, margin, w, h)
-        # render
-        self.set_nonprinting_items_visible(False)
-        image = QImage(w+2*margin, h+2*margin, QImage.Format_ARGB32)
-        if Settings.image_export_background=="transparent":
-            image.fill(Qt.transparent)
-        else:
-            image.fill(QColor(Settings.image_export_background))
-        painter = QPainter(image)
-        painter.setRenderHint(QPainter.Antialiasing)
-        self.render(painter, dst_rect, src_rect)
-        painter.end()
-        self.set_nonprinting_items_visible(True)
+        with self.full_detail():
+            # source area
+            x1, y1, x2, y2 = map(int, self.curr_page_objects_bbox())
+            src_rect = QRectF(x1,y1, x2-x1+1, y2-y1+1)
+            # dest area
+            scale = dpi/Settings.render_dpi if dpi>0 else 1.0
+            w, h = int(round((x2-x1+1)*scale)), int(round((y2-y1+1)*scale))
+            dst_rect = QRectF(margin, margin, w, h)
+            # render
+            self.set_nonprinting_items_visible(False)
+            image = QImage(w+2*margin, h+2*margin, QImage.Format_ARGB32)
+            if Settings.image_export_background=="transparent":
+                image.fill(Qt.transparent)
+            else:
+                image.fill(QColor(Settings.image_export_background))
+            painter = QPainter(image)
+            painter.setRenderHint(QPainter.Antialiasing)
+            self.render(painter, dst_rect, src_rect)
+            painter.end()
+            self.set_nonprinting_items_visible(True)
         return image
 
 
     def getSvg(self):
+        with self.full_detail():
+            return self._getSvg()
+
+    def _getSvg(self):
         objs = self.objects_in_page(self.curr_page_no)
         items = self.get_items_of_objects(objs)
         svg_canvas = SvgCanvas()
@@ -791,6 +972,7 @@ class Canvas(QGraphicsScene):
 
     def renderObjects(self, objects):
         """ this is for generating thumbnails """
+        self.redraw_dirty_objects()
         bboxes = [obj.bounding_box() for obj in objects]
         bbox = bbox_of_bboxes(bboxes)
         w, h = bbox[2]-bbox[0], bbox[3]-bbox[1]
@@ -811,6 +993,33 @@ class Canvas(QGraphicsScene):
         return image
 
 
+# QFont and QFontMetricsF are cached, as many objects use same few fonts
+
+@lru_cached(64)
+def get_qfont(name, pixel_size, bold=False, italic=False):
+    """ returns a shared QFont, which must not be modified """
+    qfont = QFont(name)
+    qfont.setPixelSize(pixel_size)
+    qfont.setBold(bold)
+    qfont.setItalic(italic)
+    return qfont
+
+@lru_cached(64)
+def get_font_metrics(name, pixel_size, bold=False, italic=False):
+    return QFontMetricsF(get_qfont(name, pixel_size, bold, italic))
+
+@lru_cached(64)
+def get_char_widths(name, pixel_size):
+    """ returns {char: width} table of the font. Printable ASCII characters are
+    precalculated, others are added when required """
+    metrics = get_font_metrics(name, pixel_size)
+    return {char: metrics.widthChar(char) for char in map(chr, range(32,127))}
+
+@lru_cached(4096)
+def get_text_width(name, pixel_size, text):
+    return get_font_metrics(name, pixel_size).width(text)
+
+
 key_name_map = {
     Qt.Key_Shift: "Shift",
     Qt.Key_Control: "Ctrl",
@@ -835,6 +1044,100 @@ key_name_map = {
 
 
 
+class PageIndex:
+    """ keeps bounding box and page no. of top level objects of canvas.
+    An object is marked changed when it is redrawn (in Canvas.addFocusable())
+    or its bounding box is invalidated, and its bounding box is calculated
+    again only when it is queried next time. Page of an object is decided by the
+    center of its bounding box """
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.objects = canvas.objects # the list which is indexed
+        self.order = {} # {obj: serial no}, to keep order of canvas.objects
+        self.bboxes = {} # {obj: bbox}
+        self.pages = {} # {obj: page_no}
+        self.page_objects = {} # {page_no: set of objects}
+        self.changed = set()
+        self.page_layout = None # page height and count, when pages are calculated
+        self.next_serial = 0
+
+    def object_added(self, obj):
+        self.order[obj] = self.next_serial
+        self.next_serial += 1
+        self.changed.add(obj)
+
+    def object_removed(self, obj):
+        self.order.pop(obj, None)
+        self.changed.discard(obj)
+        self._discard(obj)
+
+    def object_changed(self, obj):
+        # children (eg. atoms, bonds) change bounding box of their top level parent
+        while obj and not obj.is_toplevel:
+            obj = obj.parent
+        if obj:
+            self.changed.add(obj)
+
+    def bbox_of(self, obj):
+        self.update()
+        return self.bboxes[obj]
+
+    def page_of(self, obj):
+        self.update()
+        return self.pages[obj]
+
+    def objects_in_page(self, page_no):
+        self.update()
+        return sorted(self.page_objects.get(page_no, ()), key=self.order.get)
+
+    def _discard(self, obj):
+        self.bboxes.pop(obj, None)
+        page_no = self.pages.pop(obj, None)
+        if page_no is not None:
+            self.page_objects[page_no].discard(obj)
+
+    def _set_page(self, obj):
+        canvas = self.canvas
+        cx, cy = geo.rect_get_center(self.bboxes[obj])
+        page_no = int(cy/(canvas.page_size[1] + canvas.page_spacing))
+        page_no = max(0, min(page_no, canvas.pages_count-1))
+        old_page_no = self.pages.get(obj)
+        if page_no != old_page_no:
+            if old_page_no is not None:
+                self.page_objects[old_page_no].discard(obj)
+            self.page_objects.setdefault(page_no, set()).add(obj)
+            self.pages[obj] = page_no
+
+    def update(self):
+        """ recalculates bounding boxes of changed objects. Pending redraws
+        are not flushed here, callers which need drawn geometry must call
+        canvas.redraw_dirty_objects() first """
+        canvas = self.canvas
+        # object list is replaced when undo or redo is done
+        if canvas.objects is not self.objects:
+            self.objects = canvas.objects
+            self.order = {obj:i for i,obj in enumerate(self.objects)}
+            self.next_serial = len(self.objects)
+            for obj in [o for o in self.bboxes if o not in self.order]:
+                self._discard(obj)
+            self.changed.update(o for o in self.objects if o not in self.bboxes)
+        # page size or count is changed
+        page_layout = (canvas.page_size[1] + canvas.page_spacing, canvas.pages_count)
+        if page_layout != self.page_layout:
+            self.page_layout = page_layout
+            self.pages.clear()
+            self.page_objects.clear()
+            for obj in self.bboxes:
+                self._set_page(obj)
+        for obj in self.changed:
+            if obj in self.order:
+                self.bboxes[obj] = obj.bounding_box()
+                self._set_page(obj)
+        self.changed.clear()
+
+
+
 # ------------------ SVG Canvas ----------------------
 
 
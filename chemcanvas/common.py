@@ -1,6 +1,78 @@
 # -*- coding: utf-8 -*-
 # This file is a part of ChemCanvas Program which is GNU GPLv3 licensed
 # Copyright (C) 2022-2026 Arindam Chaudhuri <arindamsoft94@gmail.com>
+from functools import wraps
+from collections import OrderedDict
+
+
+# flags for cached_on(), results are recomputed when these version counters change
+TOPOLOGY = 1 # topology_version, changed when atoms, bonds or bond types change
+GEOMETRY = 2 # geometry_version, changed when atoms are moved
+
+# hits and misses of each cached method, i.e {"Molecule.average_bond_length" : [hits, misses]}
+cache_stats = {}
+
+def cached_on(depends_on):
+    """ decorator to memoize the result of a method without arguments, until
+    topology_version and/or geometry_version of the object is changed.
+    usage : @cached_on(TOPOLOGY|GEOMETRY) . Results are stored in self._memo """
+    def decorator(method):
+        name = method.__qualname__
+        stats = cache_stats.setdefault(name, [0, 0])
+        @wraps(method)
+        def wrapper(self):
+            version = (depends_on & TOPOLOGY and self.topology_version,
+                        depends_on & GEOMETRY and self.geometry_version)
+            try:
+                memo_version, result = self._memo[name]
+                if memo_version == version:
+                    stats[0] += 1
+                    return result
+            except KeyError:
+                pass
+            stats[1] += 1
+            result = method(self)
+            self._memo[name] = (version, result)
+            return result
+        return wrapper
+    return decorator
+
+
+def lru_cached(maxsize=1024):
+    """ decorator to memoize the result of a function by its arguments, which
+    must be hashable. Only maxsize recently used results are kept. """
+    def decorator(func):
+        name = func.__qualname__
+        stats = cache_stats.setdefault(name, [0, 0])
+        cache = OrderedDict()
+        @wraps(func)
+        def wrapper(*args):
+            try:
+                result = cache[args]
+                cache.move_to_end(args)
+                stats[0] += 1
+                return result
+            except KeyError:
+                pass
+            stats[1] += 1
+            result = cache[args] = func(*args)
+            if len(cache) > maxsize:
+                cache.popitem(last=False)
+            return result
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
+def cache_stats_text():
+    """ returns hit rate of each cache, for debugging """
+    lines = []
+    for name, (hits, misses) in sorted(cache_stats.items()):
+        if hits+misses:
+            lines.append("%s : %i hits, %i misses (%.1f%%)" % (name, hits, misses,
+                                                        100*hits/(hits+misses)))
+    return "\n".join(lines)
+
 
 def list_difference( list_):
   """return a list of differences between list members,
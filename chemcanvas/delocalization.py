@@ -100,6 +100,7 @@ class Delocalization(DrawableObject):
 
 
     def bounding_box(self):
+        # not cached, as it changes whenever an atom moves
         if self._main_item:
             return self.canvas.itemBoundingBox(self._main_item)
         xs = [a.x for a in self.atoms]
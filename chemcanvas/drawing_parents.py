@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 # This file is a part of ChemCanvas Program which is GNU GPLv3 licensed
 # Copyright (C) 2022-2026 Arindam Chaudhuri <arindamsoft94@gmail.com>
+from collections import namedtuple
 
 
 # any color is denoted by 3 or 4 member tuple (4th is alpha)
@@ -57,6 +58,33 @@ class Font:
         self.italic = False
 
 
+# Flyweight drawing styles. Many objects (eg. atoms) have same font, sizes and color.
+# Such objects keep a reference to a shared immutable style (a namedtuple) instead
+# of storing each attribute separately. Modifying an attribute replaces the style
+# with a modified copy (copy on write), which is shared again if it already exists.
+_shared_styles = {}
+
+def style_class(name, fields):
+    """ creates an immutable namedtuple type for shared styles. being immutable,
+    copy and deepcopy of a style returns the same (shared) object """
+    return type(name, (namedtuple(name, fields),), {"__slots__": (),
+                "__copy__": lambda self: self,
+                "__deepcopy__": lambda self, memo: self})
+
+def shared_style(style):
+    """ returns the shared instance equal to @style """
+    return _shared_styles.setdefault(style, style)
+
+def style_property(name):
+    """ creates a property for attribute @name stored in self._style """
+    def getter(self):
+        return getattr(self._style, name)
+    def setter(self, val):
+        if getattr(self._style, name) != val:
+            self._style = shared_style(self._style._replace(**{name:val}))
+    return property(getter, setter)
+
+
 class Layer:
     """ ZValue for various items of Canvas """
     GRAPHICS_TOP_LAYER = 4
@@ -77,6 +105,8 @@ class Layer:
 # Bracket
 
 class DrawableObject:
+    # empty, so that subclasses like Atom and Bond can use __slots__
+    __slots__ = ()
     focus_priority = 10 # smaller number have higher priority
     redraw_priority = 10
     is_toplevel = True
@@ -86,10 +116,13 @@ class DrawableObject:
     meta__undo_children_to_record = () # must be a list or set
     meta__same_objects = {}
     meta__scalables = ()# list of objects which are affected by scaling
+    # number of times bounding box is calculated (i.e not found in cache)
+    bbox_calc_count = 0
 
     def __init__(self):
         self.canvas = None
         self.color = (0,0,0)
+        self._bbox = None # cached bounding box
         # Top level objects will have scale value, and children will
         # use their parent's scale value.
         #self.scale_val = 1.0 # must be implemented in subclasses
@@ -126,10 +159,28 @@ class DrawableObject:
         pass
 
     def bounding_box(self):
-        """ bounding box of all graphics items return as [x1,x2,y1,y2]
-        reimplementation mandatory. required by ScaleTool """
+        """ bounding box of all graphics items return as [x1,y1,x2,y2].
+        calculated by calc_bounding_box() and cached until invalidated """
+        if self._bbox is None:
+            DrawableObject.bbox_calc_count += 1
+            self._bbox = self.calc_bounding_box()
+        return self._bbox
+
+    def calc_bounding_box(self):
+        """ reimplementation mandatory. required by ScaleTool """
         return None
 
+    def invalidate_bounding_box(self):
+        """ must be called when object is moved, transformed or redrawn.
+        parent's bounding box is also invalidated """
+        self._bbox = None
+        parent = self.parent
+        if parent:
+            parent.invalidate_bounding_box()
+        elif self.canvas:
+            # moved without redrawing, page may be changed
+            self.canvas.page_index.object_changed(self)
+
     def transform(self, tr):
         """ 2D Transform coordinates of object (Atom, Plus, Text, Arrow, Bracket).
         Molecule and Bond has no effect of this """
@@ -148,9 +199,13 @@ class DrawableObject:
         pass
 
     def mark_dirty(self):
-        """ mark as redraw needed """
-        if self.canvas:
-            self.canvas.dirty_objects.add(self)
+        """ schedule redraw of itself and its dependents. see Canvas.mark_dirty() """
+        obj = self
+        # children which are not drawn yet, dont have canvas
+        while not obj.canvas and obj.parent:
+            obj = obj.parent
+        if obj.canvas:
+            obj.canvas.mark_dirty([self])
 
     def delete_from_canvas(self):
         """ unfocus, deselect, unmap focusable, clear graphics"""
@@ -115,11 +115,12 @@ class Ccdx(FileFormat):
             if val:
                 setattr(molecule, attr, val)
         # read atoms, bonds and delocalizations
-        for objtype in ("Atom", "Bond", "Delocalization"):
-            elms = element.getElementsByTagName(objtype.lower())
-            for elm in elms:
-                obj = getattr(self, "read%s"%objtype)(elm)
-                getattr(molecule, "add_%s"%objtype.lower())(obj)
+        with molecule.batch_edit():
+            for objtype in ("Atom", "Bond", "Delocalization"):
+                elms = element.getElementsByTagName(objtype.lower())
+                for elm in elms:
+                    obj = getattr(self, "read%s"%objtype)(elm)
+                    getattr(molecule, "add_%s"%objtype.lower())(obj)
         # read template atom and template bond
         for attr in ("template_atom", "template_bond"):
             obj_id = element.getAttribute(attr)
@@ -83,15 +83,16 @@ class Molfile(FileFormat):
         f.readline()
         # read the structure
         mol = Molecule()
-        # read atom block
-        for i in range( atom_count):
-            a = self.read_atom_line(f)
-            mol.add_atom(a)
-        # read bond block
-        for k in range( bond_count):
-            bond, a1, a2 = self.read_bond_line(f)
-            mol.add_bond(bond)
-            bond.connect_atoms(mol.atoms[a1], mol.atoms[a2])
+        with mol.batch_edit():
+            # read atom block
+            for i in range( atom_count):
+                a = self.read_atom_line(f)
+                mol.add_atom(a)
+            # read bond block
+            for k in range( bond_count):
+                bond, a1, a2 = self.read_bond_line(f)
+                mol.add_bond(bond)
+                bond.connect_atoms(mol.atoms[a1], mol.atoms[a2])
         # read properties block
         for line in f:
             if line.strip() == "M  END":
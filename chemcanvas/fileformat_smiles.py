@@ -54,10 +54,11 @@ class Smiles(FileFormat):
             doc = Document()
             page = doc.add_new_page()
             page.objects.append(mol)
-            self.status = "ok"
+            self.status = self.message and "warning" or "ok"
             return doc
 
     def read_string(self, text):
+        self.reset_status()
         mol = self.get_molecule(text)# newline and whitespaces are handled here
         if not mol:
             return
@@ -65,7 +66,7 @@ class Smiles(FileFormat):
         doc = Document()
         page = doc.add_new_page()
         page.objects.append(mol)
-        self.status = "ok"
+        self.status = self.message and "warning" or "ok"
         return doc
 
     def get_molecule(self, text):
@@ -84,61 +85,63 @@ class Smiles(FileFormat):
         last_bond = None
         numbers = {}
         bracket_openings = []
-        for c in chunks:
-            # atom
-            if is_text.match( c) or c.islower() or c[0] == "[":
-                a = Atom()
-                if c[0] == "[":
-                    # atom spec in square brackets
-                    self._parse_atom_spec( c, a)
-                else:
-                    # just atom symbol
-                    if c.islower():
-                        symbol = c.upper()
-                        a.properties_["aromatic"] = 1
+        with mol.batch_edit():
+            for c in chunks:
+                # atom
+                if is_text.match( c) or c.islower() or c[0] == "[":
+                    a = Atom()
+                    if c[0] == "[":
+                        # atom spec in square brackets
+                        self._parse_atom_spec( c, a)
                     else:
-                        symbol = c
-                    a.set_symbol(symbol)
-
-                mol.add_atom(a)
-                if last_bond: # and not (not "aromatic" in a.properties_ and last_bond.aromatic):
-                    mol.add_bond(last_bond)
-                    last_bond.connect_atoms(last_atom, a)
-                    last_bond = None
-                elif last_atom:
-                    b = mol.new_bond()
-                    if "aromatic" in a.properties_:
-                        b.type = "delocalized"
-                    b.connect_atoms(last_atom, a)
-                last_atom = a
-                last_bond = None
-            # bond
-            elif c in r'-=#:.\/':
-                last_bond = Bond()
-                last_bond.type = self.smiles_to_native_bond_type[ c]
-                if c in r'\/':
-                    last_bond.properties_['stereo'] = c
-                # the atoms will be connected when next atom is found
-            # ring closure
-            elif c.isdigit():
-                if c in numbers:
-                    if last_bond:
-                        b = last_bond
-                    else:
-                        b = Bond()
-                        if "aromatic" in numbers[c].properties_:
+                        # just atom symbol
+                        if c.islower():
+                            symbol = c.upper()
+                            a.properties_["aromatic"] = 1
+                        else:
+                            symbol = c
+                        a.set_symbol(symbol)
+
+                    mol.add_atom(a)
+                    if last_bond: # and not (not "aromatic" in a.properties_ and last_bond.aromatic):
+                        mol.add_bond(last_bond)
+                        last_bond.connect_atoms(last_atom, a)
+                        last_bond = None
+                    elif last_atom:
+                        b = mol.new_bond()
+                        # bond between two aromatic atoms is aromatic
+                        if "aromatic" in a.properties_ and "aromatic" in last_atom.properties_:
                             b.type = "delocalized"
-                    mol.add_bond(b)
-                    b.connect_atoms(last_atom, numbers[c])
+                        b.connect_atoms(last_atom, a)
+                    last_atom = a
                     last_bond = None
-                    del numbers[ c]
-                else:
-                    numbers[c] = last_atom
-                    last_bond = None
-            elif c == '(':
-                bracket_openings.append( last_atom)
-            elif c == ')':
-                last_atom = bracket_openings.pop(-1)
+                # bond
+                elif c in r'-=#:.\/':
+                    last_bond = Bond()
+                    last_bond.type = self.smiles_to_native_bond_type[ c]
+                    if c in r'\/':
+                        last_bond.properties_['stereo'] = c
+                    # the atoms will be connected when next atom is found
+                # ring closure
+                elif c.isdigit():
+                    if c in numbers:
+                        if last_bond:
+                            b = last_bond
+                        else:
+                            b = Bond()
+                            if "aromatic" in numbers[c].properties_ and "aromatic" in last_atom.properties_:
+                                b.type = "delocalized"
+                        mol.add_bond(b)
+                        b.connect_atoms(last_atom, numbers[c])
+                        last_bond = None
+                        del numbers[ c]
+                    else:
+                        numbers[c] = last_atom
+                        last_bond = None
+                elif c == '(':
+                    bracket_openings.append( last_atom)
+                elif c == ')':
+                    last_atom = bracket_openings.pop(-1)
 
         if len(mol.vertices) == 0:
             self.message = "No atom found!"
@@ -159,7 +162,9 @@ class Smiles(FileFormat):
         # stereochemistry
         self._process_stereochemistry( mol)
         if self.localize_aromatic_bonds:
-            mol.localize_aromatic_bonds()
+            failed_atoms = mol.localize_aromatic_bonds()
+            if failed_atoms:
+                self.message = "Could not localize aromatic bonds of %i atom(s)" % len(failed_atoms)
 
         return mol
 
@@ -369,6 +374,8 @@ class Smiles(FileFormat):
         self._stereo_bonds_to_code = {} # for bond it will contain character it uses
         self._stereo_bonds_to_others = {} # for bond it will contain the other bonds
         self._stereo_centers = {}
+        # canonical ranks make the output independent of the order of atoms and bonds
+        self._ranks = mol.canonical_ranks()
         # at first we mark all the atoms with aromatic bonds
         # it is much simple to do it now when all the edges are present
         # we can make use of the properties attribute of the vertex
@@ -427,7 +434,7 @@ class Smiles(FileFormat):
         # disconnect branches until final linear fragment remains
         while not (is_line( mol) and (not start_from or start_from.degree <= 1)):
             if is_pure_ring( mol):# one ring or multple fused rings but no branches
-                self.ring_joins.append( mol.temporarily_disconnect_edge( list( mol.edges)[0]))
+                self.ring_joins.append( mol.temporarily_disconnect_edge( min( mol.edges, key=self._bond_rank)))
             else:
                 e, mol, branch_vertex, branch = self.disconnect_something( mol, start_from=start_from)
                 if branch_vertex:
@@ -438,7 +445,7 @@ class Smiles(FileFormat):
                 else:
                     self.ring_joins.append( e)
         try:
-            start, end = filter( lambda x: x.degree == 1, mol.vertices)
+            start, end = sorted( filter( lambda x: x.degree == 1, mol.vertices), key=self._ranks.get)
         except:
             #print filter( lambda x: x.get_degree() == 1, mol.vertices)
             raise Exception("shit")
@@ -515,7 +522,7 @@ class Smiles(FileFormat):
         """returns (broken edge, resulting mol, atom where mol was disconnected, disconnected branch)"""
         # we cannot do much about this part
         if start_from and start_from.degree != 1:
-            for e,n in start_from.get_neighbor_edge_pairs():
+            for e,n in sorted( start_from.get_neighbor_edge_pairs(), key=lambda x: self._ranks[x[1]]):
                 if n.degree > 2:
                     mol.temporarily_disconnect_edge( e)
                     return e, mol, None, None
@@ -526,13 +533,13 @@ class Smiles(FileFormat):
         # when no non-bridges are present use the other ones
         #
         # the edges with crowded atoms
-        for e in mol.edges:
+        for e in sorted( mol.edges, key=self._bond_rank):
             d1, d2 = [x.degree for x in e.vertices]
             if d1 > 2 and d2 > 2 and not mol.is_edge_a_bridge_fast_and_dangerous( e):
                 mol.temporarily_disconnect_edge( e)
                 return e, mol, None, None
         # the other valuable non-bridge edges
-        for e in mol.edges:
+        for e in sorted( mol.edges, key=self._bond_rank):
             d1, d2 = [x.degree for x in e.vertices]
             if (d1 > 2 or d2 > 2) and not mol.is_edge_a_bridge_fast_and_dangerous( e):
                 mol.temporarily_disconnect_edge( e)
@@ -546,7 +553,7 @@ class Smiles(FileFormat):
         the_right_branch_atom = None
         ring_joints_in_branch = 1000
         ring_join_vertices = set( reduce( operator.add, [e.vertices for e in self.ring_joins], []))
-        for e in mol.edges:
+        for e in sorted( mol.edges, key=self._bond_rank):
             d1, d2 = [x.degree for x in e.vertices]
             if d1 > 2 or d2 > 2: # bridge
                 ps = mol.get_pieces_after_edge_removal( e)
@@ -557,7 +564,7 @@ class Smiles(FileFormat):
                 # and smaller part is considered branch
                 lengths = map( len, ps)
                 ms = min( lengths)
-                p1, p2 = ps
+                p1, p2 = sorted( ps, key=lambda p: min( self._ranks[v] for v in p))
                 the_mol = (len( p1) < len( p2)) and p2 or p1
                 the_branch = (p1 == the_mol) and p2 or p1
                 ring_joints = len( [i for i in the_branch if i in ring_join_vertices])
@@ -580,6 +587,9 @@ class Smiles(FileFormat):
                 the_right_branch_atom,
                 the_right_branch)
 
+    def _bond_rank( self, b):
+        return sorted( self._ranks[v] for v in b.vertices)
+
     def create_bond_smiles( self, b):
         if b.type == "delocalized":
             return ''
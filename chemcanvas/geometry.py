@@ -591,6 +591,12 @@ class Transform:
             ret += [x,y]
         return ret
 
+    def transform_xy_lists( self, xs, ys):
+        """ transforms points given as list of x and list of y values.
+        returns new x list and y list. much faster than transform() for many points """
+        (a, b, c), (d, e, f) = self.mat[0], self.mat[1]
+        return [a*x+b*y+c for x,y in zip(xs, ys)], [d*x+e*y+f for x,y in zip(xs, ys)]
+
 
     def scale(self, scale):
         """ same scaling for both dimensions"""
@@ -3,8 +3,53 @@
 # Copyright (C) 2003-2008 Beda Kosata <beda@zirael.org>
 # Copyright (C) 2022-2026 Arindam Chaudhuri <arindamsoft94@gmail.com>
 from functools import reduce
+from array import array
 import operator, warnings
 import copy
+import time
+
+from common import cached_on, TOPOLOGY
+
+# ring perception engine used by Graph.get_smallest_independent_cycles_e()
+# "vismara" : polynomial time minimum cycle basis from Vismara's prototype cycles
+# "legacy" : breadth first search using generators (exponential for cage compounds)
+# "check" : runs both and warns if the ring sizes differ (result of "vismara" is returned)
+RING_PERCEPTION = "vismara"
+
+# larger relevant cycles are skipped by Graph.get_relevant_cycles_e(), as number of
+# them may grow exponentially (e.g a macrocycle through many para-phenylenes)
+RELEVANT_CYCLE_MAX_SIZE = 24
+
+
+def _bits(n):
+    """ yields positions of set bits of int n """
+    while n:
+        low = n & -n
+        yield low.bit_length() - 1
+        n ^= low
+
+
+def _reduce_cycle(basis, c):
+    """ gaussian elimination step over GF(2). if cycle bitset c is independent
+    of basis ({highest bit : reduced cycle}), adds it and returns True """
+    while c:
+        h = c.bit_length() - 1
+        if h not in basis:
+            basis[h] = c
+            return True
+        c ^= basis[h]
+    return False
+
+
+def _shortest_paths(r, dag):
+    """ returns function which returns all paths from r to a vertex in
+    dag ({vertex : [(predecessor, edge),...]}) as (vertex bitset, edge bitset) """
+    memo = {r: [(1<<r, 0)]}
+    def paths(v):
+        if v not in memo:
+            memo[v] = [(vb | 1<<v, eb | 1<<j) for z,j in dag[v] for vb,eb in paths(z)]
+        return memo[v]
+    return paths
 
 
 class Vertex:
@@ -12,13 +57,21 @@ class Vertex:
     to store data directly in vertex and not get them from the graph connectivity matrix.
     vertex has a value attribute used to store arbitrary object"""
     attrs_to_copy = ()
+    __slots__ = ("_properties", "_neighbors")
 
     def __init__( self):
-        # TODO : rename properties_ to properties
-        self.properties_ = {} # used to store intermediate properties such as distances etc.
+        self._properties = None # created when needed, see properties_
         #self.value = None  # used to store any object associated with the vertex
         self._neighbors = {} # set of all neighbors in {edge:vertex} format
 
+    # TODO : rename properties_ to properties
+    @property
+    def properties_(self):
+        """ used to store intermediate properties such as distances etc. """
+        if self._properties is None:
+            self._properties = {}
+        return self._properties
+
     @property
     def degree(self):
         return len(self.neighbors)
@@ -72,11 +125,18 @@ class Vertex:
 
 class Edge:
     attrs_to_copy = ("disconnected",)
+    __slots__ = ("vertices", "disconnected", "_properties")
 
     def __init__( self):
         self.vertices = []
         self.disconnected = False
-        self.properties_ = {}
+        self._properties = None # created when needed, see properties_
+
+    @property
+    def properties_(self):
+        if self._properties is None:
+            self._properties = {}
+        return self._properties
 
     @property
     def neighbor_edges(self):
@@ -104,6 +164,540 @@ class Edge:
         return other
 
 
+class Adjacency:
+    """ frozen, index based snapshot of graph connectivity in compressed sparse row (CSR) format.
+    neighbors of vertex i are neighbors[offsets[i]:offsets[i+1]], and the edges leading to them
+    are neighbor_edges[offsets[i]:offsets[i+1]]. Edge j connects edge_ends[2*j] and edge_ends[2*j+1].
+    Order of neighbors is same as Vertex.neighbors. Disconnected edges are not included.
+    It is valid only until the next topology change of the graph """
+
+    def __init__(self, vertices, edges):
+        self.vertices = list(vertices)
+        self.index = {v:i for i,v in enumerate(self.vertices)}
+        self.edges = []
+        self.edge_index = {}
+        edges = edges if isinstance(edges, (set,frozenset)) else set(edges)
+        ends = []
+        offsets = [0]
+        neighbors = []
+        neighbor_edges = []
+        for v in self.vertices:
+            for e, n in v._neighbors.items():
+                if e.disconnected or e not in edges or n not in self.index:
+                    continue
+                j = self.edge_index.get(e)
+                if j is None:
+                    j = self.edge_index[e] = len(self.edges)
+                    self.edges.append(e)
+                    ends += [self.index[v], self.index[n]]
+                neighbors.append(self.index[n])
+                neighbor_edges.append(j)
+            offsets.append(len(neighbors))
+        self.edge_ends = array('i', ends)
+        self.offsets = array('i', offsets)
+        self.neighbors = array('i', neighbors)
+        self.neighbor_edges = array('i', neighbor_edges)
+
+    def degree(self, i):
+        return self.offsets[i+1] - self.offsets[i]
+
+    def neighbors_of(self, i):
+        return self.neighbors[self.offsets[i]:self.offsets[i+1]]
+
+    def neighbor_edges_of(self, i):
+        return self.neighbor_edges[self.offsets[i]:self.offsets[i+1]]
+
+    def components(self, skip_edge=None):
+        """ returns list of connected components, each as list of vertex indices.
+        if skip_edge index is given, the graph is treated as if that edge were removed """
+        seen = bytearray(len(self.vertices))
+        offsets, neighbors, neighbor_edges = self.offsets, self.neighbors, self.neighbor_edges
+        comps = []
+        for i in range(len(self.vertices)):
+            if seen[i]:
+                continue
+            seen[i] = 1
+            comp = [i]
+            stack = [i]
+            while stack:
+                k = stack.pop()
+                for p in range(offsets[k], offsets[k+1]):
+                    n = neighbors[p]
+                    if not seen[n] and neighbor_edges[p] != skip_edge:
+                        seen[n] = 1
+                        comp.append(n)
+                        stack.append(n)
+            comps.append(comp)
+        return comps
+
+    def distances_from(self, i):
+        """ breadth-first search from vertex index i. returns array of distances
+        aligned with self.vertices, where unreachable vertices have distance -1 """
+        dist = array('i', [-1]) * len(self.vertices)
+        dist[i] = 0
+        offsets, neighbors = self.offsets, self.neighbors
+        level = [i]
+        d = 0
+        while level:
+            d += 1
+            next_level = []
+            for k in level:
+                for n in neighbors[offsets[k]:offsets[k+1]]:
+                    if dist[n] < 0:
+                        dist[n] = d
+                        next_level.append(n)
+            level = next_level
+        return dist
+
+    def bridges_and_blocks(self):
+        """ finds all bridges and biconnected components (blocks) in a single depth first
+        search (Hopcroft-Tarjan). returns (bridges, blocks), where bridges is a list of edge
+        indices and blocks is a list of edge index lists. a bridge is also a single edge block """
+        nv = len(self.vertices)
+        offsets, neighbors, neighbor_edges = self.offsets, self.neighbors, self.neighbor_edges
+        disc = array('i', [-1]) * nv # discovery time
+        low = array('i', [0]) * nv  # lowest discovery time reachable through back edges
+        bridges, blocks = [], []
+        edge_stack = []
+        time = 0
+        for root in range(nv):
+            if disc[root] >= 0:
+                continue
+            disc[root] = low[root] = time
+            time += 1
+            # each item is [vertex, edge we came through, position of next neighbor]
+            stack = [[root, -1, offsets[root]]]
+            while stack:
+                item = stack[-1]
+                v, came_from, p = item
+                if p < offsets[v+1]:
+                    item[2] += 1
+                    j, w = neighbor_edges[p], neighbors[p]
+                    if j == came_from:
+                        continue
+                    if disc[w] < 0:
+                        edge_stack.append(j)
+                        disc[w] = low[w] = time
+                        time += 1
+                        stack.append([w, j, offsets[w]])
+                    elif disc[w] < disc[v]:# back edge
+                        edge_stack.append(j)
+                        low[v] = min(low[v], disc[w])
+                    continue
+                stack.pop()
+                if not stack:
+                    continue
+                u = stack[-1][0]
+                low[u] = min(low[u], low[v])
+                if low[v] >= disc[u]:
+                    # u separates the subtree of v, so everything above came_from is a block
+                    block = []
+                    while True:
+                        j = edge_stack.pop()
+                        block.append(j)
+                        if j == came_from:
+                            break
+                    blocks.append(block)
+                    if low[v] > disc[u]:
+                        bridges.append(came_from)
+        return bridges, blocks
+
+    def minimum_cycle_basis(self, bridges=None):
+        """ returns minimum cycle basis (SSSR) as set of frozensets of edges, in polynomial time.
+        bridges (set of edges) are found if not given. Candidate cycles are
+        Vismara's prototypes, i.e for each vertex r, cycles made of two shortest paths
+        from r through vertices of lower rank only. They are sorted by size and
+        independent ones are selected by gaussian elimination over GF(2), where each
+        cycle is an int bitset of edge indices.
+        Vismara P., Union of all the minimum cycle bases of a graph,
+        Electron. J. Combin. 4 (1997) R9 """
+        ncycles = len( self.edges) - len( self.vertices) + len( self.components())
+        if ncycles <= 0:
+            return set()
+        candidates = self._cycle_prototypes( bridges)
+
+        # select smallest independent cycles
+        basis = {}# highest bit : reduced cycle
+        cycles = []
+        for c in sorted( candidates, key=lambda c: (candidates[c][0], c)):
+            if _reduce_cycle( basis, c):
+                cycles.append( c)
+            if len( cycles) == ncycles:
+                break
+
+        if len( cycles) < ncycles:
+            warnings.warn( "The number of cycles found (%d) is smaller than the theoretical value %d (|E|-|V|+1)" % (len( cycles), ncycles), UserWarning, 3)
+        return set( frozenset( self.edges[j] for j in _bits( c)) for c in cycles)
+
+    def relevant_cycles(self, bridges=None, max_size=None):
+        """ returns set of relevant cycles (the union of all minimum cycle bases)
+        as frozensets of edges, upto max_size edges if given. Unlike minimum cycle
+        basis, it does not depend on the order of vertices. A prototype is relevant
+        if it is independent of all smaller cycles, then all cycles of its family
+        (same ends, other shortest paths) are relevant too """
+        if len( self.edges) - len( self.vertices) + len( self.components()) <= 0:
+            return set()
+        candidates = self._cycle_prototypes( bridges)
+        basis = {}
+        relevant = []
+        size = 0
+        group = []# independent cycles of current size
+        for c in sorted( candidates, key=lambda c: (candidates[c][0], c)):
+            if max_size and candidates[c][0] > max_size:
+                break
+            if candidates[c][0] != size:
+                # cycles of same size must not be reduced by each other
+                for g in group:
+                    _reduce_cycle( basis, g)
+                size, group = candidates[c][0], []
+            if _reduce_cycle( dict( basis), c):
+                group.append( c)
+                relevant.append( c)
+        cycles = set()
+        for c in relevant:
+            size, paths, r, p, q, closing = candidates[c]
+            for vp, ep in paths( p):
+                for vq, eq in paths( q):
+                    if vp & vq == 1<<r:
+                        cycles.add( ep | eq | closing)
+        return set( frozenset( self.edges[j] for j in _bits( c)) for c in cycles)
+
+    def _cycle_prototypes(self, bridges=None):
+        """ returns {cycle : (size, paths, r, p, q, closing)} for Vismara's prototypes,
+        where cycle is bitset of edges, made of shortest paths from r to p and q,
+        and closing edges. paths(v) returns all shortest paths from r to v as
+        (vertex bitset, edge bitset) pairs """
+        if bridges is None:
+            bridges = set( self.edges[j] for j in self.bridges_and_blocks()[0])
+        offsets, neighbors, neighbor_edges = self.offsets, self.neighbors, self.neighbor_edges
+        ring_edge = bytearray( 0 if e in bridges else 1 for e in self.edges)
+        # vertices are ranked by degree (among ring edges), ties are broken by index
+        nv = len( self.vertices)
+        degree = [sum( ring_edge[j] for j in self.neighbor_edges_of(i)) for i in range( nv)]
+        order = sorted( (i for i in range( nv) if degree[i] > 1), key=lambda i: (degree[i], i))
+        rank = array( 'i', [-1]) * nv
+        for k, i in enumerate( order):
+            rank[i] = k
+
+        candidates = {}
+        for r in order:
+            # breadth first search from r, restricted to shortest paths going only
+            # through vertices of lower rank. each reached vertex keeps one path
+            # as bitsets of vertices and edges
+            dist = {r:0}
+            vpath = {r:1<<r}
+            epath = {r:0}
+            level = [r]
+            reached = []
+            while level:
+                next_level = []
+                for v in level:
+                    for p in range( offsets[v], offsets[v+1]):
+                        j, n = neighbor_edges[p], neighbors[p]
+                        if not ring_edge[j] or rank[n] >= rank[r] or n in dist:
+                            continue
+                        dist[n] = dist[v] + 1
+                        vpath[n] = vpath[v] | 1<<n
+                        epath[n] = epath[v] | 1<<j
+                        next_level.append( n)
+                reached += next_level
+                level = next_level
+            # the vertices not reachable through lower rank vertices by a shortest path
+            # in whole graph are dropped (dist here may be longer than real distance)
+            real_dist = self.distances_from( r)
+            for y in reached:
+                if dist[y] != real_dist[y]:
+                    del dist[y]
+            dag = {}# vertex : all (predecessor, edge) on shortest paths
+            paths = _shortest_paths( r, dag)
+            for y in reached:
+                if y not in dist:
+                    continue
+                preds = dag[y] = []
+                for p in range( offsets[y], offsets[y+1]):
+                    j, z = neighbor_edges[p], neighbors[p]
+                    if not ring_edge[j] or z not in dist:
+                        continue
+                    if dist[z] + 1 == dist[y]:
+                        preds.append( (z,j))
+                    elif dist[z] == dist[y] and rank[z] < rank[y] and vpath[y] & vpath[z] == 1<<r:
+                        # odd cycle
+                        c = epath[y] | epath[z] | 1<<j
+                        candidates[c] = (2*dist[y] + 1, paths, r, y, z, 1<<j)
+                for k, (p, j1) in enumerate( preds):
+                    for q, j2 in preds[k+1:]:
+                        if vpath[p] & vpath[q] == 1<<r:
+                            # even cycle
+                            c = epath[p] | epath[q] | 1<<j1 | 1<<j2
+                            candidates[c] = (2*dist[y], paths, r, p, q, 1<<j1 | 1<<j2)
+        return candidates
+
+
+
+class _EdgeMask:
+    """ mutable view over an Adjacency, where edges can be removed and restored
+    without modifying the graph (an alternative to temporarily_disconnect_edge()) """
+
+    def __init__(self, adj):
+        self.adj = adj
+        self.alive = bytearray(b'\x01') * len(adj.edges)
+        self.degree = array('i', [adj.degree(i) for i in range(len(adj.vertices))])
+
+    def disconnect(self, j):
+        if self.alive[j]:
+            self.alive[j] = 0
+            self.degree[self.adj.edge_ends[2*j]] -= 1
+            self.degree[self.adj.edge_ends[2*j+1]] -= 1
+
+    def reconnect(self, j):
+        if not self.alive[j]:
+            self.alive[j] = 1
+            self.degree[self.adj.edge_ends[2*j]] += 1
+            self.degree[self.adj.edge_ends[2*j+1]] += 1
+
+    def neighbor_edge_pairs(self, i):
+        adj, alive = self.adj, self.alive
+        for k in range(adj.offsets[i], adj.offsets[i+1]):
+            if alive[adj.neighbor_edges[k]]:
+                yield adj.neighbor_edges[k], adj.neighbors[k]
+
+    def neighbors(self, i):
+        return [n for j,n in self.neighbor_edge_pairs(i)]
+
+    def first_edge(self, i):
+        for j, n in self.neighbor_edge_pairs(i):
+            return j
+
+    def strip_terminal_edges(self):
+        """ repeatedly disconnect edges of vertices with degree 1 """
+        degree = self.degree
+        vs1 = [i for i in range(len(degree)) if degree[i] == 1]
+        while vs1:
+            for i in vs1:
+                # we have to ask the degree, because the edge might have been stripped in this run
+                if degree[i]:
+                    self.disconnect(self.first_edge(i))
+            vs1 = [i for i in range(len(degree)) if degree[i] == 1]
+
+    def strip_bridges(self):
+        """ strip all edges that are bridge, thus leaving only the cycles connected.
+        removing a bridge never changes whether other edges are bridges or not,
+        so all of them can be removed at once """
+        bridges, blocks = self.adj.bridges_and_blocks()
+        for j in bridges:
+            self.disconnect(j)
+
+    def smallest_cycles_gen(self, v, to_reach=None, came_from=None, went_through=None):
+        """ingenious generator-based breadth-first search (BFS) to find smallest
+        cycles for given vertex. It yields None or cycles for each depth level"""
+        ret = []
+        for e, neigh in self.neighbor_edge_pairs(v):
+            if neigh == to_reach and e != came_from:
+                ret.append( frozenset( [e] if came_from is None else [came_from, e]))
+        yield ret
+
+        gens = []
+        w = went_through and went_through+[v] or [v]
+        for e, neigh in self.neighbor_edge_pairs(v):
+            # we dont want to go back, therefore we use went_through
+            if (not went_through or neigh not in went_through) and not e == came_from:
+                gens.append( self.smallest_cycles_gen( neigh, to_reach=to_reach, came_from=e, went_through=w))
+        while 1:
+            all_rets = []
+            for gen in gens:
+                rets = next(gen)
+                if rets:
+                    if came_from is not None:
+                        rets = [ret | {came_from} for ret in rets]
+                    all_rets.extend( frozenset( rets))
+            yield all_rets
+
+
+
+class RingStore:
+    """ smallest set of smallest rings of a graph, kept up to date while edges are
+    added or removed, instead of perceiving all rings again after every edit.
+    cycles are frozensets of edges. edge_rings and vertex_rings map each edge and
+    vertex to the set of cycles containing it """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.cycles = set()
+        self.edge_rings = {}
+        self.vertex_rings = {}
+        self.ring_vertices = {}# cycle : frozenset of vertices
+        for cycle in graph.get_smallest_independent_cycles_e():
+            self._add_cycle( cycle)
+
+    def _add_cycle(self, cycle):
+        self.cycles.add( cycle)
+        vertices = frozenset( v for e in cycle for v in e.vertices)
+        self.ring_vertices[cycle] = vertices
+        for e in cycle:
+            self.edge_rings.setdefault( e, set()).add( cycle)
+        for v in vertices:
+            self.vertex_rings.setdefault( v, set()).add( cycle)
+
+    def _remove_cycle(self, cycle):
+        self.cycles.remove( cycle)
+        for e in cycle:
+            self.edge_rings[e].discard( cycle)
+            if not self.edge_rings[e]:
+                del self.edge_rings[e]
+        for v in self.ring_vertices.pop( cycle):
+            self.vertex_rings[v].discard( cycle)
+            if not self.vertex_rings[v]:
+                del self.vertex_rings[v]
+
+    def _shortest_path(self, v1, v2, without):
+        """ returns list of edges of a shortest path from v1 to v2, not using edge 'without' """
+        edges = self.graph.edges
+        came_from = {v1:None}
+        level = [v1]
+        while level and v2 not in came_from:
+            next_level = []
+            for v in level:
+                for e, n in v._neighbors.items():
+                    if e is without or e.disconnected or e not in edges or n in came_from:
+                        continue
+                    came_from[n] = (v, e)
+                    next_level.append( n)
+            level = next_level
+        if v2 not in came_from:
+            return None
+        path = []
+        v = v2
+        while came_from[v]:
+            v, e = came_from[v]
+            path.append( e)
+        return path
+
+    def edge_added(self, e):
+        """ must be called after the edge is connected and added to the graph """
+        if e in self.edge_rings:
+            return
+        v1, v2 = e.vertices
+        path = self._shortest_path( v1, v2, e)
+        if path is None:# e is a bridge
+            return
+        new = frozenset( path + [e])
+        system = self._ring_system( self.vertex_rings.get( v, set()) for v in self._vertices_of( new))
+        if all( len( cycle) <= len( new) for cycle in system):
+            # new cycle can not make any of the existing cycles smaller
+            self._add_cycle( new)
+        else:
+            self._rebuild( system, new)
+
+    def edge_removed(self, e):
+        """ must be called before the edge is disconnected or removed from the graph """
+        rings = self.edge_rings.get( e)
+        if not rings:
+            return
+        if len( rings) == 1:
+            # remaining cycles are still the smallest independent ones
+            self._remove_cycle( next( iter( rings)))
+            return
+        system = self._ring_system( [rings])
+        self._rebuild( system, (), without=e)
+
+    def _vertices_of(self, edges):
+        return set( v for e in edges for v in e.vertices)
+
+    def _ring_system(self, ring_sets):
+        """ returns set of cycles connected (by sharing vertices) to the given cycles """
+        system = set()
+        to_go = set()
+        for rings in ring_sets:
+            to_go |= rings
+        while to_go:
+            cycle = to_go.pop()
+            system.add( cycle)
+            for v in self.ring_vertices[cycle]:
+                to_go |= self.vertex_rings[v] - system
+        return system
+
+    def _rebuild(self, system, extra_edges, without=None):
+        """ perceive the rings of a ring system again, as edges are added or removed in it """
+        edges = set( extra_edges)
+        for cycle in system:
+            edges |= cycle
+            self._remove_cycle( cycle)
+        edges.discard( without)
+        vertices = self._vertices_of( edges)
+        adj = Adjacency( [v for v in self.graph.vertices if v in vertices], edges)
+        for cycle in adj.minimum_cycle_basis():
+            self._add_cycle( cycle)
+
+
+class ComponentTracker:
+    """ disjoint-set (union-find) index of connected components of a graph. Adding an edge
+    merges two components in nearly constant time, and removing an edge recounts only
+    the component it belongs to """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.parent = {}
+        self.count = 0
+        adj = graph.adjacency()
+        for comp in adj.components():
+            root = adj.vertices[comp[0]]
+            for i in comp:
+                self.parent[adj.vertices[i]] = root
+            self.count += 1
+
+    def find(self, v):
+        root = v
+        while self.parent[root] is not root:
+            root = self.parent[root]
+        # path compression
+        while self.parent[v] is not root:
+            self.parent[v], v = root, self.parent[v]
+        return root
+
+    def vertex_added(self, v):
+        if v not in self.parent:
+            self.parent[v] = v
+            self.count += 1
+
+    def vertex_removed(self, v):
+        """ returns False if the vertex could not be removed, as other vertices are linked to it """
+        if self.parent.get( v) is not v or v.degree:
+            return False
+        del self.parent[v]
+        self.count -= 1
+        return True
+
+    def edge_added(self, e):
+        r1, r2 = [self.find( v) for v in e.vertices]
+        if r1 is not r2:
+            self.parent[r2] = r1
+            self.count -= 1
+
+    def edge_removed(self, e):
+        """ must be called before the edge is disconnected or removed from the graph """
+        v1, v2 = e.vertices
+        side1 = self._reachable( v1, e)
+        if v2 in side1:
+            return
+        # component is broken into two, each side gets a new root
+        for v in side1:
+            self.parent[v] = v1
+        for v in self._reachable( v2, e):
+            self.parent[v] = v2
+        self.count += 1
+
+    def _reachable(self, v, without):
+        edges = self.graph.edges
+        seen = {v}
+        stack = [v]
+        while stack:
+            for e, n in stack.pop()._neighbors.items():
+                if e is not without and not e.disconnected and e in edges and n not in seen:
+                    seen.add( n)
+                    stack.append( n)
+        return seen
+
+
 
 class Graph:
     """ provides a minimalistic graph implementation suitable for analysis of chemical problems,
@@ -119,13 +713,23 @@ class Graph:
         self.edges = set()              # this is overriden by Molecule.bonds
         self.disconnected_edges = set()
         self._cache = {}
+        # incremented on every topology change, used by common.cached_on()
+        self.topology_version = 0
+        self._memo = {}
+        # RingStore and ComponentTracker are not part of _cache, as they are
+        # updated on topology change instead of being flushed
+        self._ring_store = None
+        self._components = None
 
     def _flush_cache( self):
         """ clear cache. TODO : replace all _flush_cache with self._cache.clear() """
         self._cache = {}
+        self.topology_version += 1
 
     def clear_cache(self):
+        """ called on every topology change """
         self._cache.clear()
+        self.topology_version += 1
 
 
     def edge_subgraph_to_vertex_subgraph( self, cycle):
@@ -137,27 +741,35 @@ class Graph:
         return ret
 
 
+    def adjacency(self):
+        """ returns the cached Adjacency (CSR) view of the graph. It stays valid
+        until the next topology change, which clears the cache """
+        try:
+            return self._cache['adjacency']
+        except KeyError:
+            self._cache['adjacency'] = self.freeze()
+            return self._cache['adjacency']
+
+    def freeze(self):
+        """ returns a new Adjacency snapshot of current connectivity """
+        return Adjacency(self.vertices, self.edges)
+
+
     def get_connected_components( self):
         """ returns the connected components of graph as list of set of vertices"""
-        comp = set() # just processed component
-        not_processed = set( self.vertices)
-        recent = set() # [not_processed.pop()]
-        while not_processed:
-            recent = set( reduce( operator.add, [v.neighbors for v in recent], [])) & not_processed
-            if not recent:
-                if comp:
-                    yield comp
-                recent = set( [not_processed.pop()])
-                comp = recent
-            else:
-                comp.update( recent)
-                not_processed -= recent
-        # when there is only one atom in the last piece it is not yielded in the loop
-        yield comp
+        adj = self.adjacency()
+        if not adj.vertices:
+            yield set()
+            return
+        for comp in adj.components():
+            yield set( adj.vertices[i] for i in comp)
 
 
     def is_connected(self):
         """ Check if all components of the Graph is connected """
+        # temporarily disconnected edges are not tracked by ComponentTracker
+        if not self.disconnected_edges:
+            return self.get_component_tracker().count <= 1
         if len( self.edges) < len( self.vertices) - 1:
             # in this case it cannot be connected
             return False
@@ -190,10 +802,43 @@ class Graph:
         self._flush_cache()
 
     def get_pieces_after_edge_removal(self, e):
-        self.temporarily_disconnect_edge( e)
-        ps = [i for i in self.get_connected_components()]
-        self.reconnect_temporarily_disconnected_edge( e)
-        return ps
+        """ returns the connected components (list of set of vertices) that the graph
+        would have if the edge was removed. the graph itself is not modified """
+        adj = self.adjacency()
+        # removing a non-bridge edge does not change the components
+        skip = adj.edge_index[e] if e in self.get_bridges() else None
+        return [set( adj.vertices[i] for i in comp) for comp in adj.components( skip_edge=skip)]
+
+
+    def get_bridges(self):
+        """ returns set of edges which are not part of any cycle, i.e removing any of
+        them increases the number of connected components. cached until next topology change """
+        try:
+            return self._cache['bridges']
+        except KeyError:
+            self._find_bridges_and_blocks()
+            return self._cache['bridges']
+
+    def get_biconnected_components(self):
+        """ returns list of biconnected components (blocks) as sets of edges. a block with
+        single edge is a bridge, others are ring systems. cached until next topology change """
+        try:
+            return self._cache['blocks']
+        except KeyError:
+            self._find_bridges_and_blocks()
+            return self._cache['blocks']
+
+    def _find_bridges_and_blocks(self):
+        adj = self.adjacency()
+        bridges, blocks = adj.bridges_and_blocks()
+        self._cache['bridges'] = set( adj.edges[j] for j in bridges)
+        self._cache['blocks'] = [set( adj.edges[j] for j in block) for block in blocks]
+
+    def distances_from( self, v):
+        """ returns array of distances (number of edges) of all vertices from vertex v.
+        it is aligned with self.vertices, and unreachable vertices have distance -1 """
+        adj = self.adjacency()
+        return adj.distances_from( adj.index[v])
 
     def clean_distance_from_vertices( self):
         for i in self.vertices:
@@ -204,104 +849,65 @@ class Graph:
 
 
     def mark_vertices_with_distance_from( self, v):
-        """returns the maximum d"""
+        """returns the maximum d. prefer distances_from(), which does not modify vertices"""
         self.clean_distance_from_vertices()
+        adj = self.adjacency()
+        dist = adj.distances_from( adj.index[v])
         d = 0
-        to_mark = set([v])
-        while to_mark:
-            to_mark_next = set()
-            for i in to_mark:
-                i.properties_['d'] = d
-
-            for i in to_mark:
-                for j in i.neighbors:
-                    if 'd' not in j.properties_:
-                        to_mark_next.add( j)
-
-            to_mark = to_mark_next
-            d += 1
-
-        return d-1
+        for i, vertex in enumerate( adj.vertices):
+            if dist[i] >= 0:
+                vertex.properties_['d'] = dist[i]
+                d = max( d, dist[i])
+        return d
 
 
     def is_edge_a_bridge( self, e):
         """ tells whether an edge is not ring memmber """
-        start = e.vertices[0]
-        # find number of vertices accessible from one of the edge endpoints
-        self.mark_vertices_with_distance_from( start)
-        c1 = len( [v for v in self.vertices if 'd' in v.properties_])
-        # disconnect the eddge
-        self.temporarily_disconnect_edge( e)
-        # find the number of vertices accessible now
-        self.mark_vertices_with_distance_from( start)
-        c2 = len( [v for v in self.vertices if 'd' in v.properties_])
-        self.reconnect_temporarily_disconnected_edge( e)
-        # if they differ, we've got a bridge
-        if c1 > c2:
-            return True
-        return False
+        return e in self.get_bridges()
 
 
     def temporarily_strip_bridge_edges( self):
         """strip all edges that are bridge, thus leaving only the cycles connected """
-        bridge_found = True
-        while bridge_found:
-            vs = [v for v in self.vertices if v.degree == 1]
-            while vs:
-                for v in vs:
-                    # we have to ask the degree, because the bond might have been stripped in this run
-                    if v.degree:
-                        e = v.neighbor_edges[0]
-                        self.temporarily_disconnect_edge( e)
-                vs = [v for v in self.vertices if v.degree == 1]
-
-            bridge_found = False
-            for e in self.edges:
-                if self.is_edge_a_bridge( e):
-                    bridge_found = True
-                    break
-            if bridge_found:
-                self.temporarily_disconnect_edge( e)
-
-
-    def _get_smallest_cycles_for_vertex( self, v, to_reach=None, came_from=None, went_through=None):
-        """ingenious generator-based breadth-first search (BFS) to find smallest
-        cycles for given vertex. It yields None or cycles for each depth level"""
-        ret = []
-        for e, neigh in v.get_neighbor_edge_pairs():
-            if neigh == to_reach and e != came_from:
-                ret.append( frozenset( [came_from, e]))
-        yield ret
-
-        gens = []
-        w = went_through and went_through+[v] or [v]
-        for e, neigh in v.get_neighbor_edge_pairs():
-            # we dont want to go back, therefore we use went_through
-            if (not went_through or neigh not in went_through) and not e == came_from:
-                gens.append( self._get_smallest_cycles_for_vertex( neigh, to_reach=to_reach, came_from=e, went_through=w))
-        while 1:
-            all_rets = []
-            for gen in gens:
-                rets = next(gen)
-                new_rets = []
-                if rets:
-                    for ret in rets:
-                        if came_from:
-                            ret = set( ret)
-                            ret.update( set( [came_from]))
-                            ret = frozenset( ret)
-                        new_rets.append( ret)
-                    all_rets.extend( frozenset( new_rets))
-            yield all_rets
+        for e in list( self.get_bridges()):
+            self.temporarily_disconnect_edge( e)
 
 
+    @cached_on(TOPOLOGY)
     def get_smallest_independent_cycles_e( self):
         """returns a set of smallest possible independent cycles as list of Sets of edges,
         other cycles in graph are guaranteed to be combinations of them.
+        The engine is selected by module level RING_PERCEPTION """
+        if RING_PERCEPTION == "legacy":
+            return self._get_smallest_independent_cycles_e_legacy()
+        cycles = self._get_smallest_independent_cycles_e_vismara()
+        if RING_PERCEPTION == "check":
+            old_cycles = self._get_smallest_independent_cycles_e_legacy()
+            sizes = sorted( map( len, cycles))
+            old_sizes = sorted( map( len, old_cycles))
+            if sizes != old_sizes:
+                warnings.warn( "Ring perception mismatch : vismara %s, legacy %s" % (sizes, old_sizes), UserWarning, 2)
+        return cycles
+
+
+    @cached_on(TOPOLOGY)
+    def get_relevant_cycles_e( self):
+        """ returns set of relevant cycles as frozensets of edges, i.e all cycles
+        which can be member of a minimum cycle basis, upto RELEVANT_CYCLE_MAX_SIZE.
+        Unlike smallest independent cycles, they do not depend on the order of vertices """
+        return self.adjacency().relevant_cycles( self.get_bridges(), RELEVANT_CYCLE_MAX_SIZE)
+
+
+    def _get_smallest_independent_cycles_e_vismara( self):
+        return self.adjacency().minimum_cycle_basis( self.get_bridges())
+
+
+    def _get_smallest_independent_cycles_e_legacy( self):
+        """ generator based breadth first search to find smallest independent cycles.
         Gasteiger J. (Editor), Engel T. (Editor), Chemoinformatics : A Textbook,
         John Wiley & Sons 2001, ISBN 3527306811, 174."""
         assert self.is_connected()
-        ncycles = len( self.edges) - len( self.vertices) + 2 - len( list( self.get_connected_components()))
+        adj = self.adjacency()
+        ncycles = len( adj.edges) - len( adj.vertices) + 2 - len( adj.components())
 
         # check if the graph is connected, don't know if we should do it...
         if ncycles < 0:
@@ -312,53 +918,55 @@ class Graph:
         if ncycles == 0:
             return set()
 
-        # the code itself
-        self.temporarily_strip_bridge_edges()
+        # the code itself. edges are removed from the mask instead of the graph
+        mask = _EdgeMask( adj)
+        mask.strip_bridges()
+        degree = mask.degree
         cycles = set()
 
-        vs = [v for v in self.vertices if v.degree]
+        vs = [v for v in range( len( adj.vertices)) if degree[v]]
         while vs and len( cycles) < ncycles:
             new_cycles = set()
-            vs2 = [v for v in vs if v.degree == 2]
+            vs2 = [v for v in vs if degree[v] == 2]
             # disconnect something if there are no vertices of degree 2
             removed_e = None
             if not vs2:
                 for v in vs:
-                    if v.degree == 3:
-                        removed_e = list( v.neighbor_edges)[0]
-                        self.temporarily_disconnect_edge( removed_e)
+                    if degree[v] == 3:
+                        removed_e = mask.first_edge( v)
+                        mask.disconnect( removed_e)
                         break
-            vs2 = [v for v in vs if v.degree == 2]
+            vs2 = [v for v in vs if degree[v] == 2]
             assert len( vs2) > 0
             # get rings for all degree==2 vertices
             for v in vs2:
-                gen = self._get_smallest_cycles_for_vertex( v, to_reach=v)
+                gen = mask.smallest_cycles_gen( v, to_reach=v)
                 for x in gen:
                     if x:
                         new_cycles.update( set( x))
                         break
-            if removed_e:
+            if removed_e is not None:
                 # we removed an edge - we need to check what cycles it would influence
                 # we can also assume that there are only two vertices with degree 2
                 # after the removal of this edge and these are the end vertices
                 # therefore the code to detect longest path of degree 2 vertices is
                 # superfluous
-                to_disconnect = [list( removed_e.vertices[0].neighbor_edges)[0]]
+                to_disconnect = [mask.first_edge( adj.edge_ends[2*removed_e])]
                 # reconnect the edge removed on the top
-                if removed_e:
-                    self.reconnect_temporarily_disconnected_edge( removed_e)
+                mask.reconnect( removed_e)
             else:
                 # strip the cycles
                 to_disconnect = set()
                 for cycle in new_cycles:
                     # find the longest degree==2 chain in each cycle
                     paths = set()
-                    to_go = set( [v for v in self.edge_subgraph_to_vertex_subgraph( cycle) if v.degree == 2])
+                    cycle_vertices = set( adj.edge_ends[2*j+k] for j in cycle for k in (0,1))
+                    to_go = set( [v for v in cycle_vertices if degree[v] == 2])
                     while to_go:
                         now = set( [to_go.pop()])
                         path = set( now)
                         while now:
-                            now = reduce( operator.or_, [set( [n for n in v.neighbors if n.degree == 2]) for v in now], set())
+                            now = set( [n for v in now for n in mask.neighbors( v) if degree[n] == 2])
                             now &= to_go
                             to_go -= now
                             path.update( now)
@@ -368,31 +976,22 @@ class Graph:
                     path = [p for p in paths if len( p) == l][0]
                     # now mark them for disconnection
                     v1 = set( path).pop()
-                    to_disconnect.add( list( v1.neighbor_edges)[0])
+                    to_disconnect.add( mask.first_edge( v1))
             # disconnect what needs to be disconnected
-            [self.temporarily_disconnect_edge( e) for e in to_disconnect]
+            [mask.disconnect( e) for e in to_disconnect]
 
             # add new_cycles to cycles
             cycles.update( new_cycles)
 
             # strip the degree==1 vertices
-            vs1 = [v for v in self.vertices if v.degree == 1]
-            while vs1:
-                for v in vs1:
-                    # we have to ask the degree, because the bond might have been stripped in this run
-                    if v.degree:
-                        e = v.neighbor_edges[0]
-                        self.temporarily_disconnect_edge( e)
-                vs1 = [v for v in self.vertices if v.degree == 1]
+            mask.strip_terminal_edges()
 
-            vs = [v for v in self.vertices if v.degree]
+            vs = [v for v in range( len( adj.vertices)) if degree[v]]
 
         # remove extra cycles in some cases like adamantane
         if len( cycles) - ncycles > 0:
             # sort cycles according to length
-            cs = [(len( c), c) for c in cycles]
-            cs.sort()
-            cs = [c[1] for c in cs]
+            cs = sorted( cycles, key=lambda c: (len( c), sorted( c)))
             # now try to remove the biggest ones
             while len( cs) - ncycles > 0:
                 c = set( cs.pop( -1))
@@ -406,9 +1005,7 @@ class Graph:
         elif len( cycles) > ncycles:
             warnings.warn( "The number of independent cycles found (%d) is larger than the theoretical value %d (|E|-|V|+1), but I cannot improve it." % (len( cycles), ncycles), UserWarning, 2)
 
-        self.reconnect_temporarily_disconnected_edges()
-
-        return cycles
+        return set( frozenset( adj.edges[j] for j in c) for c in cycles)
 
 
     def get_smallest_independent_cycles( self):
@@ -419,13 +1016,63 @@ class Graph:
 
 
     def get_smallest_independent_cycles_dangerous_and_cached( self):
-        try:
-            #print("number of cached rings", len(self._cache['cycles']))
-            return self._cache['cycles']
-        except KeyError:
-            self._cache['cycles'] = self.get_smallest_independent_cycles()
-            #print("number of rings", len(self._cache['cycles']))
-            return self._cache['cycles']
+        store = self.get_ring_store()
+        return [store.ring_vertices[c] for c in store.cycles]
+
+    def get_ring_store( self):
+        """ returns the incrementally maintained RingStore, which is created on first use """
+        if self._ring_store is None:
+            self._ring_store = RingStore( self)
+        return self._ring_store
+
+    def get_component_tracker( self):
+        """ returns the incrementally maintained ComponentTracker, which is created on first use """
+        if self._components is None:
+            self._components = ComponentTracker( self)
+        return self._components
+
+    def invalidate_topology_stores( self):
+        """ drops RingStore and ComponentTracker, they are rebuilt when needed """
+        self._ring_store = None
+        self._components = None
+
+    def on_vertex_added( self, v):
+        if self._components is not None:
+            self._components.vertex_added( v)
+
+    def on_vertex_removed( self, v):
+        if self._components is not None and not self._components.vertex_removed( v):
+            self._components = None
+
+    def on_edge_connected( self, e):
+        """ updates the ring store and component tracker if they exist,
+        after e is connected and added to graph """
+        if e not in self.edges:
+            return
+        if self._ring_store is not None:
+            self._ring_store.edge_added( e)
+        if self._components is not None:
+            self._components.edge_added( e)
+
+    def on_edge_disconnected( self, e):
+        """ updates the ring store and component tracker if they exist,
+        before e is disconnected or removed """
+        if e not in self.edges:
+            return
+        if self._ring_store is not None:
+            self._ring_store.edge_removed( e)
+        if self._components is not None:
+            self._components.edge_removed( e)
+
+    def get_rings_of_edge( self, e):
+        """ returns list of smallest rings (as sets of vertices) containing the edge """
+        store = self.get_ring_store()
+        return [store.ring_vertices[c] for c in store.edge_rings.get( e, ())]
+
+    def get_rings_of_vertex( self, v):
+        """ returns list of smallest rings (as sets of vertices) containing the vertex """
+        store = self.get_ring_store()
+        return [store.ring_vertices[c] for c in store.vertex_rings.get( v, ())]
 
     def add_vertex( self, v=None):
         """adds a vertex to a graph, if v argument is not given creates a new one.
@@ -438,6 +1085,7 @@ class Graph:
             print("Added vertex is already present in graph %s" % str(v))
             return None
         self._flush_cache()
+        self.on_vertex_added( v)
         return v
 
 
@@ -459,6 +1107,7 @@ class Graph:
         v1.add_neighbor(v2, e)
         v2.add_neighbor(v1, e)
         self._flush_cache()
+        self.invalidate_topology_stores()
         return e
 
     def vertex_subgraph_to_edge_subgraph(self, cycle):
@@ -511,38 +1160,44 @@ class Graph:
                 return 0
 
 
+    def edge_distances_from( self, e1):
+        """ returns {edge: distance} for all edges reachable from edge e1,
+        where neighbor edges have distance 1 """
+        dist = {e1: 0}
+        new = [e1]
+        d = 0
+        while new:
+            d += 1
+            new_new = []
+            for e in new:
+                for ne in e.neighbor_edges:
+                    if ne not in dist:
+                        dist[ne] = d
+                        new_new.append( ne)
+            new = new_new
+        return dist
+
     def mark_edges_with_distance_from( self, e1):
+        """ prefer edge_distances_from(), which does not modify edges """
         for e in self.edges:
             try:
-                del e.properties_['d']
+                del e.properties_['dist']
             except KeyError:
                 pass
-        marked = set( [e1])
-        new = set( [e1])
-        dist = 0
-        e1.properties_['dist'] = dist
-        while new:
-            new_new = set()
-            dist += 1
-            for e in new:
-                for ne in e.neighbor_edges:
-                    if not ne in marked:
-                        ne.properties_['dist'] = dist
-                        new_new.add( ne)
-            new = new_new
-            marked.update( new)
+        for e, d in self.edge_distances_from( e1).items():
+            e.properties_['dist'] = d
 
     def get_path_between_edges( self, e1, e2):
-        self.mark_edges_with_distance_from( e1)
-        if not "dist" in e2.properties_:
+        """ returns shortest path from e2 to e1 as list of edges, or None if not connected """
+        dist = self.edge_distances_from( e1)
+        if e2 not in dist:
             return None
-        else:
-            path = [e2]
-            _e = e2
-            for i in range( e2.properties_['dist']-1, -1, -1):
-                _e = [ee for ee in _e.neighbor_edges if ee.properties_['dist'] == i][0]
-                path.append( _e)
-            return path
+        path = [e2]
+        _e = e2
+        for i in range( dist[e2]-1, -1, -1):
+            _e = [ee for ee in _e.neighbor_edges if dist.get( ee) == i][0]
+            path.append( _e)
+        return path
 
     def is_tree( self):
         return self.is_connected() and len( self.vertices)-1 == len( self.edges)
@@ -554,34 +1209,280 @@ class Graph:
 
     def sort_vertices_in_path( self, path, start_from=None):
         """returns None if there is no path"""
-        rng = copy.copy( path)
+        adj = self.adjacency()
+        rng = set( adj.index[v] for v in path)
         if start_from:
-            a = start_from
+            a = adj.index[start_from]
             rng.remove( a)
         else:
             a = None
             # for acyclic path we need to find one end
             for at in path:
-                if len( [v for v in at.neighbors if v in path]) == 1:
-                    a = at
-                    rng.remove( at)
+                i = adj.index[at]
+                if len( [n for n in adj.neighbors_of( i) if n in rng]) == 1:
+                    a = i
                     break
-            if not a:
-                a = rng.pop() # for rings
+            if a is None:
+                a = adj.index[copy.copy( path).pop()] # for rings
+            rng.remove( a)
         out = [a]
         while rng:
-            try:
-                a = [i for i in a.neighbors if i in rng][0]
-            except IndexError:
+            for n in adj.neighbors_of( a):
+                if n in rng:
+                    a = n
+                    break
+            else:
                 return None
             out.append( a)
             rng.remove( a)
-        return out
+        return [adj.vertices[i] for i in out]
 
     def defines_connected_subgraph_v(self, vertices):
         sub = self.get_new_induced_subgraph( vertices, self.vertex_subgraph_to_edge_subgraph( vertices))
         return sub.is_connected()
 
+    def canonical_ranking( self, vertex_invariant, edge_invariant):
+        """ Morgan's extended connectivity refinement, with ties broken by
+        individualization-refinement search, which keeps the labeling giving
+        lexicographically smallest graph. vertex_invariant(v) and edge_invariant(e)
+        must return comparable values. returns {vertex: rank} where ranks are
+        unique integers from 0, independent of vertex order """
+        nbrs = {v: [(edge_invariant(e), n) for (e,n) in v.get_neighbor_edge_pairs()]
+                        for v in self.vertices}
+
+        def start_ranks(keys):
+            # rank of a vertex is the number of vertices having smaller key,
+            # so that vertices of same rank occupy the ranks from it
+            values = sorted(keys.values())
+            starts = {}
+            for i,k in enumerate(values):
+                starts.setdefault(k, i)
+            return {v: starts[k] for v,k in keys.items()}
+
+        def refine(ranks, changed):
+            # split classes of tied vertices by sorted (edge, neighbor rank) pairs,
+            # until it does not change. only the classes of neighbors of the
+            # vertices whose rank changed are checked
+            cells = {}
+            for v,r in ranks.items():
+                cells.setdefault(r, []).append(v)
+            while changed:
+                affected = sorted(set(ranks[n] for v in changed for ei,n in nbrs[v]))
+                changed = []
+                for r in affected:
+                    cell = cells[r]
+                    if len(cell) == 1:
+                        continue
+                    keys = {v: tuple(sorted((ei, ranks[n]) for ei,n in nbrs[v])) for v in cell}
+                    values = sorted(set(keys.values()))
+                    if len(values) == 1:
+                        continue
+                    parts = {k: [] for k in values}
+                    for v in cell:
+                        parts[keys[v]].append(v)
+                    start = r
+                    for k in values:
+                        cells[start] = parts[k]
+                        if start != r:
+                            for v in parts[k]:
+                                ranks[v] = start
+                            changed += parts[k]
+                        start += len(parts[k])
+            return ranks
+
+        def certificate(ranks):
+            # the graph relabeled by ranks. vertex invariants need not be
+            # included, as refinement keeps ranks ordered by them
+            return sorted((ranks[v], ranks[n], ei) for v in ranks for ei,n in nbrs[v]
+                                if ranks[v] < ranks[n])
+
+        def orbits(automorphisms, prefix):
+            # orbits of automorphisms which fix all vertices in prefix. each
+            # automorphism is {vertex: image} of the vertices it moves
+            parent = {}
+            def find(v):
+                while parent.get(v, v) is not v:
+                    v = parent[v]
+                return v
+            for perm in automorphisms:
+                if not any(v in perm for v in prefix):
+                    for v,w in perm.items():
+                        v, w = find(v), find(w)
+                        if v is not w:
+                            parent[w] = v
+            return find
+
+        def label_component(vertices):
+            ranks = refine(start_ranks({v: vertex_invariant(v) for v in vertices}), vertices)
+            # tied vertices having same neighbors (e.g methyls of t-butyl) can be
+            # swapped without changing the graph, so their ties are broken in
+            # any order, without searching
+            twins = {}
+            for v in vertices:
+                twins.setdefault((ranks[v], frozenset(nbrs[v])), []).append(v)
+            ranks = start_ranks({v: (ranks[v], i) for vs in twins.values()
+                                                    for i,v in enumerate(vs)})
+            ranks = refine(ranks, [v for vs in twins.values() for v in vs[1:]])
+            # each leaf is [ranks, prefix, certificate]
+            first, best = [], []
+            automorphisms = []
+
+            def search(ranks, prefix):
+                """ returns the depth to which search must return, when an
+                automorphism shows that rest of the subtree was seen already """
+                tied = {}
+                for v,r in ranks.items():
+                    tied.setdefault(r, []).append(v)
+                tied = [(len(vs), r, vs) for r,vs in tied.items() if len(vs) > 1]
+                if not tied:
+                    cert = certificate(ranks)
+                    if not first:
+                        first[:] = best[:] = [ranks, prefix, cert]
+                        return None
+                    for leaf_ranks, leaf_prefix, leaf_cert in (first, best):
+                        if cert == leaf_cert:
+                            vertex_of = {r:v for v,r in ranks.items()}
+                            automorphisms.append({v: vertex_of[r] for v,r in leaf_ranks.items()
+                                                            if vertex_of[r] is not v})
+                            depth = 0
+                            while leaf_prefix[depth] is prefix[depth]:
+                                depth += 1
+                            return depth
+                    if cert < best[2]:
+                        best[:] = [ranks, prefix, cert]
+                    return None
+                # branch on each vertex of the smallest tied class, except those
+                # which are equivalent to an already searched one
+                size, r, vs = min(tied, key=lambda x: x[:2])
+                depth = len(prefix)
+                done = []
+                known = None
+                for chosen in vs:
+                    if known != len(automorphisms):
+                        known = len(automorphisms)
+                        find = orbits(automorphisms, prefix)
+                    if any(find(chosen) is find(v) for v in done):
+                        continue
+                    done.append(chosen)
+                    child = dict(ranks)
+                    for v in vs:
+                        if v is not chosen:
+                            child[v] = r+1
+                    child = refine(child, [v for v in vs if v is not chosen])
+                    jump = search(child, prefix+[chosen])
+                    if jump is not None and jump < depth:
+                        return jump
+                return None
+
+            search(ranks, [])
+            ranks, prefix, cert = best
+            atoms = [vertex_invariant(v) for v in sorted(ranks, key=ranks.__getitem__)]
+            return ranks, (len(ranks), atoms, cert)
+
+        # components are labeled separately, then ordered by their labeled graph,
+        # so that identical components do not multiply the search
+        components = [label_component(vs) for vs in self.get_connected_components() if vs]
+        result = {}
+        for ranks, cert in sorted(components, key=lambda x: x[1]):
+            offset = len(result)
+            for v,r in ranks.items():
+                result[v] = offset + r
+        return result
+
+    def find_subgraph_matches( self, query, vertex_match=None, edge_match=None,
+                                max_matches=None, timeout=None, unique=False):
+        """ VF2 subgraph monomorphism search of query graph in this graph.
+        vertex_match(query_vertex, vertex) and edge_match(query_edge, edge) are
+        optional compatibility callbacks. Search stops after max_matches matches
+        or timeout seconds. If unique is True, matches covering same set of
+        vertices are reported once. returns list of {query_vertex: vertex} dicts """
+        if not query.vertices or len(query.vertices) > len(self.vertices):
+            return []
+        if len(query.edges) > len(self.edges):
+            return []
+        # {vertex: {neighbor: edge}} of both graphs, skipping disconnected edges
+        def neighbor_map(graph):
+            return {v: {n:e for (e,n) in v._neighbors.items() if not e.disconnected}
+                        for v in graph.vertices}
+        q_nbrs = neighbor_map(query)
+        t_nbrs = neighbor_map(self)
+
+        # match order : BFS from the most connected query vertex, so that every
+        # vertex (except the first of each component) has an already mapped parent
+        order, parent = [], {}
+        for root in sorted(query.vertices, key=lambda v: -len(q_nbrs[v])):
+            if root in parent:
+                continue
+            parent[root] = None
+            queue = [root]
+            while queue:
+                v = queue.pop(0)
+                order.append(v)
+                for n in sorted(q_nbrs[v], key=lambda x: -len(q_nbrs[x])):
+                    if n not in parent:
+                        parent[n] = v
+                        queue.append(n)
+        # already mapped neighbors of each query vertex at the time it is matched
+        position = {v:i for i,v in enumerate(order)}
+        back_nbrs = [[n for n in q_nbrs[v] if position[n] < i] for i,v in enumerate(order)]
+
+        deadline = timeout and time.monotonic() + timeout
+        q_to_t, t_to_q = {}, {}
+        matches, found_sets = [], set()
+
+        def candidates(i):
+            p = parent[order[i]]
+            if p is None:
+                return self.vertices
+            return t_nbrs[q_to_t[p]].keys()
+
+        def feasible(q, t, i):
+            if t in t_to_q or len(t_nbrs[t]) < len(q_nbrs[q]):
+                return False
+            if vertex_match and not vertex_match(q, t):
+                return False
+            for qn in back_nbrs[i]:
+                e = t_nbrs[t].get(q_to_t[qn])
+                if e is None:
+                    return False
+                if edge_match and not edge_match(q_nbrs[q][qn], e):
+                    return False
+            # look-ahead : unmatched neighbors of t must be enough for those of q
+            q_free = sum(1 for n in q_nbrs[q] if n not in q_to_t)
+            t_free = sum(1 for n in t_nbrs[t] if n not in t_to_q)
+            return q_free <= t_free
+
+        # iterative depth first search, stack holds candidate iterators
+        stack = [iter(candidates(0))]
+        steps = 0
+        while stack:
+            i = len(stack) - 1
+            q = order[i]
+            # undo previous assignment at this level
+            if q in q_to_t:
+                del t_to_q[q_to_t.pop(q)]
+            for t in stack[-1]:
+                if feasible(q, t, i):
+                    break
+            else:
+                stack.pop()
+                continue
+            q_to_t[q], t_to_q[t] = t, q
+            if len(stack) < len(order):
+                stack.append(iter(candidates(len(stack))))
+            else:
+                vset = frozenset(t_to_q)
+                if not unique or vset not in found_sets:
+                    found_sets.add(vset)
+                    matches.append(dict(q_to_t))
+                    if max_matches and len(matches) >= max_matches:
+                        break
+            steps += 1
+            if deadline and steps % 256 == 0 and time.monotonic() > deadline:
+                warnings.warn("subgraph search timed out after %i matches" % len(matches))
+                break
+        return matches
+
     def _get_vertex_index( self, v):
         """if v is already an index, return v, otherwise return index of v on None"""
         if type( v) == int and v < len( self.vertices):
@@ -590,3 +1491,85 @@ class Graph:
             return self.vertices.index( v)
         except ValueError:
             return None
+
+
+
+def maximum_matching( neighbors):
+    """ Edmonds' blossom algorithm for maximum matching in a general graph.
+    neighbors is a list of neighbor index lists of each vertex.
+    returns list where i-th item is index of vertex matched with vertex i, or -1 """
+    n = len( neighbors)
+    match = [-1]*n
+    # greedy initial matching, starting from the least connected vertices
+    for v in sorted( range(n), key=lambda i: len( neighbors[i])):
+        if match[v] == -1:
+            for u in neighbors[v]:
+                if match[u] == -1:
+                    match[u], match[v] = v, u
+                    break
+
+    def find_augmenting_path( root):
+        """ returns the free vertex at the end of an augmenting path from root, or -1.
+        the path is stored in parent list """
+        used = [False]*n
+        base = list( range(n))
+        used[root] = True
+        queue = [root]
+
+        def lowest_common_ancestor( a, b):
+            visited = [False]*n
+            while True:
+                a = base[a]
+                visited[a] = True
+                if match[a] == -1:
+                    break
+                a = parent[match[a]]
+            while True:
+                b = base[b]
+                if visited[b]:
+                    return b
+                b = parent[match[b]]
+
+        def mark_path( v, b, child):
+            while base[v] != b:
+                blossom[base[v]] = blossom[base[match[v]]] = True
+                parent[v] = child
+                child = match[v]
+                v = parent[match[v]]
+
+        for v in queue:# queue grows while iterating
+            for to in neighbors[v]:
+                if base[v] == base[to] or match[v] == to:
+                    continue
+                if to == root or match[to] != -1 and parent[match[to]] != -1:
+                    # odd cycle found, contract the blossom
+                    curr_base = lowest_common_ancestor( v, to)
+                    blossom = [False]*n
+                    mark_path( v, curr_base, to)
+                    mark_path( to, curr_base, v)
+                    for i in range(n):
+                        if blossom[base[i]]:
+                            base[i] = curr_base
+                            if not used[i]:
+                                used[i] = True
+                                queue.append( i)
+                elif parent[to] == -1:
+                    parent[to] = v
+                    if match[to] == -1:
+                        return to
+                    used[match[to]] = True
+                    queue.append( match[to])
+        return -1
+
+    for root in range(n):
+        if match[root] != -1:
+            continue
+        parent = [-1]*n
+        v = find_augmenting_path( root)
+        # flip matched and unmatched edges along the augmenting path
+        while v != -1:
+            pv = parent[v]
+            ppv = match[pv]
+            match[v], match[pv] = pv, v
+            v = ppv
+    return match
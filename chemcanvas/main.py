@@ -7,6 +7,7 @@ import sys, os
 import io
 import platform
 import re
+import time
 from datetime import datetime
 import traceback
 
@@ -39,7 +40,7 @@ from widgets import (PaletteWidget, TextBoxDialog, UpdateDialog, UpdateChecker,
 from settings_ui import (SettingsDialog, ImageExportSettingsDialog, PageSetupDialog,
     PageGridDialog)
 from reagent_label_tool import LabelPrintDialog
-from common import str_to_tuple
+from common import str_to_tuple, cache_stats_text
 
 
 DEBUG = False
@@ -250,6 +251,7 @@ class Window(QMainWindow, Ui_MainWindow):
         self.actionRedo.triggered.connect(self.redo)
         self.actionGenSmiles.triggered.connect(self.generateSmiles)
         self.actionReadSmiles.triggered.connect(self.readSmiles)
+        self.actionFindSubstructure.triggered.connect(self.findSubstructure)
         self.actionPrintLabel.triggered.connect(self.printLabel)
         self.actionDrawingSettings.triggered.connect(self.drawingSettings)
         self.actionCheckForUpdate.triggered.connect(self.checkForUpdate)
@@ -312,6 +314,13 @@ class Window(QMainWindow, Ui_MainWindow):
         Settings.image_export_dpi = int(self.settings.value("ImageExportDpi", Settings.image_export_dpi))
         Settings.image_export_margin = int(self.settings.value("ImageExportMargin", Settings.image_export_margin))
         Settings.image_export_background = self.settings.value("ImageExportBackground", Settings.image_export_background)
+        # zoom levels below which less detail is drawn
+        lod_zoom_thresholds = Settings.lod_zoom_thresholds
+        try:
+            Settings.lod_zoom_thresholds = str_to_tuple(settings.value("LodZoomThresholds",
+                                            str(lod_zoom_thresholds)))
+        except ValueError:# invalid saved value, keep default
+            Settings.lod_zoom_thresholds = lod_zoom_thresholds
         # drawing settings
         settings.beginGroup("Custom_Style")
         Settings.atom_font_size = int(settings.value("atom_font_size", Settings.atom_font_size))
@@ -458,6 +467,7 @@ class Window(QMainWindow, Ui_MainWindow):
         for view_tab in self.tabs:
             view_tab.resetTransform()
             view_tab.scale(Settings.basic_scale*scale, Settings.basic_scale*scale)
+            view_tab.canvas.set_zoom(scale*100)
         self.zoomLabel.setText("%i%%"%int(scale*100))
 
     def updatePageIndicator(self):
@@ -864,17 +874,18 @@ class Window(QMainWindow, Ui_MainWindow):
         layout = writer.pageLayout()
         layout.setMargins(QMarginsF(0, 0, 0, 0))
         writer.setPageLayout(layout)
-        # prevent painting unwanted items
-        App.canvas.set_nonprinting_items_visible(False)
-        # paint on pages
-        painter = QPainter(writer)
-        for page_no in range(App.canvas.pages_count):
-            if page_no!=0:
-                writer.newPage()
-            x1,y1,x2,y2 = App.canvas.get_page_rect(page_no)
-            App.canvas.render(painter, QRectF(), QRectF(x1,y1,x2-x1,y2-y1))
-        painter.end()
-        App.canvas.set_nonprinting_items_visible(True)
+        with App.canvas.full_detail():
+            # prevent painting unwanted items
+            App.canvas.set_nonprinting_items_visible(False)
+            # paint on pages
+            painter = QPainter(writer)
+            for page_no in range(App.canvas.pages_count):
+                if page_no!=0:
+                    writer.newPage()
+                x1,y1,x2,y2 = App.canvas.get_page_rect(page_no)
+                App.canvas.render(painter, QRectF(), QRectF(x1,y1,x2-x1,y2-y1))
+            painter.end()
+            App.canvas.set_nonprinting_items_visible(True)
 
     def imageExportSettings(self):
         dlg = ImageExportSettingsDialog(self)
@@ -969,6 +980,8 @@ class Window(QMainWindow, Ui_MainWindow):
             doc = reader.read_string(text)
             if not doc:
                 return
+            if reader.status=="warning":
+                self.showStatus(reader.message)
             mol = doc.pages[0].objects[0]
             App.canvas.addObject(mol)
             draw_recursively(mol)
@@ -976,6 +989,53 @@ class Window(QMainWindow, Ui_MainWindow):
         except Exception as e:
             self.showException(e)
 
+    def findSubstructure(self):
+        """ highlights matches of a SMILES query in current tab, and reports
+        number of matching molecules in other tabs and templates """
+        dlg = TextBoxDialog("Enter SMILES of Substructure :", "", self, mode="input")
+        if dlg.exec()!=QDialog.Accepted:
+            return
+        try:
+            doc = Smiles().read_string(dlg.text())
+            if not doc:
+                return
+            query = doc.pages[0].objects[0]
+            # total time limit of whole search, prevents hang on huge or many molecules
+            deadline = time.monotonic() + 5
+            App.canvas.deselectAll()
+            found_mols = 0
+            # current tab is searched first, as its matches are highlighted
+            tabs = sorted(self.tabs, key=lambda tab: tab.canvas is not App.canvas)
+            mols = [(tab.canvas, o) for tab in tabs for o in tab.canvas.objects
+                                        if o.class_name=="Molecule"]
+            for canvas, mol in mols:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # in other tabs, molecules are only counted
+                max_matches = None if canvas is App.canvas else 1
+                matches = mol.find_substructure(query, max_matches, remaining)
+                if not matches:
+                    continue
+                found_mols += 1
+                if canvas is not App.canvas:
+                    continue
+                for match in matches:
+                    bonds = [match[a1].get_edge_leading_to(match[a2])
+                                for a1,a2 in [b.atoms for b in query.bonds]]
+                    [App.canvas.selectObject(o) for o in list(match.values())+bonds]
+            titles = []
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                titles = App.template_manager.find_templates_with_substructure(query, remaining)
+            msg = "Substructure found in %i molecule(s) and %i template(s)" % (
+                                                    found_mols, len(titles))
+            if time.monotonic() > deadline:
+                msg += " ; Search timed out, results may be incomplete"
+            self.showStatus(msg)
+        except Exception as e:
+            self.showException(e)
+
 
     def printLabel(self):
         dlg = LabelPrintDialog()
@@ -1094,6 +1154,10 @@ class Window(QMainWindow, Ui_MainWindow):
         if self.curr_tab.filename:
             self.settings.setValue("WorkingDir", os.path.dirname(self.curr_tab.filename))
         self.settings.setValue("RecentFiles", self.recent_files)
+        self.settings.setValue("LodZoomThresholds", str(Settings.lod_zoom_thresholds))
+        debug(cache_stats_text())
+        for tab in self.tabs:
+            debug(tab.canvas.redraw_stats_text())
         QMainWindow.closeEvent(self, ev)
 
 
@@ -3,14 +3,22 @@
 # Copyright (C) 2022-2026 Arindam Chaudhuri <arindamsoft94@gmail.com>
 from math import cos, sin, atan2
 from math import pi as PI
+from collections import Counter
+from contextlib import contextmanager
+import hashlib
+import re
+import operator
 
 from drawing_parents import DrawableObject
 from atom import Atom
 from bond import Bond
-from graph import Graph
+from graph import Graph, maximum_matching
 import common
+from common import cached_on, TOPOLOGY, GEOMETRY
+from app_data import Settings, periodic_table
 import geometry as geo
-from tool_helpers import find_least_crowded_place_around_atom
+from tool_helpers import (find_least_crowded_place_around_atom, calc_average_bond_length,
+        get_pi_e_contribution)
 
 global molecule_id_no
 molecule_id_no = 1
@@ -45,8 +53,27 @@ class Molecule(Graph, DrawableObject):
         self._last_used_atom = None
         self._sign = 1
         self.stereochemistry = []
+        self._stereo_by_refs = {} # {frozenset(references): StereoChemistry}
+        # {double bond path: [(references, value),...]} calculated from coordinates
+        self._stereo_cache = {}
+        self._stereo_paths = None # paths of which results are in _stereo_cache
+        # atoms changed since last stereochemistry detection
+        self._stereo_dirty_atoms = set()
+        # element counts, see Molecule.composition
+        self._composition = Counter()
+        self._atom_compositions = {} # {atom: Counter}
+        self._composition_dirty_atoms = set()
+        # spatial index of atom positions, see atoms_near()
+        self._atom_grid = None
+        self._grid_dirty_atoms = set()
+        # atoms whose valency and text update is postponed, see batch_edit()
+        self._batch_depth = 0
+        self._batch_reposition_atoms = set()
+        self._batch_valency_atoms = set()
         # this is used to calculate atom font size, and new bond length
         self.scale_val = 1.0
+        # incremented when any atom is moved, used by common.cached_on()
+        self.geometry_version = 0
 
     @property
     def children(self):
@@ -69,18 +96,145 @@ class Molecule(Graph, DrawableObject):
         self.atoms.append(atom)
         self.clear_cache()
         atom.molecule = self
+        self.on_vertex_added(atom)
+        self.on_atoms_changed((atom,))
 
     def remove_atom(self, atom):
         self.atoms.remove(atom)
         self.clear_cache()
         atom.molecule = None
+        self.on_vertex_removed(atom)
+        self.on_atoms_changed((atom,))
+
+    def on_atoms_moved(self, atoms):
+        """ must be called when coordinates of atoms are changed.
+        stereochemistry around these atoms is detected again """
+        self._stereo_dirty_atoms.update(atoms)
+        if self._atom_grid:
+            self._grid_dirty_atoms.update(atoms)
+
+    def on_atoms_changed(self, atoms):
+        """ must be called when chemistry or bonds of atoms are changed.
+        their element counts are also recalculated """
+        self.on_atoms_moved(atoms)
+        self._composition_dirty_atoms.update(atoms)
+
+    @contextmanager
+    def batch_edit(self):
+        """ with mol.batch_edit(): ...
+        while adding or removing many bonds, valency, hydrogens and text of
+        atoms are updated once at the end, instead of after each bond change """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._finish_batch_edit()
+
+    def queue_atom_update(self, atom, bonds_changed=False):
+        """ called by atom before updating its valency. returns True if the
+        update is postponed until the end of batch_edit() """
+        if not self._batch_depth:
+            return False
+        if bonds_changed:
+            self._batch_reposition_atoms.add(atom)
+        else:
+            self._batch_valency_atoms.add(atom)
+        return True
+
+    def _finish_batch_edit(self):
+        reposition_atoms = self._batch_reposition_atoms
+        valency_atoms = self._batch_valency_atoms - reposition_atoms
+        self._batch_reposition_atoms = set()
+        self._batch_valency_atoms = set()
+        # atoms may have moved to another molecule or deleted in between
+        for atom in reposition_atoms:
+            atom.on_bond_count_change()
+        for atom in valency_atoms:
+            atom.update_occupied_valency()
+        # hydrogens are changed, composition may have been read during batch
+        for atom in reposition_atoms | valency_atoms:
+            if atom.molecule:
+                atom.molecule.on_atoms_changed((atom,))
+
+    def on_edge_connected(self, bond):
+        Graph.on_edge_connected(self, bond)
+        self.on_atoms_changed(bond.atoms)
+
+    def on_edge_disconnected(self, bond):
+        Graph.on_edge_disconnected(self, bond)
+        self.on_atoms_changed(bond.atoms)
+
+    def invalidate_topology_stores(self):
+        Graph.invalidate_topology_stores(self)
+        self._stereo_cache.clear()
+        self._composition.clear()
+        self._atom_compositions.clear()
+        self._composition_dirty_atoms.update(self.atoms)
+        self._atom_grid = None
+        self._grid_dirty_atoms.clear()
+
+    def atoms_near(self, x, y, radius):
+        """ returns atoms within radius of point (x,y). uses a grid index of
+        atom positions, which is updated only for the atoms moved since last call """
+        if self._atom_grid is None:
+            self._atom_grid = AtomGrid(Settings.bond_length)
+            self._grid_dirty_atoms = set(self.atoms)
+        for atom in self._grid_dirty_atoms:
+            if atom.molecule is self:
+                self._atom_grid.update(atom)
+            else:
+                self._atom_grid.remove(atom)
+        self._grid_dirty_atoms.clear()
+        return self._atom_grid.atoms_near(x, y, radius)
+
+    @property
+    def composition(self):
+        """ returns {element: count} of the molecule, including implicit hydrogens.
+        isotopes are counted separately, eg. {"C":5, "13C":1, "H":6} """
+        self._update_composition()
+        return +self._composition # copy without zero counts
+
+    def get_composition(self, atoms):
+        """ returns {element: count} of the given atoms of this molecule """
+        self._update_composition()
+        composition = Counter()
+        for atom in atoms:
+            composition.update(self._atom_compositions[atom])
+        return composition
+
+    def _update_composition(self):
+        """ recalculates element counts of atoms changed after last call """
+        for atom in self._composition_dirty_atoms:
+            old = self._atom_compositions.pop(atom, None)
+            if old:
+                self._composition.subtract(old)
+            if atom.molecule is self:
+                new = self._atom_compositions[atom] = atom_composition(atom)
+                self._composition.update(new)
+        self._composition_dirty_atoms.clear()
+
+    def component_of(self, atom):
+        """ returns an atom representing the fragment which contains the given atom.
+        two atoms are in same fragment if component_of() returns same atom for them """
+        return self.get_component_tracker().find(atom)
+
+    @property
+    def component_count(self):
+        """ number of fragments (connected components) in the molecule """
+        return self.get_component_tracker().count
 
     def add_bond(self, bond):
         self.bonds.add(bond)
         self.clear_cache()
         bond.molecule = self
+        if bond.atoms:
+            self.on_edge_connected(bond)
 
     def remove_bond(self, bond):
+        if bond.atoms:
+            self.on_edge_disconnected(bond)
         self.bonds.remove(bond)
         self.clear_cache()
         bond.molecule = None
@@ -120,22 +274,7 @@ class Molecule(Graph, DrawableObject):
     def eat_molecule(self, food_mol):
         if food_mol is self:
             return
-        # move all atoms of food_mol to this molecule
-        for atom in food_mol.atoms:
-            self.add_atom(atom)
-        food_mol.atoms.clear()
-
-        # move all bonds of food_mol to this molecule
-        for bond in food_mol.bonds:
-            self.add_bond(bond)
-        food_mol.bonds.clear()
-
-        # move all delocalizations
-        for deloc in food_mol.delocalizations:
-            deloc.molecule = self
-            self.delocalizations.append(deloc)
-        food_mol.delocalizations.clear()
-
+        food_mol.transfer_atoms(dict.fromkeys(food_mol.atoms, self))
         # remove food_mol from canvas
         if food_mol.canvas:
             food_mol.canvas.removeObject(food_mol)
@@ -144,31 +283,82 @@ class Molecule(Graph, DrawableObject):
     def split_fragments(self):
         """ convert each fragments into different molecules if it is broken molecule """
         new_mols = []
-        frags = list(self.get_connected_components())
-        for frag in frags[1:]:
-            new_mol = Molecule()
-            self.canvas.addObject(new_mol)
-            bonds = []
-            for atom in frag:
-                self.remove_atom(atom)
-                new_mol.add_atom(atom)
-                bonds += atom.bonds
-            for bond in set(bonds):
-                self.remove_bond(bond)
-                new_mol.add_bond(bond)
-            new_mols.append(new_mol)
-        # move delocalizations
-        for deloc in self.delocalizations:
-            if not set(deloc.atoms).issubset(set(self.atoms)):
-                for mol in new_mols:
-                    if set(deloc.atoms).issubset(set(mol.atoms)):
-                        self.delocalizations.remove(deloc)
-                        mol.delocalizations.append(deloc)
-                        deloc.molecule = mol
-                        break
+        if self.component_count <= 1:
+            return new_mols
+        # first fragment (with first atom) stays in this molecule
+        targets = {}
+        root_mols = {self.component_of(self.atoms[0]): None}
+        for atom in self.atoms:
+            root = self.component_of(atom)
+            if root not in root_mols:
+                new_mol = Molecule()
+                self.canvas.addObject(new_mol)
+                new_mols.append(new_mol)
+                root_mols[root] = new_mol
+            if root_mols[root]:
+                targets[atom] = root_mols[root]
+        self.transfer_atoms(targets)
         return new_mols
 
 
+    def transfer_atoms(self, targets):
+        """ moves atoms to other molecules in a single pass. @targets is {atom: molecule}.
+        bonds, delocalizations, stereochemistry and template atom/bond go with
+        their atoms, so a fragment must be moved as a whole """
+        if not targets:
+            return
+        # modify lists in place, as vertices and atoms must be same object
+        kept_atoms = []
+        for atom in self.atoms:
+            mol = targets.get(atom)
+            if mol:
+                mol.atoms.append(atom)
+                atom.molecule = mol
+            else:
+                kept_atoms.append(atom)
+        self.atoms[:] = kept_atoms
+
+        moved_bonds = [bond for bond in self.bonds if bond.atom1 in targets]
+        self.bonds.difference_update(moved_bonds)
+        for bond in moved_bonds:
+            mol = targets[bond.atom1]
+            mol.bonds.add(bond)
+            bond.molecule = mol
+
+        kept_delocs = []
+        for deloc in self.delocalizations:
+            mol = deloc.atoms and targets.get(deloc.atoms[0])
+            if mol:
+                mol.delocalizations.append(deloc)
+                deloc.molecule = mol
+            else:
+                kept_delocs.append(deloc)
+        self.delocalizations[:] = kept_delocs
+
+        kept_stereo = []
+        for st in self.stereochemistry:
+            mol = targets.get(st.references[0])
+            if mol:
+                mol.add_stereochemistry(st)
+            else:
+                kept_stereo.append(st)
+        self.stereochemistry[:] = kept_stereo
+        self._stereo_by_refs = {frozenset(st.references): st for st in kept_stereo}
+
+        for attr in ("template_atom", "template_bond"):
+            obj = getattr(self, attr)
+            if obj and obj.molecule is not self:
+                if getattr(obj.molecule, attr) is None:
+                    setattr(obj.molecule, attr, obj)
+                setattr(self, attr, None)
+
+        # rings, fragments and memoized results are calculated again when needed
+        for mol in set(targets.values()) | {self}:
+            mol.clear_cache()
+            mol.invalidate_topology_stores()
+            mol.geometry_version += 1
+
+
     def find_place( self, a, distance, added_order=1):
         """tries to find accurate place for next atom around atom 'a',
         returns x,y and list of ids of 'items' found there for overlap, those atoms are not bound to id"""
@@ -203,16 +393,74 @@ class Molecule(Graph, DrawableObject):
             y = a.y + sin( get_angle( a, neighbors[0]) + PI) *distance
         # more than one neighbors
         else:
+          return find_least_crowded_place_around_atom(a, distance)
+        # do not place over a non-bonded atom
+        if any(atom is not a for atom in self.atoms_near(x, y, distance/2)):
           x, y = find_least_crowded_place_around_atom(a, distance)
         return x, y
 
 
-    def bounding_box(self):
+    def calc_bounding_box(self):
         bboxes = []
         for atom in self.atoms:
             bboxes.append( atom.bounding_box())
         return common.bbox_of_bboxes( bboxes)
 
+    @cached_on(TOPOLOGY|GEOMETRY)
+    def average_bond_length(self):
+        """ median of bond lengths """
+        return calc_average_bond_length(self.bonds)
+
+    @cached_on(TOPOLOGY)
+    def canonical_ranks(self):
+        """ returns {atom: rank}, same structure always gets same ranks
+        regardless of the order in which atoms and bonds were added """
+        atom_inv = self._canonical_atom_invariants()
+        return self.canonical_ranking(atom_inv.__getitem__, operator.attrgetter("order"))
+
+    @cached_on(TOPOLOGY)
+    def canonical_hash(self):
+        """ a hex string which is same for identical structures.
+        different kekule structures of an aromatic molecule have same hash """
+        atom_inv = self._canonical_atom_invariants()
+        bond_inv = self.aromatic_bond_orders()
+        ranks = self.canonical_ranking(atom_inv.__getitem__, bond_inv.__getitem__)
+        atoms = [atom_inv[a] for a in sorted(self.atoms, key=ranks.__getitem__)]
+        bonds = sorted(tuple(sorted(ranks[a] for a in b.atoms)) + (bond_inv[b],)
+                            for b in self.bonds)
+        return hashlib.sha1(repr((atoms, bonds)).encode()).hexdigest()
+
+    def _canonical_atom_invariants(self):
+        deloc_atoms = set(a for d in self.delocalizations for a in d.atoms)
+        return {atom: (atom.symbol, atom.isotope or 0, atom.charge, atom.hydrogens,
+                        atom in deloc_atoms) for atom in self.atoms}
+
+    @cached_on(TOPOLOGY)
+    def aromatic_bond_orders(self):
+        """ returns {bond: order}, where single and double bonds of aromatic
+        rings are treated as delocalized, so that all kekule structures are same """
+        bond_inv = {bond: bond.order for bond in self.bonds}
+        for ring_bonds in self.get_relevant_cycles_e():
+            if not all(bond_inv[b] in (1,2,1.5) for b in ring_bonds):
+                continue
+            ring_atoms = self.edge_subgraph_to_vertex_subgraph(ring_bonds)
+            pi_electrons = [get_pi_e_contribution(atom) for atom in ring_atoms]
+            if None not in pi_electrons and sum(pi_electrons)%4==2:# huckel rule
+                for b in ring_bonds:
+                    bond_inv[b] = 1.5
+        return bond_inv
+
+    def find_substructure(self, query, max_matches=None, timeout=None):
+        """ returns list of matches of query molecule in this molecule, where each
+        match is {query_atom: atom} dict. same set of atoms is reported only once """
+        # a quick check before graph matching, molecule must have enough atoms of each element
+        available = Counter(atom.symbol for atom in self.atoms)
+        for symbol, count in Counter(atom.symbol for atom in query.atoms).items():
+            if available[symbol] < count:
+                return []
+        return self.find_subgraph_matches(query, atoms_match, bonds_match,
+                        max_matches=max_matches, timeout=timeout, unique=True)
+
     def deepcopy(self):
         obj_map = {}
         new_mol = Molecule()
@@ -223,11 +471,12 @@ class Molecule(Graph, DrawableObject):
             new_mol.add_atom(new_atom)
             obj_map[atom.id] = new_atom
 
-        for bond in self.bonds:
-            new_bond = bond.copy()
-            new_mol.add_bond(new_bond)
-            new_bond.connect_atoms(obj_map[bond.atom1.id], obj_map[bond.atom2.id])
-            obj_map[bond.id] = new_bond
+        with new_mol.batch_edit():
+            for bond in self.bonds:
+                new_bond = bond.copy()
+                new_mol.add_bond(new_bond)
+                new_bond.connect_atoms(obj_map[bond.atom1.id], obj_map[bond.atom2.id])
+                obj_map[bond.id] = new_bond
 
         for deloc in self.delocalizations:
             new_deloc = deloc.copy()
@@ -242,34 +491,55 @@ class Molecule(Graph, DrawableObject):
         return new_mol
 
 
-    def handle_overlap(self):
+    def handle_overlap(self, new_atoms=None, tolerance=2):
         """ Merge overlapped atoms and bonds in this molecule.
         To handle overlap with two different molecules,
-        call Molecule.eat_molecule() before calling this function """
-        to_process = self.atoms[:]
-        replacement_dict = {}
+        call Molecule.eat_molecule() before calling this function.
+        If new_atoms is given, only those are checked against other atoms.
+        Atoms closer than tolerance (in both x and y) are merged """
+        with self.batch_edit():
+            self._handle_overlap(new_atoms, tolerance)
 
-        while len(to_process):
-            a1 = to_process.pop(0) # the overlapped atom
-            i = 0
-            while i < len(to_process):
-                a2 = to_process[i]
-                if abs(a2.x-a1.x)<=2 and abs(a2.y-a1.y)<=2:
-                    replacement_dict[a2] = a1
-                    to_process.pop(i)
-                    # handle bonds
-                    for bond in a2.bonds:
-                        if bond.atom_connected_to(a2) in a1.neighbors:
-                            # two overlapping atoms have same neighbor means
-                            # we found overlapping bond
-                            bond.disconnect_atoms()
-                            self.remove_bond(bond)
-                            bond.delete_from_canvas()
-                        else:
-                            # disconnect from overlapping atom, and connect to overlapped atom
-                            bond.replace_atom(a2, a1)
+    def _handle_overlap(self, new_atoms, tolerance):
+        replacement_dict = {}
+        # uniform grid of kept atoms, with cell size equal to tolerance, so that
+        # an overlapping atom must be in one of the 3x3 cells around an atom
+        grid = {}
+        def cell_of(atom):
+            return int(atom.x//tolerance), int(atom.y//tolerance)
+
+        if new_atoms is None:
+            to_process = self.atoms
+        else:
+            new_atoms = set(new_atoms)
+            to_process = [a for a in self.atoms if a in new_atoms]
+            for atom in self.atoms:
+                if atom not in new_atoms:
+                    grid.setdefault(cell_of(atom), []).append(atom)
+        order = {atom:i for i,atom in enumerate(self.atoms)}
+
+        for a2 in to_process:
+            cx, cy = cell_of(a2)
+            overlapped = [a1 for i in (cx-1,cx,cx+1) for j in (cy-1,cy,cy+1)
+                            for a1 in grid.get((i,j), ())
+                            if abs(a2.x-a1.x)<=tolerance and abs(a2.y-a1.y)<=tolerance]
+            if not overlapped:
+                grid.setdefault((cx,cy), []).append(a2)
+                continue
+            # the atom which comes first in atom list is kept
+            a1 = min(overlapped, key=order.__getitem__)
+            replacement_dict[a2] = a1
+            # handle bonds
+            for bond in a2.bonds:
+                if bond.atom_connected_to(a2) in a1.neighbors:
+                    # two overlapping atoms have same neighbor means
+                    # we found overlapping bond
+                    bond.disconnect_atoms()
+                    self.remove_bond(bond)
+                    bond.delete_from_canvas()
                 else:
-                    i += 1
+                    # disconnect from overlapping atom, and connect to overlapped atom
+                    bond.replace_atom(a2, a1)
 
         # handle delocalizations
         for deloc in self.delocalizations:
@@ -295,20 +565,67 @@ class Molecule(Graph, DrawableObject):
 
     def add_stereochemistry(self, st):
         self.stereochemistry.append(st)
+        self._stereo_by_refs[frozenset(st.references)] = st
 
     def remove_stereochemistry(self, st):
         self.stereochemistry.remove(st)
+        key = frozenset(st.references)
+        if self._stereo_by_refs.get(key) is st:
+            del self._stereo_by_refs[key]
 
 #    def transform(self, tr):
 #        pass
 
     def scale(self, scale):
         self.scale_val *= scale
+        self.invalidate_bounding_box()
 
 
     def detect_stereochemistry_from_coords( self, omit_rings=True):
-        # double bonds
-        # detect clusters of double bonds
+        """ detects cis-trans stereochemistry of double bonds from coordinates.
+        results are cached for each double bond path, and only the paths near
+        atoms changed since last call are calculated again """
+        if omit_rings:
+            paths, atom_paths = self._double_bond_paths()
+        else:
+            paths = self._find_double_bond_paths( omit_rings=False)
+            atom_paths = {}
+            self._stereo_cache.clear()
+        # paths with an end atom or its neighbor changed
+        changed = set( path for a in self._stereo_dirty_atoms for path in atom_paths.get( a, ()))
+        self._stereo_dirty_atoms.clear()
+        if paths is not self._stereo_paths:
+            # topology is changed, forget the paths which no longer exist
+            self._stereo_cache = {path: self._stereo_cache[path] for path in paths if path in self._stereo_cache}
+            self._stereo_paths = paths
+
+        for path in paths:
+            if path in changed or path not in self._stereo_cache:
+                self._stereo_cache[path] = self._calc_double_bond_path_stereo( path)
+            center = len( path)==1 and path[0] or None
+            for refs, value in self._stereo_cache[path]:
+                st1 = self._stereo_by_refs.get( frozenset( refs))
+                if st1 and st1.value == value:
+                    continue
+                if st1:
+                    self.remove_stereochemistry( st1)
+                self.add_stereochemistry( StereoChemistry( center, value, refs))
+
+    @cached_on(TOPOLOGY)
+    def _double_bond_paths( self):
+        """ returns double bond paths (omitting rings), and {atom: [path,...]} of
+        atoms which affect the stereochemistry of the path """
+        paths = self._find_double_bond_paths( omit_rings=True)
+        atom_paths = {}
+        for path in paths:
+            for bond in path:
+                for atom in bond.atoms:
+                    for a in [atom] + atom.neighbors:
+                        atom_paths.setdefault( a, set()).add( path)
+        return paths, atom_paths
+
+    def _find_double_bond_paths( self, omit_rings=True):
+        """ returns list of odd length paths (tuple of bonds) of cumulated double bonds """
         double_paths = []
         processed = set()
         for e in self.edges:
@@ -318,194 +635,67 @@ class Molecule(Graph, DrawableObject):
                 path = [e]
                 add_neighbor_double_bonds( e, path)
                 if len( path) % 2:# odd
-                    double_paths.append( path)
+                    double_paths.append( tuple( path))
                     processed |= set( path)
-        # detect config on these paths
-        for path in double_paths:
-            vertices = []
-            for bond in path:
-                vertices.extend( bond.vertices)
-            ends = [v for v in vertices if vertices.count(v) == 1]
-            if len( ends) != 2: # two ends is the only thing we are prepared to handle
-                continue
-            end1, end2 = ends
-            # set stereochemistry for all neighbors of both ends
-            for e1,n1 in end1.get_neighbor_edge_pairs():
-                plane1 = geo.plane_normal_from_3_points( (n1.x,n1.y,n1.z),(end1.x,end1.y,end1.z),(end2.x,end2.y,end2.z))
-                if plane1 == None:
-                    continue # some coords were missing
-                if not e1 in path:
-                    for e2,n2 in end2.get_neighbor_edge_pairs():
-                        if not e2 in path:
-                            plane2 = geo.plane_normal_from_3_points( (end1.x,end1.y,end1.z),(end2.x,end2.y,end2.z),(n2.x,n2.y,n2.z))
-                            #cos_angle = geo.same_or_oposite_side( plane1, plane2)
-                            cos_angle = geo.angle_between_planes( plane1, plane2)
-                            if cos_angle < 0:
-                                value = StereoChemistry.TRANS
-                            else:
-                                value = StereoChemistry.CIS
-                            if len( path) == 1:
-                                center = path[0]
-                            else:
-                                center = None
-                            refs = [n1,end1,end2,n2]
-                            st = StereoChemistry(center, value, refs)
-                            to_remove = None
-                            to_add = None
-                            for st1 in self.stereochemistry:
-                                if set( st1.references) == set( st.references):
-                                    if st.value == st1.value:
-                                        break
-                                    else:
-                                        to_remove = st1
-                                        break
-                            else:
-                                self.add_stereochemistry( st)
-                            if to_remove:
-                                self.remove_stereochemistry( to_remove)
-
-
-    def _get_atoms_possible_aromatic_electrons(self, at, ring):
-        out = set()
-        accept_cation = {'N', 'P', 'O', 'S', 'Se'}
-        if at.charge > 0 and at.symbol not in accept_cation:# can contribute vacant p-orbital
-            out.add( 0)
-        elif at.charge < 0:# negative charge can contribute lone pair
-            out.add( 2)
-        if at.symbol in accept_cation and not at.charge > 0:
-            out.add( 2)
-        if at.symbol in ('B','Al'):# has vacant p-orbital
-            out.add( 0)
-        for b, a in at.get_neighbor_edge_pairs():
-            if b.order > 1 and (a in ring or "delocalized" in b.properties_):
-                out.add( 1)
-            elif b.order > 1:
-                out.add( 0)
-        return tuple( out)
+        return double_paths
+
+    def _calc_double_bond_path_stereo( self, path):
+        """ returns list of (references, value) for a double bond path """
+        result = []
+        vertices = []
+        for bond in path:
+            vertices.extend( bond.vertices)
+        ends = [v for v in vertices if vertices.count(v) == 1]
+        if len( ends) != 2: # two ends is the only thing we are prepared to handle
+            return result
+        end1, end2 = ends
+        # set stereochemistry for all neighbors of both ends
+        for e1,n1 in end1.get_neighbor_edge_pairs():
+            plane1 = geo.plane_normal_from_3_points( (n1.x,n1.y,n1.z),(end1.x,end1.y,end1.z),(end2.x,end2.y,end2.z))
+            if plane1 == None:
+                continue # some coords were missing
+            if not e1 in path:
+                for e2,n2 in end2.get_neighbor_edge_pairs():
+                    if not e2 in path:
+                        plane2 = geo.plane_normal_from_3_points( (end1.x,end1.y,end1.z),(end2.x,end2.y,end2.z),(n2.x,n2.y,n2.z))
+                        #cos_angle = geo.same_or_oposite_side( plane1, plane2)
+                        cos_angle = geo.angle_between_planes( plane1, plane2)
+                        if cos_angle < 0:
+                            value = StereoChemistry.TRANS
+                        else:
+                            value = StereoChemistry.CIS
+                        result.append( ([n1,end1,end2,n2], value))
+        return result
 
 
     def localize_aromatic_bonds( self):
-        """ localizes aromatic bonds (does not relocalize already localized ones) """
-        # it helps to check whether it was aromatic before bond type is changed
-        for b in self.bonds:
-            if b.type=="delocalized":
-                b.properties_["delocalized"]=1
-
-        erings = self.get_smallest_independent_cycles_e()
-        # filter off rings without aromatic bonds
-        erings = filter( lambda x: len( [b for b in x if b.type=="delocalized"]), erings)
-        rings = list(map( self.edge_subgraph_to_vertex_subgraph, erings))
-        # sort rings
-        rings.sort( key=lambda x: len(x)%2, reverse=True) # odd size rings first
-        last_rings = []
-        while rings:
-            # we have to continue with the neighbor rings of the last_ring (or the rings before)
-            intersection = None
-            if last_rings:
-                aring = None
-                while last_rings:
-                    last_ring = last_rings.pop( -1)
-                    for ring in rings:
-                        intersection = ring & last_ring
-                        if intersection:
-                            aring = ring
-                            last_rings.append( last_ring)
-                            break
-                    if aring:
-                        break
-                if not aring:
-                    aring = rings.pop(0)
-                else:
-                    rings.remove( aring)
-            else:
-                aring = rings.pop(0)
-            last_rings.append( aring)
-            # convert ring from set to list
-            aring = self.sort_vertices_in_path( aring, start_from=intersection and intersection.pop() or None)
-            # taken from mark_aromatic_bonds
-            els = [self._get_atoms_possible_aromatic_electrons( a, aring) for a in aring]
-            if () in els:
-                continue  # misuse of aromatic bonds (e.g. by smiles) or e.g. tetrahydronaphtalene
-            for comb in common.gen_combinations_of_series( els):
-                if sum( comb) % 4 == 2:
-                    aring.append( aring[0])
-                    comb.append( comb[0])
-                    # at first we process the bonds that are surely single (like C-S-C in thiophene)
-                    already_set = None
-                    for i in range( len( aring) -1):
-                        if comb[i] + comb[i+1] != 2:
-                            # these bonds must be single
-                            b = aring[i].get_edge_leading_to( aring[i+1])
-                            b.type = "single"
-                            already_set = i
-                    if already_set != None:
-                        # we reorder the comb and aring to start from the already set bonds
-                        j = already_set + 1
-                        aring = aring[j:len(aring)] + aring[1:j]
-                        aring.insert( 0, aring[-1])
-                        comb = comb[j:len(comb)] + comb[1:j]
-                        comb.insert( 0, comb[-1])
-                    i = 0
-                    while i+1 < len( aring):
-                        if comb[i] + comb[i+1] == 2:
-                            b = aring[i].get_edge_leading_to( aring[i+1])
-                            assert b != None # should be
-                            # to assure alternating bonds
-                            bs1 = [bo for bo in aring[i].neighbor_edges if bo.type=="double" and "delocalized" in bo.properties_ and bo!=b]
-                            bs2 = [bo for bo in aring[i+1].neighbor_edges if bo.type=="double" and "delocalized" in bo.properties_ and bo!=b]
-                            if len( bs1) == 0 and len( bs2) == 0:
-                                b.type = "double"
-                            else:
-                                b.type = "single"
-                        i += 1
-                    break
-
-        # cleanup
-        for b in self.bonds:
-            try:
-                del b.properties_["delocalized"]
-            except: pass
-
-        self.localize_fake_aromatic_bonds()
-
-
-    def localize_fake_aromatic_bonds( self):
-        """ for those that are not aromatic but marked as delocalized
-        (it is for instance possible to misuse 'cccc' in smiles to create butadiene) """
-        to_go = [b for b in self.bonds if b.type == "delocalized"]
-
-        processed = []
-        for b in to_go:
-            if not min( [a.free_valency for a in b.vertices]):
-                b.set_type("single")
-                processed.append( b)
-        to_go = common.difference( to_go, processed)
-
-        while to_go:
-            # find the right bond
-            b = None
-            for bo in to_go:
-                bs1, bs2 = bo.neighbor_edges2
-                if not bs1 or len( [e for e in bs1 if e.order < 2]) > 0 and len( [e for e in bs1 if e.order == 2]) == 0 \
-                   or not bs2 or len( [e for e in bs2 if e.order < 2]) > 0 and len( [e for e in bs2 if e.order == 2]) == 0:
-                    b = bo
-                    break
-                # new start for iteration
-            if not b:
-                for bo in self.edges:
-                    if not [e for e in bo.neighbor_edges if e.type!="delocalized"]:
-                        b = bo
-                        break
-            if not b:
-                b = to_go.pop(0)
-            # the code itself
-            b.type = "double"
-            for bo in b.neighbor_edges:
-                if bo.type == "delocalized":
-                    bo.type = "single"
-            # next turn
-            to_go = [b for b in self.bonds if b.type == "delocalized"]
-
+        """ converts delocalized bonds to alternate single and double bonds (kekulization).
+        the double bonds are found by maximum matching of the atoms which need a
+        double bond, so the whole aromatic system is handled at once.
+        returns list of atoms which could not get a double bond (empty if succeeded) """
+        # self.bonds is a set, so bonds are ordered by atom index to get same
+        # kekule structure every time
+        atom_index = {a:i for i,a in enumerate(self.atoms)}
+        deloc_bonds = sorted((b for b in self.bonds if b.type=="delocalized"),
+                        key=lambda b: sorted(atom_index[a] for a in b.atoms))
+        if not deloc_bonds:
+            return []
+        atoms = list(dict.fromkeys(a for b in deloc_bonds for a in b.atoms))
+        # must be decided before any bond type is changed
+        needy_atoms = [a for a in atoms if needs_double_bond(a)]
+        index = {a:i for i,a in enumerate(needy_atoms)}
+        neighbors = [[] for a in needy_atoms]
+        for b in deloc_bonds:
+            a1, a2 = b.atoms
+            if a1 in index and a2 in index:
+                neighbors[index[a1]].append(index[a2])
+                neighbors[index[a2]].append(index[a1])
+        match = maximum_matching(neighbors)
+
+        for b in deloc_bonds:
+            i, j = [index.get(a, -1) for a in b.atoms]
+            b.set_type(i!=-1 and match[i]==j and "double" or "single")
+        return [a for a in needy_atoms if match[index[a]]==-1]
 
 
 
@@ -517,6 +707,121 @@ def add_neighbor_double_bonds( bond, path):
 
 
 
+def needs_double_bond(atom):
+    """ whether an atom having delocalized bonds needs a double bond in kekule structure.
+    delocalized bonds are counted as single bonds """
+    bond_orders = sum(b.type=="delocalized" and 1 or b.order for b in atom.bonds)
+    occupied = int(bond_orders) + (0 if atom.auto_hydrogens else atom.hydrogens)
+    if atom.symbol not in periodic_table:
+        return False
+    valencies = periodic_table[atom.symbol]["valency"]
+    # cation of N, O etc has one more bond, carbocation and carbanion has one less
+    if atom.charge and atom.symbol in ("N", "P", "O", "S", "Se"):
+        valencies = [val+atom.charge for val in valencies]
+    elif atom.charge and atom.symbol=="C":
+        valencies = [3]
+    for val in valencies:
+        if val >= occupied:
+            return val > occupied
+    return False
+
+
+# common abbreviations used in functional groups
+group_abbreviations = {"Me": "CH3", "Et": "C2H5", "Bu": "C4H9", "Ph": "C6H5", "Bn": "C7H7",
+        "Bz": "C7H5O", "Ac": "C2H3O", "Ts": "C7H7SO2", "Bs": "C6H4BrSO2"}
+
+def group_composition(formula):
+    """ returns {element: count} of functional group formula, eg. COOH, CO(NH2)2, OAc.
+    unknown symbols (eg. R) are counted as they are """
+    stack = [Counter()]
+    for token in re.findall(r"\(|\)\d*|[A-Z][a-z]?\d*", formula):
+        if token=="(":
+            stack.append(Counter())
+            continue
+        if token[0]==")":
+            if len(stack)==1:
+                continue
+            part, count = stack.pop(), int(token[1:] or 1)
+        else:
+            symbol, count = re.match(r"([A-Z][a-z]?)(\d*)", token).groups()
+            count = int(count or 1)
+            if symbol in group_abbreviations:
+                part = group_composition(group_abbreviations[symbol])
+            else:
+                part = {symbol: 1}
+        for symbol, n in part.items():
+            stack[-1][symbol] += n*count
+    # unclosed brackets
+    while len(stack)>1:
+        stack[-2].update(stack.pop())
+    return stack[0]
+
+
+def atom_composition(atom):
+    """ returns {element: count} of an atom including its hydrogens """
+    if atom.is_group:
+        composition = group_composition(atom.symbol)
+    elif atom.isotope:
+        composition = Counter({"%i%s" % (atom.isotope, atom.symbol): 1})
+    else:
+        composition = Counter({atom.symbol: 1})
+    if atom.hydrogens:
+        composition["H"] += atom.hydrogens
+    return composition
+
+
+def _split_isotope(symbol):
+    """ "13C" -> ("C", 13) ; "C" -> ("C", None) """
+    isotope, element = re.match(r"(\d*)(.*)", symbol).groups()
+    return element, isotope and int(isotope) or None
+
+
+def composition_to_formula(composition):
+    """ returns formula text in Hill system order, i.e C, H and then others
+    alphabetically. isotopes are written in brackets, eg. C5[13C]H6 """
+    def order(symbol):
+        element, isotope = _split_isotope(symbol)
+        if "C" in composition or "13C" in composition:
+            hill = {"C":0, "H":1}.get(element, 2)
+        else:
+            hill = 2
+        return (hill, element, isotope or 0)
+    formula = ""
+    for symbol in sorted(composition, key=order):
+        count = composition[symbol]
+        if count <= 0:
+            continue
+        if symbol[0].isdigit():
+            symbol = "[%s]" % symbol
+        formula += count > 1 and "%s%i" % (symbol, count) or symbol
+    return formula
+
+
+def composition_to_weight(composition):
+    """ returns molecular weight in g/mol, mass number is used for isotopes.
+    returns None if there is unknown element (eg. R) """
+    weight = 0
+    for symbol, count in composition.items():
+        element, isotope = _split_isotope(symbol)
+        if element not in periodic_table:
+            return None
+        weight += (isotope or periodic_table[element]["weight"]) * count
+    return weight
+
+
+def atoms_match(query_atom, atom):
+    """ default atom compatibility test used in substructure search """
+    return query_atom.symbol==atom.symbol and query_atom.charge==atom.charge
+
+
+def bonds_match(query_bond, bond):
+    """ default bond compatibility test used in substructure search.
+    bonds of aromatic rings are compared as delocalized, so that aromatic
+    query matches any kekule structure, and vice versa """
+    return query_bond.molecule.aromatic_bond_orders()[query_bond] == \
+                bond.molecule.aromatic_bond_orders()[bond]
+
+
 def get_angle(a1, a2):
     """ angle between x-axis and a1-a2 line """
     a = a2.x - a1.x
@@ -527,6 +832,52 @@ def get_angle(a1, a2):
 
 
 
+class AtomGrid:
+    """ uniform grid of atom positions. cell size is about a bond length, so the
+    atoms near a point are found by checking only a few cells around it """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {} # {(i,j): set of atoms}
+        self.atom_cells = {} # {atom: (i,j)}
+
+    def update(self, atom):
+        """ adds the atom, or moves it to the cell of its current position """
+        cell = None
+        if atom.x is not None:
+            cell = int(atom.x//self.cell_size), int(atom.y//self.cell_size)
+        old_cell = self.atom_cells.get(atom)
+        if cell == old_cell:
+            return
+        if old_cell:
+            self.remove(atom)
+        if cell:
+            self.cells.setdefault(cell, set()).add(atom)
+            self.atom_cells[atom] = cell
+
+    def remove(self, atom):
+        cell = self.atom_cells.pop(atom, None)
+        if cell:
+            atoms = self.cells[cell]
+            atoms.discard(atom)
+            if not atoms:
+                del self.cells[cell]
+
+    def atoms_near(self, x, y, radius):
+        size = self.cell_size
+        i1, i2 = int((x-radius)//size), int((x+radius)//size)
+        j1, j2 = int((y-radius)//size), int((y+radius)//size)
+        radius_sq = radius*radius
+        result = []
+        for i in range(i1, i2+1):
+            for j in range(j1, j2+1):
+                for atom in self.cells.get((i,j), ()):
+                    if (atom.x-x)**2 + (atom.y-y)**2 <= radius_sq:
+                        result.append(atom)
+        return result
+
+
+
 class StereoChemistry:
     CIS_TRANS = 1
     TETRAHEDRAL = 2
@@ -35,7 +35,7 @@ class Shape(DrawableObject):
     def all_items(self):
         return filter(None, [self._main_item, self._focus_item, self._selection_item])
 
-    def bounding_box(self):
+    def calc_bounding_box(self):
         if self._main_item:
             return self.canvas.itemBoundingBox(self._main_item)
         d = self.line_width/2
@@ -45,15 +45,19 @@ class Shape(DrawableObject):
 
     def move_by(self, dx, dy):
         self.points = [(x+dx,y+dy) for x,y in self.points]
+        self.invalidate_bounding_box()
 
     def scale(self, scale):
         self.scale_val *= scale
+        self.invalidate_bounding_box()
 
     def transform(self, tr):
         self.points = tr.transform_points(self.points)
+        self.invalidate_bounding_box()
 
     def transform_3D(self, tr):
         self.points = [tr.transform(*pt,0)[:2] for pt in self.points]
+        self.invalidate_bounding_box()
 
     @property
     def menu_template(self):
@@ -305,6 +309,7 @@ class Orbital(DrawableObject):
 
     def set_pos(self, x,y):
         self.x, self.y = x, y
+        self.invalidate_bounding_box()
 
     @property
     def chemistry_items(self):
@@ -314,7 +319,7 @@ class Orbital(DrawableObject):
     def all_items(self):
         return filter(None, self._main_items + [self._focus_item, self._selection_item])
 
-    def bounding_box(self):
+    def calc_bounding_box(self):
         if self._main_items:
             bboxes = [self.canvas.itemBoundingBox(item) for item in self._main_items]
             return bbox_of_bboxes(bboxes)
@@ -448,15 +453,19 @@ class Orbital(DrawableObject):
 
     def move_by(self, dx, dy):
         self.x, self.y = self.x+dx, self.y+dy
+        self.invalidate_bounding_box()
 
     def scale(self, scale):
         self.scale_val *= scale
+        self.invalidate_bounding_box()
 
     def transform(self, tr):
         self.x, self.y = tr.transform(self.x, self.y)
+        self.invalidate_bounding_box()
 
     def transform_3D(self, tr):
         self.x, self.y, z = tr.transform(self.x, self.y, 0)
+        self.invalidate_bounding_box()
 
     @property
     def menu_template(self):
@@ -2,10 +2,12 @@
 # Copyright (C) 2003-2008 Beda Kosata <beda@zirael.org>
 # Copyright (C) 2022-2026 Arindam Chaudhuri <arindamsoft94@gmail.com>
 import os
+import time
 import math
 import operator
 from functools import reduce
 import urllib.request
+from array import array
 
 from PyQt5.QtCore import QRect, Qt, pyqtSignal
 from PyQt5.QtGui import QPixmap, QFontMetrics, QPainter
@@ -20,7 +22,8 @@ from fileformats import Ccdx, Molfile
 from widgets import FlowLayout, PixmapButton, SearchBox, wait
 from canvas import Canvas
 import geometry as geo
-from tool_helpers import place_molecule, remove_explicit_hydrogens
+from molecule import Molecule
+from tool_helpers import remove_explicit_hydrogens
 
 
 def find_template_icon(icon_name):
@@ -34,6 +37,45 @@ def find_template_icon(icon_name):
 
 
 
+class TemplateData:
+    """ coordinates and connectivity of a template stored as arrays, used for
+    placing copies of template without creating intermediate molecule.
+    coordinates are normalized, i.e average bond length is 1 and top-left is at origin """
+    def __init__(self, template):
+        self.version = (template.topology_version, template.geometry_version)
+        index = {atom:i for i,atom in enumerate(template.atoms)}
+        minx = min(atom.x for atom in template.atoms)
+        miny = min(atom.y for atom in template.atoms)
+        scale = 1/(template.average_bond_length() or 1)
+        self.xs = array("d", [(atom.x-minx)*scale for atom in template.atoms])
+        self.ys = array("d", [(atom.y-miny)*scale for atom in template.atoms])
+        self.width, self.height = max(self.xs), max(self.ys)
+        self.bonds = list(template.bonds)
+        self.bond_atoms = array("i", [index[atom] for bond in self.bonds for atom in bond.atoms])
+        self.delocalizations = [array("i", [index[a] for a in deloc.atoms]) for deloc in template.delocalizations]
+        self.template_atom = index.get(template.template_atom)
+        self.template_bond = template.template_bond and self.bonds.index(template.template_bond)
+        if self.template_atom==None or self.template_bond==None:
+            return
+        normalize = lambda x, y: ((x-minx)*scale, (y-miny)*scale)
+        # line from template atom to the place of new bond, for aligning to atom
+        atom = template.template_atom
+        if atom.neighbors:
+            x2, y2 = template.find_place(atom, geo.point_distance(atom.pos, atom.neighbors[0].pos))
+            self.atom_align_line = normalize(*atom.pos) + normalize(x2, y2)
+        # template bond line, for aligning to bond.
+        # template is attached to the side of bond where most of the atoms are
+        xt1, yt1 = normalize(*template.template_bond.atom1.pos)
+        xt2, yt2 = normalize(*template.template_bond.atom2.pos)
+        atom1, atom2 = template.template_bond.atoms
+        atms = set(atom1.neighbors + atom2.neighbors) - set([atom1,atom2])
+        points = [normalize(*a.pos) for a in atms]
+        if reduce( operator.add, [geo.line_get_side_of_point( (xt1,yt1,xt2,yt2), xy) for xy in points], 0) < 0:
+            xt1, yt1, xt2, yt2 = xt2, yt2, xt1, yt1
+        self.bond_align_line = (xt1, yt1, xt2, yt2)
+
+
+
 class TemplateManager:
     # molecule categories
     categories = ["Amino Acids", "Aromatics", "Bicyclics", "Bridged Polycyclics", "Crown Ethers", "Heterocycles", "Nucleobases", "Rings", "Sugars", "Others"]
@@ -42,6 +84,8 @@ class TemplateManager:
         # dict key is in "name index" format. eg - "cyclohexane", "cyclohexane 1".
         # index is used when two templates have same name
         self.templates = {}
+        self._template_keys = {} # {template key: title}, used to avoid duplicate templates
+        self._template_data = {} # {template: TemplateData}
         # ordered list of template names
         self.basic_templates = [] # basic set
         self.extended_templates = [] # all others except basic including user templates
@@ -85,42 +129,59 @@ class TemplateManager:
         """ adds the templates to self.templates and returns list of template titles """
         titles = []
         for mol in templates:
+            # reuse if same template is already added, e.g from another templates file
+            key = self._template_key(mol)
+            if key in self._template_keys:
+                titles.append(self._template_keys[key])
+                continue
             title = mol.name
             i = 1
             while title in self.templates:
                 title = "%s %i" % (mol.name, i)
                 i += 1
             self.templates[title] = mol
+            self._template_keys[key] = title
             titles.append(title)
         return titles
 
+    def _template_key(self, mol):
+        """ templates with same name, structure, template atom/bond and drawing
+        are duplicates. drawing is compared, as some templates are different
+        perspective views of same structure """
+        ranks = mol.canonical_ranks()
+        atoms = sorted(mol.atoms, key=ranks.__getitem__)
+        bond_len = mol.average_bond_length() or 1
+        x0, y0 = atoms[0].pos
+        drawing = tuple((round((a.x-x0)/bond_len, 1), round((a.y-y0)/bond_len, 1)) for a in atoms)
+        bond_atoms = tuple(sorted(ranks[a] for a in mol.template_bond.atoms))
+        return (mol.name, mol.canonical_hash(), ranks[mol.template_atom], bond_atoms, drawing)
+
     def add_to_extended_templates(self, templates):
         """ add new templates to extended templates list """
         titles = self.add_templates(templates)
-        self.extended_templates += titles
+        existing = set(self.basic_templates + self.extended_templates)
+        self.extended_templates += [title for title in titles if title not in existing]
         return titles
 
 
-    def get_transformed_template(self, template, coords, align_to="corner"):
-        """ transform template copy with align to atom, bond, center or corner """
-        template = template.deepcopy()
-        scale_ratio = 1
+    def get_template_data(self, template):
+        """ returns TemplateData of the template, which is created once """
+        data = self._template_data.get(template)
+        if not data or data.version != (template.topology_version, template.geometry_version):
+            data = self._template_data[template] = TemplateData(template)
+        return data
+
+    def place_template(self, template, coords, align_to="corner", mol=None):
+        """ creates a copy of template in mol, aligned to atom, bond, center or corner.
+        a new molecule is created if mol is None. returns {template atom: new atom} """
+        data = self.get_template_data(template)
         trans = geo.Transform()
 
-        if align_to in ("Atom", "Bond") and template.template_atom and template.template_bond:
+        if align_to in ("Atom", "Bond") and data.template_atom!=None and data.template_bond!=None:
             if align_to == "Bond":
-                xt1, yt1 = template.template_bond.atom1.pos
-                xt2, yt2 = template.template_bond.atom2.pos
-                #find appropriate side of bond to append template to
-                atom1, atom2 = template.template_bond.atoms
-                atms = atom1.neighbors + atom2.neighbors
-                atms = set(atms) - set([atom1,atom2])
-                points = [a.pos for a in atms]
-                if reduce( operator.add, [geo.line_get_side_of_point( (xt1,yt1,xt2,yt2), xy) for xy in points], 0) < 0:
-                    xt1, yt1, xt2, yt2 = xt2, yt2, xt1, yt1
+                xt1, yt1, xt2, yt2 = data.bond_align_line
             else:# align_to == "Atom"
-                xt1, yt1 = template.template_atom.pos
-                xt2, yt2 = template.find_place(template.template_atom, geo.point_distance(template.template_atom.pos, template.template_atom.neighbors[0].pos))
+                xt1, yt1, xt2, yt2 = data.atom_align_line
             x1, y1, x2, y2 = coords
             scale_ratio = math.sqrt( ((x1-x2)**2 + (y1-y2)**2) / ((xt1-xt2)**2 + (yt1-yt2)**2) )
             trans.translate( -xt1, -yt1)
@@ -129,28 +190,58 @@ class TemplateManager:
             trans.translate(x1, y1)
         # place center of template at given coord
         else:
-            #xt1, yt1 = template.template_atom.pos
-            #xt2, yt2 = template.template_atom.neighbors[0].pos
-            #scale_ratio = Settings.bond_length / math.sqrt( (xt1-xt2)**2 + (yt1-yt2)**2)
-            place_molecule(template)
-            bbox = template.bounding_box()
             if align_to == "center":
-                center = geo.rect_get_center(bbox)
-                trans.translate( -center[0], -center[1])
-            else:# align_to=="corner" (place top-left corner of template at given coord)
-                trans.translate( -bbox[0], -bbox[1])
-            trans.scale(scale_ratio)
+                trans.translate( -data.width/2, -data.height/2)
+            # else align_to=="corner" (place top-left corner of template at given coord)
+            trans.scale(Settings.bond_length)
             trans.translate( coords[0], coords[1])
 
-        for a in template.atoms:
-            a.x, a.y = trans.transform(a.x, a.y)
-            #a.scale_font( scale_ratio)
-        #for b in template.bonds:
-        #    if b.order != 1:
-        #        b.second_line_distance *= scale_ratio
-        # update template according to current default values
-        #App.canvas.applyDefaultProperties( [temp], template_mode=1)
-        return template
+        if mol is None:
+            mol = Molecule()
+        xs, ys = trans.transform_xy_lists(data.xs, data.ys)
+        new_atoms = []
+        for atom, x, y in zip(template.atoms, xs, ys):
+            new_atom = atom.copy()
+            new_atom.x, new_atom.y = x, y
+            mol.add_atom(new_atom)
+            new_atoms.append(new_atom)
+        with mol.batch_edit():
+            for bond, i, j in zip(data.bonds, data.bond_atoms[::2], data.bond_atoms[1::2]):
+                new_bond = bond.copy()
+                mol.add_bond(new_bond)
+                new_bond.connect_atoms(new_atoms[i], new_atoms[j])
+        for deloc, atom_indices in zip(template.delocalizations, data.delocalizations):
+            new_deloc = deloc.copy()
+            new_deloc.atoms = [new_atoms[i] for i in atom_indices]
+            new_deloc.molecule = mol
+            mol.delocalizations.append(new_deloc)
+        return dict(zip(template.atoms, new_atoms))
+
+    def get_transformed_template(self, template, coords, align_to="corner"):
+        """ returns transformed template copy, aligned to atom, bond, center or corner """
+        obj_map = self.place_template(template, coords, align_to)
+        mol = obj_map[template.atoms[0]].molecule
+        mol.name = template.name
+        if template.template_atom:
+            mol.template_atom = obj_map[template.template_atom]
+        if template.template_bond:
+            atom1, atom2 = [obj_map[a] for a in template.template_bond.atoms]
+            mol.template_bond = atom1.get_edge_leading_to(atom2)
+        return mol
+
+
+    def find_templates_with_substructure(self, query, timeout=None):
+        """ returns titles of templates which contain the query molecule.
+        search stops after timeout seconds in total """
+        deadline = timeout and time.monotonic() + timeout
+        titles = []
+        for title, mol in self.templates.items():
+            remaining = deadline and deadline - time.monotonic()
+            if deadline and remaining <= 0:
+                break
+            if mol.find_substructure(query, max_matches=1, timeout=remaining):
+                titles.append(title)
+        return titles
 
 
     def save_template(self, template_mol):
@@ -28,6 +28,7 @@ class Text(DrawableObject):
 
     def set_text(self, text):
         self.text = text
+        self.invalidate_bounding_box()
 
     @property
     def chemistry_items(self):
@@ -83,7 +84,7 @@ class Text(DrawableObject):
             self.canvas.removeItem(self._selection_item)
             self._selection_item = None
 
-    def bounding_box(self):
+    def calc_bounding_box(self):
         if self._main_item:
             return self.canvas.itemBoundingBox(self._main_item)
         d = self.font_size * self.scale_val
@@ -91,18 +92,23 @@ class Text(DrawableObject):
 
     def set_pos(self, x, y):
         self.x, self.y = x, y
+        self.invalidate_bounding_box()
 
     def move_by(self, dx, dy):
         self.x, self.y = self.x+dx, self.y+dy
+        self.invalidate_bounding_box()
 
     def scale(self, scale):
         self.scale_val *= scale
+        self.invalidate_bounding_box()
 
     def transform(self, tr):
         self.x, self.y = tr.transform(self.x, self.y)
+        self.invalidate_bounding_box()
 
     def transform_3D(self, tr):
         self.x, self.y, z = tr.transform(self.x, self.y, 0)
+        self.invalidate_bounding_box()
 
 #---------------------------- END TEXT ----------------------------------
 
@@ -180,7 +186,7 @@ class Plus(DrawableObject):
             self.canvas.removeItem(self._selection_item)
             self._selection_item = None
 
-    def bounding_box(self):
+    def calc_bounding_box(self):
         if self._main_item:
             return self.canvas.itemBoundingBox(self._main_item)
         d = self.font_size/2 * self.scale_val
@@ -188,18 +194,23 @@ class Plus(DrawableObject):
 
     def set_pos(self, x, y):
         self.x, self.y = x, y
+        self.invalidate_bounding_box()
 
     def move_by(self, dx, dy):
         self.x, self.y = self.x+dx, self.y+dy
+        self.invalidate_bounding_box()
 
     def scale(self, scale):
         self.scale_val *= scale
+        self.invalidate_bounding_box()
 
     def transform(self, tr):
         self.x, self.y = tr.transform(self.x, self.y)
+        self.invalidate_bounding_box()
 
     def transform_3D(self, tr):
         self.x, self.y, z = tr.transform(self.x, self.y, 0)
+        self.invalidate_bounding_box()
 
 #---------------------------- END PLUS ----------------------------------
 
@@ -22,6 +22,23 @@ def get_objs_with_all_children(objs):
         stack += obj.children
     return list(result)
 
+def get_objs_with_dependents(objs):
+    """ returns set of objs, their all children, and the objects whose drawing
+    depends on them, i.e bonds and delocalizations of atoms """
+    stack = list(objs)
+    result = set()
+    while len(stack):
+        obj = stack.pop()
+        if obj in result:
+            continue
+        result.add(obj)
+        stack += obj.children
+        if obj.class_name=="Atom":
+            stack += obj.bonds
+            if obj.molecule:
+                stack += [d for d in obj.molecule.delocalizations if obj in d.atoms]
+    return result
+
 
 def draw_recursively(obj):
     draw_objs_recursively([obj])
@@ -57,11 +74,20 @@ def scale_objs(objs, scale):
 
 
 
+def get_crowding_angles(atom, radius):
+    """ returns angles at which the neighbors and the non-bonded atoms
+    within radius are located around the atom """
+    atms = set(atom.neighbors)
+    if atom.molecule:
+        atms.update(atom.molecule.atoms_near(atom.x, atom.y, radius))
+    atms.discard(atom)
+    return [geo.line_get_angle_from_east([atom.x, atom.y, at.x, at.y]) for at in atms]
+
+
 def find_least_crowded_place_around_atom(atom, distance=10):
-    atms = atom.neighbors
-    if not atms:# single atom molecule
+    angles = get_crowding_angles(atom, distance)
+    if not angles:# single atom molecule
         return atom.x + distance, atom.y
-    angles = [geo.line_get_angle_from_east([atom.x, atom.y, at.x, at.y]) for at in atms]
     angles.append( 2*PI + min(angles))
     angles.sort(reverse=True)
     diffs = common.list_difference( angles)
@@ -218,11 +244,12 @@ def place_molecule( mol):
 
 def remove_explicit_hydrogens(mol):
     hydrogens = [a for a in mol.atoms if a.symbol=="H"]
-    for H in hydrogens:
-        if len(H.neighbors)==1 and H.neighbors[0].symbol in auto_hydrogen_elements:
-            b = H.neighbor_edges[0]
-            b.disconnect_atoms()
-            mol.remove_bond(b)
-            mol.remove_atom(H)
+    with mol.batch_edit():
+        for H in hydrogens:
+            if len(H.neighbors)==1 and H.neighbors[0].symbol in auto_hydrogen_elements:
+                b = H.neighbor_edges[0]
+                b.disconnect_atoms()
+                mol.remove_bond(b)
+                mol.remove_atom(H)
 
 
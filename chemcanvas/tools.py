@@ -2,6 +2,8 @@
 # This file is a part of ChemCanvas Program which is GNU GPLv3 licensed
 # Copyright (C) 2022-2026 Arindam Chaudhuri <arindamsoft94@gmail.com>
 from functools import reduce
+from collections import Counter
+from contextlib import ExitStack
 import operator
 from math import sin, cos, asin, atan2
 from math import pi as PI
@@ -11,7 +13,7 @@ from PyQt5.QtGui import QIcon
 from app_data import App, Settings
 from drawing_parents import Color, Align, PenStyle
 from tool_helpers import *
-from molecule import Molecule
+from molecule import Molecule, composition_to_formula, composition_to_weight
 from atom import Atom
 from bond import Bond
 from delocalization import Delocalization
@@ -128,9 +130,7 @@ def set_object_property(data):
     obj = data["object"]
     obj.set_property(data["key"], data["value"])
     # redraw required objects
-    obj.draw()
-    if isinstance(obj, Atom):
-        [bond.draw() for bond in obj.bonds]
+    App.canvas.mark_dirty([obj])
     App.canvas.save_state_to_undo_stack("Object Property Change")
 
 
@@ -160,7 +160,7 @@ def expand_functional_group(data):
     group_atom.eat_atom(new_mol.atoms[0])
     g = CoordsGenerator()
     g.calculate_coords(mol, bond_length=Settings.bond_length)
-    draw_recursively(mol)
+    App.canvas.mark_dirty([mol])
     App.canvas.save_state_to_undo_stack("Expand Group")
 
 
@@ -236,6 +236,10 @@ class MoveTool(SelectTool):
         self.objs_moved = False
         # self.objs_to_move = set()
         # self.objs_to_redraw = set() # Bonds need to redraw
+        # while dragging, graphics items of moving objects are grouped and
+        # the group is moved, coordinates are updated on mouse release
+        self.drag_group = None
+        self.drag_offset = (0,0)
 
     def on_mouse_press(self, x, y):
         self.reset()
@@ -260,9 +264,13 @@ class MoveTool(SelectTool):
             to_redraw |= bonds_to_redraw
             # to rearrange marks if not all neighbors are moved along
             self.redraw_on_finish = set(flatten([b.atoms for b in bonds_to_redraw]))
-            # delocalizations need to redraw if related atoms are moved
+            # delocalizations need to redraw if some of its atoms are moved
             atoms = [o for o in to_move if isinstance(o,Atom)]
-            to_redraw |= set(get_delocalizations_having_atoms(atoms))
+            for deloc in get_delocalizations_having_atoms(atoms):
+                if to_move.issuperset(deloc.atoms):
+                    to_move.add(deloc)
+                else:
+                    to_redraw.add(deloc)
         else:
             # when we try to move atom or bond, whole molecule is moved
             if isinstance(App.canvas.focused_obj.parent, Molecule):# atom or bond
@@ -280,10 +288,22 @@ class MoveTool(SelectTool):
         for o in [o for o in App.canvas.objects if isinstance(o,Arrow)]:
             tail_pos = o.points[0]  if o.e_src else None
             head_pos = o.points[-1] if o.e_dst else None
-            if tail_pos or head_pos:
-                self.anchor_dict[o] = [tail_pos, o.e_src in self.objs_to_move,
-                                       head_pos, o.e_dst in self.objs_to_move]
+            tail_moving, head_moving = o.e_src in to_move, o.e_dst in to_move
+            # arrow needs redraw if it or one of its anchors is moved
+            if (tail_pos or head_pos) and (o in to_move or tail_moving or head_moving):
+                self.anchor_dict[o] = [tail_pos, tail_moving, head_pos, head_moving]
                 self.objs_to_redraw.add(o)
+        # objects which are redrawn while dragging, and the atoms their drawing
+        # depends on, need coordinates to be updated on each mouse move
+        atoms = set()
+        for o in to_redraw:
+            if isinstance(o, Bond):
+                # side of double bond depends on neighbors and rings
+                atoms.update(o.atoms + o.atom1.neighbors + o.atom2.neighbors)
+                [atoms.update(ring) for ring in o.molecule.get_rings_of_edge(o)]
+            elif isinstance(o, Delocalization):
+                atoms.update(o.atoms)
+        self.objs_to_update = (to_move & to_redraw) | (to_move & atoms)
 
 
     def on_mouse_move(self, x, y):
@@ -293,10 +313,16 @@ class MoveTool(SelectTool):
         if not (App.canvas.dragging and self.objs_to_move):
             return
         dx, dy = x-self._prev_pos[0], y-self._prev_pos[1]
-        for obj in self.objs_to_move:
+        if not self.drag_group:
+            items = flatten([o.all_items for o in self.objs_to_move - self.objs_to_redraw])
+            self.drag_group = App.canvas.createItemGroup(items)
+            # focusing a moving object would draw focus at its old position
+            self.do_not_focus = self.objs_to_move - App.canvas.do_not_focus
+            App.canvas.do_not_focus |= self.do_not_focus
+        self.drag_offset = (self.drag_offset[0]+dx, self.drag_offset[1]+dy)
+        self.drag_group.setPos(*self.drag_offset)
+        for obj in self.objs_to_update:
             obj.move_by(dx, dy)
-        for obj in self.objs_to_move - self.objs_to_redraw:
-            App.canvas.moveItemsBy(obj.all_items, dx, dy)
 
         for o,vals in self.anchor_dict.items():
             tail_pos, tail_moving, head_pos, head_moving = vals
@@ -311,7 +337,7 @@ class MoveTool(SelectTool):
                 self.anchor_dict[o][2] = head_pos
                 o.points[-1] = head_pos
 
-        [obj.draw() for obj in self.objs_to_redraw]
+        App.canvas.mark_dirty(self.objs_to_redraw)
         self.objs_moved = True
         self._prev_pos = [x,y]
 
@@ -320,15 +346,19 @@ class MoveTool(SelectTool):
         # if not moving objects
         if self.drag_to_select or not App.canvas.dragging:
             SelectTool.on_mouse_release(self, x, y)
-            if App.canvas.selected_objs:
-                self.show_status(self.tips["on_select"])
-            else:
-                self.clear_status()
+            self.show_selection_status()
             return
+        if self.drag_group:
+            App.canvas.destroyItemGroup(self.drag_group)
+            App.canvas.do_not_focus -= self.do_not_focus
+            for obj in self.objs_to_move - self.objs_to_update:
+                obj.move_by(*self.drag_offset)
+            self.drag_group = None
         if self.objs_moved:
             # marks position on atoms need to be updated
             [o.draw() for o in self.redraw_on_finish]
-            for arrow in [o for o in self.anchor_dict if o.e_src in self.redraw_on_finish]:
+            arrows = [o for o in App.canvas.objects if isinstance(o,Arrow)]
+            for arrow in [o for o in arrows if o.e_src in self.redraw_on_finish]:
                 arrow.adjust_anchored_points()
                 arrow.draw()
             App.canvas.save_state_to_undo_stack("Move Object(s)")
@@ -352,8 +382,21 @@ class MoveTool(SelectTool):
             elif value=="Convert to Aromatic Form":
                 self.convert_to_aromatic_form()
 
+    def show_selection_status(self):
+        """ shows formula and weight of selected atoms, or clears status if
+        nothing is selected """
+        if App.canvas.selected_objs:
+            formula = get_formula_and_weight_text(App.canvas.selected_objs)
+            tip = self.tips["on_select"]
+            self.show_status(formula and "%s ; %s" % (formula, tip) or tip)
+        else:
+            self.clear_status()
+
     def delete_selected(self):
-        delete_objects(App.canvas.selected_objs)# it has every object types, except Molecule
+        objs = App.canvas.selected_objs# it has every object types, except Molecule
+        App.canvas.deselectAll()
+        delete_objects(objs)
+        self.show_selection_status()
         App.canvas.save_state_to_undo_stack("Delete Selected")
         # if there is no object left on canvas, nothing to do with MoveTool
         if len(App.canvas.objects)==0:
@@ -371,8 +414,7 @@ class MoveTool(SelectTool):
         bbox = bbox_of_bboxes(bboxes)
         x, y = App.canvas.find_place_for_obj_size(bbox[2]-bbox[0], bbox[3]-bbox[1])
         move_objs(objs, x-bbox[0], y-bbox[1])
-        draw_objs_recursively(objs)
-        App.canvas.redraw_dirty_objects()
+        App.canvas.mark_dirty(objs)
         App.canvas.save_state_to_undo_stack("Duplicate Selected")
 
 
@@ -381,7 +423,16 @@ class MoveTool(SelectTool):
         if not mols:
             mols = set(o for o in App.canvas.objects if isinstance(o,Molecule))
         aromaticity_found = False
+        bonds_localized = False
+        failed_atoms = []
         for mol in mols:
+            # delocalized bonds are localized first, so that they are either
+            # included in delocalization rings or drawn as kekule structure
+            localized = [b for b in mol.bonds if b.type=="delocalized"]
+            if localized and not mol.delocalizations:
+                failed_atoms += mol.localize_aromatic_bonds()
+                [b.mark_dirty() for b in localized]
+                bonds_localized = True
             aromatic_rings = find_aromatic_rings_in_molecule(mol)
             for ring in aromatic_rings:
                 mol.add_delocalization(Delocalization(ring+[ring[0]]))
@@ -389,14 +440,37 @@ class MoveTool(SelectTool):
                 aromaticity_found = True
                 mol.mark_dirty()
 
-        if aromaticity_found:
+        if aromaticity_found or bonds_localized:
             App.canvas.redraw_dirty_objects()
             App.canvas.save_state_to_undo_stack("Convert To Aromatic")
         else:
             self.show_status("Aromaticity detection done")
+        if failed_atoms:
+            [App.canvas.selectObject(atom) for atom in failed_atoms]
+            self.show_status("Error ! Could not localize aromatic bonds of selected atoms")
 
     def clear(self):
         SelectTool.clear(self)
+        self.show_selection_status()
+
+
+def get_formula_and_weight_text(objects):
+    """ returns formula and weight text of selected atoms, eg. "C6H6 (78.11 g/mol)"
+    returns empty string if there is no atom """
+    mol_atoms = {}
+    for obj in objects:
+        if isinstance(obj, Atom):
+            mol_atoms.setdefault(obj.molecule, []).append(obj)
+    if not mol_atoms:
+        return ""
+    composition = Counter()
+    for mol, atoms in mol_atoms.items():
+        composition.update(mol.get_composition(atoms))
+    formula = composition_to_formula(composition)
+    weight = composition_to_weight(composition)
+    if weight is None:
+        return formula
+    return "%s (%.2f g/mol)" % (formula, weight)
 
 
 def delete_objects(objects):
@@ -431,12 +505,15 @@ def delete_objects(objects):
             if set(deloc.bonds) & bonds:
                 mol.destroy_delocalization(deloc)
                 to_redraw |= (set(deloc.bonds) - bonds)
-    # first delete bonds
-    while bonds:
-        bond = bonds.pop()
-        bond.disconnect_atoms()
-        bond.molecule.remove_bond(bond)
-        bond.delete_from_canvas()
+    # first delete bonds, valency of atoms is updated once per atom
+    with ExitStack() as stack:
+        for mol in modified_molecules:
+            stack.enter_context(mol.batch_edit())
+        while bonds:
+            bond = bonds.pop()
+            bond.disconnect_atoms()
+            bond.molecule.remove_bond(bond)
+            bond.delete_from_canvas()
     # then delete atoms
     while atoms:
         atom = atoms.pop()
@@ -452,12 +529,12 @@ def delete_objects(objects):
             for child in mol.children:
                 child.delete_from_canvas()
             mol.canvas.removeObject(mol)
-        else:
+        elif mol.component_count > 1:
             new_mols = mol.split_fragments()
             # delete lone atoms
             [modified_molecules.add(mol) for mol in new_mols if len(mol.bonds)==0]
 
-    draw_objs_recursively(to_redraw)
+    App.canvas.mark_dirty(to_redraw)
 
 
 def duplicate_objects(objects):
@@ -485,11 +562,14 @@ def duplicate_objects(objects):
         obj_map[atom.molecule.id].add_atom(new_atom)
         obj_map[atom.id] = new_atom
     # copy bonds
-    for bond in bonds:
-        new_bond = bond.copy()
-        obj_map[bond.molecule.id].add_bond(new_bond)
-        new_bond.connect_atoms(obj_map[bond.atom1.id], obj_map[bond.atom2.id])
-        obj_map[bond.id] = new_bond
+    with ExitStack() as stack:
+        for new_mol in new_mols:
+            stack.enter_context(new_mol.batch_edit())
+        for bond in bonds:
+            new_bond = bond.copy()
+            obj_map[bond.molecule.id].add_bond(new_bond)
+            new_bond.connect_atoms(obj_map[bond.atom1.id], obj_map[bond.atom2.id])
+            obj_map[bond.id] = new_bond
 
     # copy delocalizations
     delocalized_bonds = set()# that are being copied
@@ -586,6 +666,7 @@ class RotateTool(SelectTool):
             for i, atom in enumerate(self.mol_to_rotate.atoms):
                 ax, ay, az = self.initial_positions[i]
                 atom.x, atom.y = tr.transform(ax, ay)
+                atom.on_geometry_change()
 
         else: # 3D
             dx = x - self.mouse_press_pos[0]
@@ -602,9 +683,10 @@ class RotateTool(SelectTool):
             # Rotate atoms
             for i, atom in enumerate(self.mol_to_rotate.atoms):
                 atom.x, atom.y, atom.z = tr.transform(*self.initial_positions[i])
+                atom.on_geometry_change()
 
         # redraw whole molecule recursively
-        draw_recursively(self.mol_to_rotate)
+        App.canvas.mark_dirty([self.mol_to_rotate])
 
     def on_mouse_release(self, x, y):
         SelectTool.on_mouse_release(self, x ,y)
@@ -707,8 +789,7 @@ class ScaleTool(SelectTool):
             self.restore_position_and_size(obj)
             obj.transform(tr)
             obj.scale(scale)
-        objs = sorted(self.objs_to_scale, key=lambda obj : obj.redraw_priority)
-        [obj.draw() for obj in objs]
+        App.canvas.mark_dirty(self.objs_to_scale)
         self.bbox_items = [App.canvas.addRect(scaled_bbox, color=Color.blue)]
 
 
@@ -788,7 +869,7 @@ class AlignTool(Tool):
             elif isinstance(o,Bond):
                 if o.auto_second_line_side:
                     o.second_line_side = None
-        draw_recursively(mol)
+        App.canvas.mark_dirty([mol])
         App.canvas.save_state_to_undo_stack("Transform : %s" % toolsettings['mode'])
 
 
@@ -852,13 +933,10 @@ class AlignTool(Tool):
 
     def _apply_freerotation( self, coords, mol):
         b = self.focused
-        a1, a2 = b.atoms
-        b.disconnect_atoms()
-        cc = list( mol.get_connected_components())
-        b.connect_atoms(a1, a2)
-        if len( cc) == 1:
+        if not mol.is_edge_a_bridge(b):
             print("Bond is part of a ring, there is no possiblity for rotation!")
             return
+        cc = mol.get_pieces_after_edge_removal(b)
         to_rotate = list( len( cc[0]) < len( cc[1]) and cc[0] or cc[1])
         to_rotate += [b for b in mol.bonds if b.atom1 in to_rotate and b.atom2 in to_rotate]
         tr = self._get_mirror_transformation(coords)
@@ -1031,20 +1109,17 @@ class AtomTool(Tool):
             if toolsettings['mode']=='atom':# for functional group use default single bond
                 self.bond.set_type(toolsettings['bond_type'])
             self.bond.connect_atoms(self.atom1, self.atom2)
+            redraw = [self.atom2]
             if self.atom1.redraw_needed():# because, hydrogens may be changed
-                self.atom1.draw()
-                [bond.draw() for bond in self.atom1.bonds]# atoms visibility change
-
-            self.atom2.draw()
-            self.bond.draw()
+                redraw.append(self.atom1)# atoms visibility change, so bonds too
+            App.canvas.mark_dirty(redraw)
             App.canvas.do_not_focus.add(self.atom2)
         else: # move atom2
             if type(App.canvas.focused_obj) is Atom and App.canvas.focused_obj is not self.atom1:
                 self.atom2.set_pos(*App.canvas.focused_obj.pos)
             else:
                 self.atom2.set_pos(*atom2_pos)
-            self.atom2.draw()
-            [bond.draw() for bond in self.atom2.bonds]
+            App.canvas.mark_dirty([self.atom2])
 
         self.show_tip("moving_bond")
 
@@ -1275,18 +1350,21 @@ class TemplateTool(Tool):
                 else:
                     x2, y2 = focused.molecule.find_place(focused, Settings.bond_length)
                     x2, y2 = (2*x1 - x2), (2*y1 - y2)# to opposite side of x1, y1
-                t = App.template_manager.get_transformed_template(template, [x1,y1,x2,y2], "Atom")
-                focused.eat_atom(t.template_atom)
+                with focused.molecule.batch_edit():
+                    obj_map = App.template_manager.place_template(template, [x1,y1,x2,y2], "Atom", focused.molecule)
+                    new_atoms = list(obj_map.values())
+                    focused.eat_atom(obj_map[template.template_atom])
+                    focused.molecule.handle_overlap(new_atoms)
             else: # connect template-atom and focused atom with bond
                 x1, y1 = focused.molecule.find_place(focused, Settings.bond_length)
                 x2, y2 = focused.pos
-                t = App.template_manager.get_transformed_template(template, [x1,y1,x2,y2], "Atom")
-                t_atom = t.template_atom
-                focused.molecule.eat_molecule(t)
-                bond = focused.molecule.new_bond()
-                bond.connect_atoms(focused, t_atom)
-            focused.molecule.handle_overlap()
-            draw_recursively(focused.molecule)
+                with focused.molecule.batch_edit():
+                    obj_map = App.template_manager.place_template(template, [x1,y1,x2,y2], "Atom", focused.molecule)
+                    new_atoms = list(obj_map.values())
+                    bond = focused.molecule.new_bond()
+                    bond.connect_atoms(focused, obj_map[template.template_atom])
+                    focused.molecule.handle_overlap(new_atoms)
+            App.canvas.mark_dirty([focused.molecule])
         elif isinstance(focused, Bond) and template.template_bond:
             x1, y1 = focused.atom1.pos
             x2, y2 = focused.atom2.pos
@@ -1297,10 +1375,10 @@ class TemplateTool(Tool):
             # so if most atoms are at the left side, switch start and end point
             if reduce( operator.add, [geo.line_get_side_of_point( (x1,y1,x2,y2), xy) for xy in coords], 0) > 0:
                 x1, y1, x2, y2 = x2, y2, x1, y1
-            t = App.template_manager.get_transformed_template(template, (x1,y1,x2,y2), "Bond")
-            focused.molecule.eat_molecule(t)
-            focused.molecule.handle_overlap()
-            draw_recursively(focused.molecule)
+            with focused.molecule.batch_edit():
+                obj_map = App.template_manager.place_template(template, (x1,y1,x2,y2), "Bond", focused.molecule)
+                focused.molecule.handle_overlap(obj_map.values())
+            App.canvas.mark_dirty([focused.molecule])
         else:
             # when we try to click over atom or bond but mouse got accidentally
             # unfocued. we should prevent placing template too close.
@@ -1311,7 +1389,7 @@ class TemplateTool(Tool):
                 return
             t = App.template_manager.get_transformed_template(template, [x,y], "center")
             App.canvas.addObject(t)
-            draw_recursively(t)
+            App.canvas.mark_dirty([t])
             t.template_atom = None
             t.template_bond = None
         App.canvas.save_state_to_undo_stack("add template : %s"% template.name)
@@ -1373,7 +1451,7 @@ class ChainTool(Tool):
             mol = create_carbon_chain_from_coordinates(self.coords, self.start_atom)
             if not self.start_atom:# if start_atom, molecule already exists on canvas
                 App.canvas.addObject(mol)
-            draw_recursively(mol)
+            App.canvas.mark_dirty([mol])
             self.coords = []
             App.canvas.save_state_to_undo_stack("Chain Added")
 
@@ -1396,12 +1474,13 @@ def create_carbon_chain_from_coordinates(coords, start_atom=None):
         last_atom = mol.new_atom()
         last_atom.set_pos(*start_pos)
 
-    for pt in coords:
-        atom = mol.new_atom()
-        atom.set_pos(*pt)
-        bond = mol.new_bond()
-        bond.connect_atoms(last_atom, atom)
-        last_atom = atom
+    with mol.batch_edit():
+        for pt in coords:
+            atom = mol.new_atom()
+            atom.set_pos(*pt)
+            bond = mol.new_bond()
+            bond.connect_atoms(last_atom, atom)
+            last_atom = atom
     return mol
 
 
@@ -1479,12 +1558,13 @@ class RingTool(Tool):
         if self.coords:
             mol = create_cyclic_molecule_from_coordinates(self.coords)
             App.canvas.addObject(mol)
-            draw_recursively(mol)
             if self.attach_to:
+                new_atoms = mol.atoms[:]
                 self.attach_to.molecule.eat_molecule(mol)
-                self.attach_to.molecule.handle_overlap()
-                draw_recursively(self.attach_to.molecule)
+                self.attach_to.molecule.handle_overlap(new_atoms)
+                mol = self.attach_to.molecule
                 self.attach_to = None
+            App.canvas.mark_dirty([mol])
             self.coords = []
             App.canvas.save_state_to_undo_stack("Ring Added")
 
@@ -1498,15 +1578,16 @@ class RingTool(Tool):
 def create_cyclic_molecule_from_coordinates(coords):
     mol = Molecule()
     atoms = []
-    for pt in coords:
-        atom = mol.new_atom()
-        atom.set_pos(*pt)
-        if atoms:
-            bond = mol.new_bond()
-            bond.connect_atoms(atoms[-1], atom)
-        atoms.append(atom)
-    bond = mol.new_bond()
-    bond.connect_atoms(atoms[-1], atoms[0])# to form a ring
+    with mol.batch_edit():
+        for pt in coords:
+            atom = mol.new_atom()
+            atom.set_pos(*pt)
+            if atoms:
+                bond = mol.new_bond()
+                bond.connect_atoms(atoms[-1], atom)
+            atoms.append(atom)
+        bond = mol.new_bond()
+        bond.connect_atoms(atoms[-1], atoms[0])# to form a ring
     return mol
 
 
@@ -2033,7 +2114,7 @@ class ColorTool(SelectTool):
 def set_objects_color(objs, color):
     for obj in objs:
         obj.color = color
-    draw_objs_recursively(objs)
+    App.canvas.mark_dirty(objs)
 
 
 # ---------------------------- END COLOR TOOL ---------------------------
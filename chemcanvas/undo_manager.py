@@ -114,7 +114,7 @@ class CanvasState:
             for a in o.meta__undo_properties:
                 rec[a] = getattr(o, a)
             for a in o.meta__undo_copy:
-                rec[a] = copy.copy(o.__dict__[a])
+                rec[a] = copy.copy(getattr(o, a))
             self.records.append(rec)
 
     def clean(self):
@@ -153,16 +153,28 @@ class CanvasState:
                     setattr( o, a, self.records[i][a])
                     changed = 1
             for a in o.meta__undo_copy:
-                if self.records[i][a] != o.__dict__[a]:
-                    o.__dict__[a] = copy.copy( self.records[i][a])
+                if self.records[i][a] != getattr(o, a):
+                    setattr( o, a, copy.copy( self.records[i][a]))
                     changed = 1
 
             if changed:
                 # e.g - vertices and atoms in Molecule points to same list object
                 for a1, a2 in o.meta__same_objects.items():
-                    o.__dict__[a1] = o.__dict__[a2]
+                    setattr( o, a1, getattr(o, a2))
                 changed_objs.add(o)
 
+        # connectivity and coordinates may be changed, so cached graph data,
+        # rings, fragments and memoized results of molecules are invalid
+        for o in changed_objs:
+            if o.class_name == 'Molecule':
+                o.clear_cache()
+                o.invalidate_topology_stores()
+                o.geometry_version += 1
+            elif o.class_name in ('Atom', 'Bond') and o.molecule:
+                o.molecule.clear_cache()
+                o.molecule.invalidate_topology_stores()
+                o.molecule.geometry_version += 1
+
         # check which objects need to redraw
         to_redraw = changed_objs.copy()
         for o in changed_objs:
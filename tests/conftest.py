@@ -0,0 +1,5 @@
+import os, sys
+
+# modules of chemcanvas import each other by plain module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "chemcanvas"))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
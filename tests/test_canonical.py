@@ -0,0 +1,41 @@
+import random
+
+import pytest
+
+from fileformat_smiles import Smiles
+
+
+C60 = ("C12=C3C4=C5C6=C1C7=C8C9=C1C%10=C%11C(=C29)C3=C2C3=C4C4=C5C5=C9C6=C7C6=C7C8=C1C1=C8C%10=C%10C%11"
+       "=C2C2=C3C3=C4C4=C5C5=C%11C%12=C(C6=C95)C7=C1C1=C%12C5=C%11C4=C3C3=C5C(=C81)C%10=C23")
+
+
+def shuffle_atoms(mol, rng):
+    """ changes the order of atoms and of neighbors of each atom """
+    rng.shuffle(mol.atoms)
+    for atom in mol.atoms:
+        items = list(atom._neighbors.items())
+        rng.shuffle(items)
+        atom._neighbors = dict(items)
+    mol.clear_cache()
+
+
+@pytest.mark.parametrize("smiles", [
+    C60,
+    "C12C3C4C5C1C6C7C2C3C4C5C67",
+    "C12C3C4C1C5C2C3C45",
+    "CC(C)(C)c1cc(C(C)(C)C)cc(C(C)(C)C)c1",
+    "OC(=O)C(N)Cc1c[nH]c2ccccc12",
+])
+def test_canonical_hash_independent_of_atom_order(smiles):
+    rng = random.Random(1)
+    mol = Smiles().get_molecule(smiles)
+    expected = mol.canonical_hash()
+    for i in range(6):
+        shuffle_atoms(mol, rng)
+        assert mol.canonical_hash() == expected
+
+
+def test_canonical_hash_same_for_kekule_structures():
+    h1 = Smiles().get_molecule("OC1=C(N)C=CC=C1").canonical_hash()
+    h2 = Smiles().get_molecule("OC1=CC=CC=C1N").canonical_hash()
+    assert h1 == h2
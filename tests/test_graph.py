@@ -0,0 +1,153 @@
+import random
+
+import pytest
+
+from bond import Bond
+from fileformat_smiles import Smiles
+from graph import Graph, RingStore, maximum_matching
+
+
+def ring_sizes(cycles):
+    return sorted(map(len, cycles))
+
+
+def check_ring_store(mol, legacy=False):
+    """ compares the incrementally updated ring store with the one perceived from scratch """
+    store = mol.get_ring_store()
+    for cycle in store.cycles:
+        assert cycle <= mol.bonds
+        # each atom of a ring has exactly two of its bonds in the ring
+        degrees = {}
+        for bond in cycle:
+            for atom in bond.atoms:
+                degrees[atom] = degrees.get(atom, 0) + 1
+        assert set(degrees.values()) == {2}
+    sizes = ring_sizes(store.cycles)
+    assert sizes == ring_sizes(RingStore(mol).cycles)
+    if legacy:
+        assert sizes == ring_sizes(mol._get_smallest_independent_cycles_e_legacy())
+
+
+def remove_bond(mol, bond):
+    bond.disconnect_atoms()
+    mol.remove_bond(bond)
+
+
+def connect(mol, atom1, atom2):
+    bond = Bond()
+    mol.add_bond(bond)
+    bond.connect_atoms(atom1, atom2)
+
+
+def ring_bonds(mol):
+    """ bonds which can be removed without disconnecting the molecule, in a stable order """
+    bonds = [b for b in mol.bonds if b not in mol.get_bridges()]
+    return sorted(bonds, key=lambda b: sorted(map(mol.atoms.index, b.atoms)))
+
+
+RING_SYSTEMS = [
+    "c1ccc2cc3ccccc3cc2c1",# anthracene
+    "c1ccc2c(c1)ccc1ccccc12",# phenanthrene
+    "c1cc2ccc3cccc4ccc(c1)c2c34",# pyrene
+    "CC12CCC3C(CCC4CC(O)CCC34C)C1CCC2O",# steroid
+    "C1CC2CCC1C2",# norbornane
+    "C1CC2CCC1CC2",# bicyclo[2.2.2]octane
+    "C1C2CC3CC1CC(C2)C3",# adamantane
+    "C12C3C4C1C5C2C3C45",# cubane
+]
+
+
+@pytest.mark.parametrize("smiles", RING_SYSTEMS)
+def test_ring_store_follows_bond_edits(smiles):
+    rng = random.Random(4)
+    mol = Smiles().get_molecule(smiles)
+    check_ring_store(mol)
+    for i in range(40):
+        bonds = ring_bonds(mol)
+        if bonds and rng.random() < 0.5:
+            remove_bond(mol, rng.choice(bonds))
+        else:
+            atom1, atom2 = rng.sample(mol.atoms, 2)
+            if atom2 in atom1.neighbors:
+                continue
+            connect(mol, atom1, atom2)
+        check_ring_store(mol)
+
+
+@pytest.mark.parametrize("smiles", RING_SYSTEMS)
+def test_ring_store_matches_legacy_engine(smiles):
+    # legacy engine is reliable only on connected subgraphs of real ring systems,
+    # so only original bonds are removed and added back
+    rng = random.Random(5)
+    mol = Smiles().get_molecule(smiles)
+    removed = []
+    check_ring_store(mol, legacy=True)
+    for i in range(40):
+        bonds = ring_bonds(mol)
+        if bonds and (not removed or rng.random() < 0.5):
+            bond = rng.choice(bonds)
+            removed.append(tuple(bond.atoms))
+            remove_bond(mol, bond)
+        elif removed:
+            connect(mol, *removed.pop(rng.randrange(len(removed))))
+        check_ring_store(mol, legacy=True)
+
+
+def random_graph(rng, n, m):
+    g = Graph()
+    vertices = [g.add_vertex() for i in range(n)]
+    pairs = [(i, j) for i in range(n) for j in range(i+1, n)]
+    for i, j in rng.sample(pairs, min(m, len(pairs))):
+        g.add_edge(vertices[i], vertices[j])
+    return g
+
+
+def is_connected_without(g, v1, v2, edge):
+    seen = {v1}
+    to_go = [v1]
+    while to_go:
+        v = to_go.pop()
+        for e, n in v._neighbors.items():
+            if e is not edge and n not in seen:
+                seen.add(n)
+                to_go.append(n)
+    return v2 in seen
+
+
+def test_bridges_match_brute_force():
+    rng = random.Random(2)
+    for i in range(300):
+        n = rng.randint(2, 12)
+        g = random_graph(rng, n, rng.randint(1, 2*n))
+        expected = set(e for e in g.edges if not is_connected_without(g, *e.vertices, e))
+        assert g.get_bridges() == expected
+
+
+def brute_force_matching_size(neighbors, matched=()):
+    unmatched = [v for v in range(len(neighbors)) if v not in matched]
+    if not unmatched:
+        return 0
+    v = unmatched[0]
+    # either v remains unmatched, or it is matched with one of its free neighbors
+    best = brute_force_matching_size(neighbors, matched + (v,))
+    for u in neighbors[v]:
+        if u not in matched:
+            best = max(best, 1 + brute_force_matching_size(neighbors, matched + (v, u)))
+    return best
+
+
+def test_maximum_matching_size_matches_brute_force():
+    rng = random.Random(3)
+    for i in range(300):
+        n = rng.randint(1, 10)
+        neighbors = [[] for v in range(n)]
+        pairs = [(v, u) for v in range(n) for u in range(v+1, n)]
+        for v, u in rng.sample(pairs, rng.randint(0, len(pairs))):
+            neighbors[v].append(u)
+            neighbors[u].append(v)
+        match = maximum_matching(neighbors)
+        for v, u in enumerate(match):
+            if u != -1:
+                assert u in neighbors[v] and match[u] == v
+        size = len([u for u in match if u != -1])//2
+        assert size == brute_force_matching_size(neighbors)
@@ -0,0 +1,25 @@
+from collections import Counter
+
+from fileformat_smiles import Smiles
+
+
+def test_composition_read_during_batch_edit():
+    mol = Smiles().get_molecule("C1CCCCCCCCCCCCCCCCC1")
+    bonds = list(mol.bonds)[:5]
+    with mol.batch_edit():
+        for bond in bonds:
+            mol.remove_bond(bond)
+            bond.disconnect_atoms()
+            mol.composition
+    hydrogens = sum(atom.hydrogens for atom in mol.atoms)
+    assert hydrogens == 46
+    assert mol.composition == Counter({"C": 18, "H": hydrogens})
+
+
+def test_moving_atoms_keeps_composition():
+    mol = Smiles().get_molecule("CCO")
+    composition = mol.composition
+    for i, atom in enumerate(mol.atoms):
+        atom.set_pos(10*i, 5)
+    assert not mol._composition_dirty_atoms
+    assert mol.composition == composition
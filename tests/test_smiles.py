@@ -0,0 +1,12 @@
+from fileformat_smiles import Smiles
+
+
+def double_bonds(mol):
+    return sorted(tuple(sorted(mol.atoms.index(a) for a in b.atoms))
+                        for b in mol.bonds if b.order==2)
+
+
+def test_same_kekule_structure_on_every_read():
+    # molecules are kept alive, so that new ones get different hash values
+    mols = [Smiles().get_molecule("c1cc2ccc3cccc4ccc(c1)c2c34") for i in range(10)]
+    assert len(set(tuple(double_bonds(mol)) for mol in mols)) == 1
@@ -0,0 +1,18 @@
+from fileformat_smiles import Smiles
+
+
+def count_matches(query, smiles):
+    mol = Smiles().get_molecule(smiles)
+    return len(mol.find_substructure(Smiles().get_molecule(query)))
+
+
+def test_aromatic_query_matches_any_kekule_structure():
+    assert count_matches("Oc1ccccc1N", "Oc1ccccc1N") == 1
+    assert count_matches("Oc1ccccc1N", "OC1=C(N)C=CC=C1") == 1
+    assert count_matches("OC1=C(N)C=CC=C1", "Oc1ccccc1N") == 1
+    assert count_matches("c1ccc2ccccc2c1", "C1=CC=C2C=CC=CC2=C1") == 1
+
+
+def test_aromatic_query_does_not_match_non_aromatic_ring():
+    assert count_matches("c1ccccc1", "C1=CCCC=C1") == 0
+    assert count_matches("C1=CCCC=C1", "c1ccccc1") == 0